@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pos_app.middleware.RequestContextMiddleware',
+    'pos_app.middleware.JSONGZipMiddleware',
+    'pos_app.middleware.RequestDecompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -54,6 +57,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pos_app.middleware.TenantMiddleware',
+    'pos_app.middleware.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,15 +84,33 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'django_pos.wsgi.application'
 
-# Database
+# Database. Connections stay open between requests for DATABASE_CONN_MAX_AGE
+# seconds and are pinged before reuse (DATABASE_CONN_HEALTH_CHECKS).
+# DATABASE_POOL=True hands them out from a per-process pool instead
+# (pos_app.db_pool): a process holds at most DATABASE_POOL_MAX_SIZE
+# connections, so gunicorn workers x DATABASE_POOL_MAX_SIZE has to stay below
+# MySQL's max_connections. A request that finds every connection in use waits
+# DATABASE_POOL_TIMEOUT seconds, and connections are closed after
+# DATABASE_POOL_RECYCLE seconds, which has to be below MySQL's wait_timeout.
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'False').lower() == 'true'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'pos_app.db_pool' if DATABASE_POOL else 'django.db.backends.mysql',
         'NAME': os.getenv('DATABASE_NAME', 'hyperpos_local'),
         'USER': os.getenv('DATABASE_USER', 'root'),
         'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
         'HOST': os.getenv('DATABASE_HOST', 'localhost'),
         'PORT': os.getenv('DATABASE_PORT', '3306'),
+        # Pooled connections go back to the pool at the end of each request
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'True').lower() == 'true',
+        'POOL': {
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', '10')),
+            'recycle': int(os.getenv('DATABASE_POOL_RECYCLE', '1800')),
+            'stats_interval': int(os.getenv('DATABASE_POOL_STATS_INTERVAL', '60')),
+        },
         'OPTIONS': {
             'charset': 'utf8mb4',
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
@@ -95,6 +118,22 @@ DATABASES = {
     }
 }
 
+# Read replica for reports and exports (pos_app.routers). A client that has
+# just written reads from the primary for REPLICA_PIN_SECONDS.
+if os.getenv('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DATABASE_REPLICA_HOST'),
+        'PORT': os.getenv('DATABASE_REPLICA_PORT', DATABASES['default']['PORT']),
+        'USER': os.getenv('DATABASE_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DATABASE_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+        'POOL': dict(DATABASES['default']['POOL']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['pos_app.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -202,4 +241,78 @@ if not DEBUG:
 # Login URLs
 LOGIN_URL = '/pos/login/'
 LOGIN_REDIRECT_URL = '/pos/dashboard/'
-LOGOUT_REDIRECT_URL = '/pos/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/pos/login/'
+
+# Cache (per-business price/VAT tables and similar). Point CACHE_BACKEND at
+# django.core.cache.backends.redis.RedisCache to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'hyperpos'),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', '300')),
+    }
+}
+
+# Sessions and flash messages. The default keeps sessions in the
+# django_session table; SESSION_ENGINE=django.contrib.sessions.backends.cached_db
+# reads them from the cache and only writes through to the table, and
+# ...backends.cache keeps them in the cache alone (logins are lost when it is
+# flushed). Both need a CACHE_BACKEND shared by all workers. Messages travel
+# in a cookie, so showing one does not touch the session. Expired database
+# sessions are removed with the purge_sessions command.
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+SESSION_CACHE_ALIAS = 'default'
+MESSAGE_STORAGE = os.getenv('MESSAGE_STORAGE', 'django.contrib.messages.storage.cookie.CookieStorage')
+
+# Invoice, credit note and debt payment numbers each worker reserves at a time
+DOCUMENT_SEQUENCE_BLOCK_SIZE = int(os.getenv('DOCUMENT_SEQUENCE_BLOCK_SIZE', '50'))
+
+# Country code assumed for customer phone numbers typed without one
+DEFAULT_PHONE_COUNTRY_CODE = os.getenv('DEFAULT_PHONE_COUNTRY_CODE', '254')
+
+# Days deleted products are remembered for terminals syncing the catalog;
+# a terminal whose last sync is older downloads the full catalog again
+CATALOG_TOMBSTONE_DAYS = int(os.getenv('CATALOG_TOMBSTONE_DAYS', '30'))
+
+# Post-commit work (inventory ledger, product popularity) runs on this many
+# threads per worker; DEFERRED_TASKS_SYNC=True runs it inline instead.
+DEFERRED_TASK_WORKERS = int(os.getenv('DEFERRED_TASK_WORKERS', '2'))
+DEFERRED_TASK_QUEUE_SIZE = int(os.getenv('DEFERRED_TASK_QUEUE_SIZE', '1000'))
+DEFERRED_TASKS_SYNC = os.getenv('DEFERRED_TASKS_SYNC', 'False').lower() == 'true'
+
+# Logging: one JSON object per line (LOG_FORMAT=text for local development).
+# LOG_LEVELS sets per-logger levels, e.g. "pos_app.checkout=DEBUG,pos_app.tasks=WARNING".
+# LOG_TRACE_SAMPLE_RATE is the fraction of requests whose verbose checkout
+# trace (the pos_app.trace logger) is kept.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_TRACE_SAMPLE_RATE = float(os.getenv('LOG_TRACE_SAMPLE_RATE', '0'))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', '1000'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'pos_app.log.ContextFilter'},
+        'trace_sampler': {'()': 'pos_app.log.TraceSampler', 'rate': LOG_TRACE_SAMPLE_RATE},
+    },
+    'formatters': {
+        'json': {'()': 'pos_app.log.JSONFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['request_context'],
+            'formatter': LOG_FORMAT,
+        },
+    },
+    'loggers': {
+        'pos_app': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+        'pos_app.trace': {'level': 'DEBUG', 'filters': ['trace_sampler']},
+    },
+}
+
+for _entry in filter(None, os.getenv('LOG_LEVELS', '').split(',')):
+    _name, _level = _entry.split('=', 1)
+    LOGGING['loggers'].setdefault(_name.strip(), {})['level'] = _level.strip().upper()
@@ -1,12 +1,22 @@
 # pos_project/urls.py
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.decorators.cache import cache_control
+from django.views.static import serve
 from django.http import HttpResponse
 from django.views.generic import RedirectView
 import os
 
+
+@cache_control(public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+def serve_thumbnail(request, path):
+    # Thumbnail variants are named after their content and never change
+    # (pos_app/images.py), so browsers may keep them for good
+    return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
@@ -20,6 +30,11 @@ urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 # Only serve media files through Django in development
 # On cPanel, Apache serves media files directly from public_html/media/
+# In production the web server serves thumbnails and sets their cache headers
 if not getattr(settings, 'CPANEL', False):
+    if settings.DEBUG:
+        urlpatterns += [
+            re_path(r'^%s(?P<path>product_images/variants/.*)$' % settings.MEDIA_URL.lstrip('/'), serve_thumbnail),
+        ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -2,7 +2,8 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from .catalog import search_catalog
+from .customers import LOOKUP_LIMIT, find_customers
 from .models import Product, Customer, Sale, SaleItem, Inventory
 import json
 
@@ -12,30 +13,26 @@ def search_products(request):
     """Search products by name, SKU or barcode"""
     if request.method == 'GET':
         query = request.GET.get('query', '')
-        business_id = request.GET.get('business_id')
+        business = request.tenant.business
         
-        if not query or not business_id:
+        if not query or not business:
             return JsonResponse({'products': []})
+        if request.GET.get('business_id') not in (None, str(business.pk)):
+            return JsonResponse({'error': 'Access denied'}, status=403)
         
-        products = Product.objects.filter(
-            Q(name__icontains=query) | 
-            Q(sku__icontains=query) | 
-            Q(barcode__icontains=query),
-            business_id=business_id,
-            is_active=True
-        )[:10]
-        
-        products_data = []
-        for product in products:
-            products_data.append({
-                'id': product.id,
-                'name': product.name,
-                'sku': product.sku,
-                'barcode': product.barcode,
-                'price': float(product.selling_price),
-                'stock': product.stock_quantity,
-                'category': product.category.name if product.category else 'Uncategorized',
-            })
+        # Matched against the cached catalog rather than a LIKE query per keystroke
+        products_data = [
+            {
+                'id': product['id'],
+                'name': product['name'],
+                'sku': product['sku'],
+                'barcode': product['barcode'],
+                'price': product['price'],
+                'stock': product['stock_quantity'],
+                'category': product['category_name'],
+            }
+            for product in search_catalog(business, query)
+        ]
         
         return JsonResponse({'products': products_data})
     
@@ -50,9 +47,7 @@ def get_product(request, product_id):
             product = Product.objects.get(id=product_id)
             
             # Check if user has access to this product
-            from .views import get_business_for_user
-            business = get_business_for_user(request.user)
-            if product.business != business:
+            if product.business_id != getattr(request.tenant.business, 'pk', None):
                 return JsonResponse({'error': 'Access denied'}, status=403)
             
             product_data = {
@@ -77,18 +72,14 @@ def search_customers(request):
     """Search customers by name, email or phone"""
     if request.method == 'GET':
         query = request.GET.get('query', '')
-        business_id = request.GET.get('business_id')
+        business = request.tenant.business
         
-        if not query or not business_id:
+        if not query or not business:
             return JsonResponse({'customers': []})
+        if request.GET.get('business_id') not in (None, str(business.pk)):
+            return JsonResponse({'error': 'Access denied'}, status=403)
         
-        customers = Customer.objects.filter(
-            Q(first_name__icontains=query) | 
-            Q(last_name__icontains=query) | 
-            Q(email__icontains=query) | 
-            Q(phone__icontains=query),
-            business_id=business_id
-        )[:10]
+        customers = find_customers(Customer.objects.filter(business=business), query)[:LOOKUP_LIMIT]
         
         customers_data = []
         for customer in customers:
@@ -113,9 +104,7 @@ def get_customer(request, customer_id):
             customer = Customer.objects.get(id=customer_id)
             
             # Check if user has access to this customer
-            from .views import get_business_for_user
-            business = get_business_for_user(request.user)
-            if customer.business != business:
+            if customer.business_id != getattr(request.tenant.business, 'pk', None):
                 return JsonResponse({'error': 'Access denied'}, status=403)
             
             customer_data = {
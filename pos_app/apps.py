@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PosAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pos_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,130 @@
+# pos_app/business_config.py
+"""
+Per-worker cache of each business's BusinessSettings and VAT categories.
+
+Both change perhaps once a month but are read on nearly every request, so
+each worker keeps a BusinessConfig per business in process memory. It is
+tagged with a version kept in the shared cache; saving or deleting settings
+or a VAT category replaces that version once the transaction commits (see
+pos_app.signals), and every worker reloads on its next read. A read costs
+one lookup in the shared cache and no queries; attach_settings makes
+business.settings read from it as well.
+
+The shared cache has to be shared between workers for this (see CACHES in
+settings); with the default LocMemCache a change only reaches the worker
+that made it.
+"""
+import copy
+import threading
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Business, BusinessSettings, VATCategory
+
+DEFAULT_LOW_STOCK_THRESHOLD = 10
+
+_lock = threading.Lock()
+_configs = {}  # business_id -> BusinessConfig
+
+
+class BusinessConfig:
+    """A business's settings (None if it has none yet) and {id: VATCategory}"""
+
+    def __init__(self, business_id, version, settings, vat_categories):
+        self.business_id = business_id
+        self.version = version
+        self.settings = settings
+        self.vat_categories = vat_categories
+
+    @property
+    def low_stock_threshold(self):
+        return self.settings.low_stock_threshold if self.settings else DEFAULT_LOW_STOCK_THRESHOLD
+
+    @property
+    def stock_policy(self):
+        return self.settings.stock_policy if self.settings else 'block'
+
+    def vat_category(self, vat_category_id):
+        return self.vat_categories.get(vat_category_id)
+
+    def vat_rate(self, vat_category_id):
+        """Rate charged for a VAT category, 0 for none or an exempt one"""
+        category = self.vat_categories.get(vat_category_id)
+        if category is None or category.vat_type == 'exempt':
+            return Decimal('0')
+        return category.rate
+
+
+def version_key(business_id):
+    return f'business-config:version:{business_id}'
+
+
+def _shared_version(business_id):
+    key = version_key(business_id)
+    version = cache.get(key)
+    if version is None:
+        # Nothing can have been cached under a brand new version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def load_config(business_id, version=None):
+    # Always from the primary: a lagging replica's copy would be kept under the new version
+    settings = BusinessSettings.objects.using(DEFAULT_DB_ALIAS).filter(business_id=business_id).first()
+    vat_categories = VATCategory.objects.using(DEFAULT_DB_ALIAS).filter(business_id=business_id).in_bulk()
+    return BusinessConfig(business_id, version, settings, vat_categories)
+
+
+def get_config(business):
+    """BusinessConfig of a business (or business id), from this worker's cache when current"""
+    business_id = getattr(business, 'pk', business)
+    version = _shared_version(business_id)
+    config = _configs.get(business_id)
+    if config is None or config.version != version:
+        config = load_config(business_id, version)
+        with _lock:
+            _configs[business_id] = config
+    return config
+
+
+def business_settings(business):
+    """The business's BusinessSettings, or None; read-only, edit a fresh instance instead"""
+    return get_config(business).settings
+
+
+def attach_settings(business):
+    """
+    Fill in business.settings from the cache, so reading it costs no query.
+
+    The business gets its own copy, which views may edit and save.
+    """
+    settings = get_config(business).settings
+    if settings is not None:
+        settings = copy.copy(settings)
+        BusinessSettings.business.field.set_cached_value(settings, business)
+    Business.settings.related.set_cached_value(business, settings)
+    return business
+
+
+def low_stock_threshold(business):
+    return get_config(business).low_stock_threshold
+
+
+def vat_category(business, vat_category_id):
+    if vat_category_id is None:
+        return None
+    return get_config(business).vat_category(vat_category_id)
+
+
+def invalidate(business_id):
+    """Make every worker reload the business's config once the current transaction commits"""
+    transaction.on_commit(lambda: cache.set(version_key(business_id), time.time_ns(), None))
+
+
+def clear_config_cache():
+    with _lock:
+        _configs.clear()
@@ -0,0 +1,224 @@
+# pos_app/catalog.py
+"""
+Catalog downloads for POS terminals.
+
+Terminals keep a copy of the catalog and ask for changes since a cursor.
+Changes are found through Product.updated_at, which stock updates move as
+well, and ProductTombstone rows for deleted products. Full downloads carry an
+ETag so an unchanged catalog costs a single aggregate query.
+
+Product lists are read with values_list in one joined query, as plain rows
+rather than model instances, and streamed out in chunks.
+
+The active catalog of each business is cached as {product_id: row}, keyed by
+Business.catalog_version. Saving or deleting a product, category or VAT
+category bumps the version (see pos_app.signals). Stock moves with every sale,
+so it is cached apart from the rows, as a small {product_id: stock} map that
+get_catalog merges in. A stock change only deletes that map once its
+transaction commits (invalidate_cached_stock), and the next read reloads it
+with one two-column query.
+"""
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+from . import wire
+from .business_config import low_stock_threshold
+from .images import thumbnail_url
+from .models import Product, ProductPopularity, ProductTombstone
+from .search import search_product_ids
+
+# Rows written by transactions that were still open when a cursor was issued
+# carry an earlier updated_at, so deltas reach back this far and may repeat rows
+SYNC_OVERLAP = timedelta(seconds=30)
+
+CATALOG_TIMEOUT = 60 * 60 * 24
+# Also bounds how stale stock can get if a reload races a sale's invalidation
+STOCK_TIMEOUT = 60
+
+CATALOG_FIELDS = (
+    'id', 'name', 'sku', 'barcode', 'description', 'category_name', 'vat_rate',
+    'price', 'stock_quantity', 'is_active', 'thumbnail', 'thumbnail_webp',
+)
+PRODUCT_FIELDS = CATALOG_FIELDS + ('reorder_level',)
+STOCK = CATALOG_FIELDS.index('stock_quantity')
+# Model columns behind PRODUCT_FIELDS (reorder_level is business-wide, both
+# thumbnail URLs come from thumbnail_hash, and vat_rate is the rate charged,
+# 0 for exempt categories, as in pricing.get_rate_table)
+PRODUCT_COLUMNS = (
+    'id', 'name', 'sku', 'barcode', 'description', 'category__name', 'vat_category__rate',
+    'vat_category__vat_type', 'selling_price', 'stock_quantity', 'is_active', 'thumbnail_hash',
+)
+# Bumped when the shape or meaning of cached rows changes, so old entries are
+# not read and terminals download the catalog again
+CATALOG_CACHE_FORMAT = 3
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'CATALOG_TOMBSTONE_DAYS', 30))
+
+
+def make_cursor(moment):
+    """Opaque sync cursor for a point in time (microseconds since the epoch)"""
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def parse_cursor(cursor):
+    """Point in time of a cursor, or None for "0"; raises ValueError if malformed"""
+    value = int(cursor)
+    if value < 0:
+        raise ValueError('negative cursor')
+    if value == 0:
+        return None
+    return datetime.fromtimestamp(value / 1_000_000, tz=dt_timezone.utc)
+
+
+def catalog_etag(business, variant=''):
+    """ETag of a business's full catalog; changes whenever a product is added, changed or deleted"""
+    summary = Product.objects.filter(business=business).aggregate(count=Count('id'), changed=Max('updated_at'))
+    changed = make_cursor(summary['changed']) if summary['changed'] else '0'
+    return (
+        f'"catalog-{CATALOG_CACHE_FORMAT}-{business.pk}-{summary["count"]}-{changed}-{reorder_level(business)}{variant}"'
+    )
+
+
+def _opaque_tag(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def etag_matches(request, etag):
+    """
+    Weak comparison of If-None-Match with an ETag.
+
+    GZipMiddleware turns the ETag of a compressed response into W/"...", which
+    is what gzip clients send back.
+    """
+    candidates = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in candidates or _opaque_tag(etag) in {_opaque_tag(tag) for tag in candidates}
+
+
+def reorder_level(business):
+    return low_stock_threshold(business)
+
+
+def product_rows(queryset):
+    """Catalog rows in CATALOG_FIELDS order, read in one joined query without model instances"""
+    columns = queryset.values_list(*PRODUCT_COLUMNS).order_by('pk')
+    for pk, name, sku, barcode, description, category, vat_rate, vat_type, price, stock, active, digest in (
+        columns.iterator(chunk_size=wire.STREAM_CHUNK_SIZE)
+    ):
+        yield [
+            pk, name, sku or '', barcode or '', description or '', category or 'Uncategorized',
+            vat_rate if vat_rate is not None and vat_type != 'exempt' else 0, float(price), stock, active,
+            thumbnail_url(digest, fmt='jpg'), thumbnail_url(digest),
+        ]
+
+
+def stream_catalog(rows, reorder_level, compact=False, envelope=None):
+    """
+    JSON chunks of catalog rows: objects, or {"fields", "rows"} when compact.
+
+    With an envelope the list becomes its "products" member.
+    """
+    rows = (row + [reorder_level] for row in rows)
+    if compact:
+        head, tail = '{"fields":' + json.dumps(PRODUCT_FIELDS) + ',"rows":[', ']}'
+    else:
+        head, tail = '[', ']'
+        rows = (dict(zip(PRODUCT_FIELDS, row)) for row in rows)
+    if envelope is not None:
+        head, tail = '{' + wire.json_members(envelope) + ',"products":' + head, tail + '}'
+    return wire.json_array(rows, head, tail)
+
+
+def catalog_cache_key(business_id, version):
+    return f'catalog:products:{CATALOG_CACHE_FORMAT}:{business_id}:{version}'
+
+
+def stock_cache_key(business_id):
+    return f'catalog:stock:{business_id}'
+
+
+def cached_stock(business):
+    """{product_id: stock_quantity} of the business's active products"""
+    key = stock_cache_key(business.pk)
+    # Tagged with the catalog version, since product edits set stock too
+    cached = cache.get(key)
+    if cached is not None and cached[0] == business.catalog_version:
+        return cached[1]
+    stock = dict(catalog_products(business).values_list('pk', 'stock_quantity'))
+    cache.set(key, (business.catalog_version, stock), STOCK_TIMEOUT)
+    return stock
+
+
+def invalidate_cached_stock(business_id):
+    """Drop the business's cached stock once the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(stock_cache_key(business_id)))
+
+
+def get_catalog(business):
+    """{product_id: row} of the business's active products, rows in CATALOG_FIELDS order"""
+    key = catalog_cache_key(business.pk, business.catalog_version)
+    rows = cache.get(key)
+    if rows is None:
+        rows = {row[0]: row for row in product_rows(catalog_products(business))}
+        cache.set(key, rows, CATALOG_TIMEOUT)
+        # The rows were just read, so their stock is current
+        stock = {pk: row[STOCK] for pk, row in rows.items()}
+        cache.set(stock_cache_key(business.pk), (business.catalog_version, stock), STOCK_TIMEOUT)
+        return rows
+    stock = cached_stock(business)
+    for pk, row in rows.items():
+        row[STOCK] = stock.get(pk, row[STOCK])
+    return rows
+
+
+def catalog_entry(row):
+    return dict(zip(CATALOG_FIELDS, row))
+
+
+def search_catalog(business, query, limit=10):
+    """Active products matching query through the search index, best first, as cached catalog entries"""
+    rows = get_catalog(business)
+    ids = search_product_ids(business, query, catalog_products(business), limit)
+    return [catalog_entry(rows[pk]) for pk in ids if pk in rows]
+
+
+def top_sellers(business, limit=20):
+    """Ids of the business's best selling products, from ProductPopularity"""
+    return list(
+        ProductPopularity.objects.filter(business=business)
+        .order_by('-quantity_sold').values_list('product_id', flat=True)[:limit]
+    )
+
+
+def catalog_products(business):
+    return Product.objects.filter(business=business, is_active=True)
+
+
+def catalog_changes(business, since):
+    """
+    Products changed and removed since a point in time.
+
+    Returns (queryset of changed active products, ids of removed products);
+    deactivated products count as removed.
+    """
+    window = since - SYNC_OVERLAP
+    touched = Product.objects.filter(business=business, updated_at__gte=window)
+    removed = list(touched.filter(is_active=False).values_list('pk', flat=True))
+    removed.extend(
+        ProductTombstone.objects.filter(business=business, deleted_at__gte=window)
+        .values_list('product_id', flat=True)
+    )
+    return touched.filter(is_active=True), removed
+
+
+def needs_full_sync(since):
+    """A missing cursor, or one older than the kept tombstones, needs a full download"""
+    return since is None or since < timezone.now() - tombstone_retention()
@@ -0,0 +1,497 @@
+# pos_app/checkout.py
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .business_config import business_settings, get_config
+from .catalog import invalidate_cached_stock
+from .models import Customer, Inventory, ProductPopularity, Sale, SaleItem, SaleSubmission
+from .pricing import CENT, get_rate_table, price_cart
+from .sequences import next_document_number
+from .stock import STOCK_POLICY_BLOCK, STOCK_POLICY_WARN, decrement_stock
+from .tasks import defer
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+REQUIRED_SALE_FIELDS = ['payment_method', 'items']
+
+# Offline terminals upload their queue in batches; each chunk is one transaction
+MAX_BATCH_SIZE = 500
+BATCH_CHUNK_SIZE = 50
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into a sale"""
+
+
+class PriceMismatch(CheckoutError):
+    """Raised when the terminal's total disagrees with the server's pricing of the cart"""
+
+    def __init__(self, cart):
+        super().__init__('Cart total does not match current prices')
+        self.cart = cart
+
+
+class DuplicateSubmission(Exception):
+    """Raised when a sale with the same idempotency key already exists"""
+
+    def __init__(self, sale_id, invoice_number):
+        super().__init__(invoice_number)
+        self.sale_id = sale_id
+        self.invoice_number = invoice_number
+
+
+class PreparedSale:
+    """A validated, unsaved sale together with its priced lines"""
+
+    def __init__(self, sale, lines, idempotency_key=None):
+        self.sale = sale
+        self.lines = lines
+        self.idempotency_key = idempotency_key
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+def _clean_idempotency_key(key):
+    if not key:
+        return None
+    key = str(key).strip()
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise CheckoutError(f'idempotency_key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+    return key
+
+
+def get_idempotency_key(request, data):
+    """Read the client idempotency key from the payload or the Idempotency-Key header"""
+    return _clean_idempotency_key(data.get('idempotency_key') or request.headers.get('Idempotency-Key'))
+
+
+def find_submitted_sale(business, key):
+    """Return (sale_id, invoice_number) for an already-submitted key, or None"""
+    if not key:
+        return None
+    return (
+        SaleSubmission.objects.filter(business=business, key=key)
+        .values_list('sale_id', 'sale__invoice_number')
+        .first()
+    )
+
+
+def validate_sale_payload(data):
+    """Check the shape of a sale payload before any database work"""
+    if not isinstance(data, dict):
+        raise CheckoutError('Sale must be a JSON object')
+    for field in REQUIRED_SALE_FIELDS:
+        if field not in data:
+            raise CheckoutError(f'Missing required field: {field}')
+    if not data['items']:
+        raise CheckoutError('No items in cart')
+
+
+def _cart_product_ids(items):
+    try:
+        return {int(item['product_id']) for item in items}
+    except (KeyError, TypeError, ValueError):
+        raise CheckoutError('Every cart item needs a valid product_id')
+
+
+def _check_products(product_ids, rates):
+    missing = product_ids - set(rates)
+    if missing:
+        raise CheckoutError(f"Product not found: {', '.join(str(pk) for pk in sorted(missing))}")
+
+
+def load_cart_rates(business, items):
+    """Check every product in the cart against the business's cached rate table"""
+    rates = get_rate_table(business)
+    _check_products(_cart_product_ids(items), rates)
+    return rates
+
+
+def build_sale_lines(items, rates, use_catalog_prices=True):
+    """
+    Turn raw cart items into (product_id, quantity, unit_price) tuples.
+
+    Items are priced from the catalog unless use_catalog_prices is off, as for
+    offline sales that were already charged at the terminal's price.
+    """
+    lines = []
+    for item in items:
+        product_id = int(item['product_id'])
+        try:
+            quantity = int(item['quantity'])
+            if use_catalog_prices:
+                unit_price = rates[product_id].price
+            else:
+                unit_price = _to_decimal(item['unit_price'])
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            raise CheckoutError(f"Invalid quantity or price for product {product_id}")
+
+        if quantity <= 0:
+            raise CheckoutError(f"Quantity must be positive for product {product_id}")
+
+        lines.append((product_id, quantity, unit_price))
+    return lines
+
+
+def _payload_amount(data, field):
+    try:
+        return _to_decimal(data.get(field) or 0).quantize(CENT)
+    except ArithmeticError:
+        raise CheckoutError(f'Invalid {field}')
+
+
+def prepare_sale(business, employee, customer, data, rates, idempotency_key=None, use_catalog_prices=True,
+                 points_spent=Decimal('0')):
+    """
+    Price a sale payload against the rate table without touching the database.
+
+    Totals always come from the server's pricing. With catalog prices, a
+    total_amount sent by the terminal must agree with it to the cent per line,
+    otherwise PriceMismatch tells the terminal to refresh its prices.
+    ``points_spent`` is what earlier sales of the same batch already took
+    from the customer's loyalty points.
+    """
+    settings = business_settings(business)
+    lines = build_sale_lines(data['items'], rates, use_catalog_prices)
+    discount_amount = _payload_amount(data, 'discount_amount')
+    cart = price_cart(settings, rates, lines, discount_amount)
+    if discount_amount < 0 or cart.total_amount < 0:
+        raise CheckoutError('Invalid discount_amount')
+
+    if use_catalog_prices and data.get('total_amount') is not None:
+        client_total = _payload_amount(data, 'total_amount')
+        if abs(client_total - cart.total_amount) > CENT * len(lines):
+            raise PriceMismatch(cart)
+
+    sale = Sale(
+        business=business,
+        customer=customer,
+        employee=employee,
+        subtotal=cart.subtotal,
+        tax_amount=cart.tax_amount,
+        discount_amount=cart.discount_amount,
+        total_amount=cart.total_amount,
+        payment_method=data['payment_method'],
+        payment_reference=data.get('payment_reference', ''),
+        notes=data.get('notes', ''),
+        status='completed',
+    )
+    # Numbered before the sale's transaction opens, so it comes from this worker's block
+    sale.invoice_number = next_document_number(business.pk, 'INV')
+
+    # Sales queued offline keep the time they were rung up
+    if data.get('created_at'):
+        created_at = parse_datetime(str(data['created_at']))
+        if created_at is None:
+            raise CheckoutError('Invalid created_at')
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        sale.created_at = created_at
+
+    if settings.enable_customer_loyalty and customer:
+        sale.loyalty_points_earned = cart.total_amount * settings.points_per_purchase
+        points_used = _payload_amount(data, 'loyalty_points_used')
+        if points_used < 0:
+            raise CheckoutError('Invalid loyalty_points_used')
+        points_left = customer.loyalty_points - points_spent
+        if points_used > points_left:
+            raise CheckoutError(f'Customer has only {points_left} loyalty points')
+        sale.loyalty_points_used = points_used
+
+    return PreparedSale(sale, cart.lines, idempotency_key)
+
+
+def write_sales(business, user, prepared_sales, stock_policy):
+    """
+    Write prepared sales, their items and stock decrements.
+
+    Items and idempotency keys are bulk-inserted across all the given sales,
+    and stock moves in a single UPDATE under ``stock_policy``, customer
+    balances in another. The inventory ledger and product popularity are
+    deferred until after commit (see pos_app.tasks). The caller owns the transaction. Returns the stock
+    warnings produced by the warn policy.
+    """
+    submissions = []
+    sale_items = []
+    ledger = []
+    quantities = {}
+    customer_deltas = {}
+
+    for prepared in prepared_sales:
+        sale = prepared.sale
+        sale.save()
+
+        if prepared.idempotency_key:
+            submissions.append(SaleSubmission(business=business, key=prepared.idempotency_key, sale=sale))
+
+        if sale.customer_id:
+            points, debt = customer_deltas.get(sale.customer_id, (Decimal('0'), Decimal('0')))
+            points += sale.loyalty_points_earned - sale.loyalty_points_used
+            if sale.payment_method == 'credit':
+                debt += sale.total_amount
+            customer_deltas[sale.customer_id] = (points, debt)
+
+        for line in prepared.lines:
+            # Priced by pricing.price_cart, so SaleItem.save is not needed
+            sale_items.append(SaleItem(
+                sale=sale,
+                product_id=line.product_id,
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                subtotal=line.subtotal,
+                vat_amount=line.unit_vat,
+            ))
+            ledger.append((line.product_id, -line.quantity, sale.invoice_number))
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+
+    if submissions:
+        # Fails on the unique (business, key) index if a resend raced us
+        SaleSubmission.objects.bulk_create(submissions)
+
+    SaleItem.objects.bulk_create(sale_items)
+    warnings = decrement_stock(quantities, stock_policy)
+
+    invalidate_cached_stock(business.pk)
+    defer(write_inventory_ledger, business.pk, user.pk if user else None, ledger)
+    defer(record_popularity, business.pk, list(quantities.items()))
+    # Money owed is written with the sale, never left to a task that a restart could lose
+    apply_customer_balances([
+        (customer_id, str(points), str(debt))
+        for customer_id, (points, debt) in customer_deltas.items()
+        if points or debt
+    ])
+    return warnings
+
+
+def write_inventory_ledger(business_id, user_id, rows):
+    """Deferred: record (product_id, quantity, reference) ledger rows for stock that already moved"""
+    # Stock was moved by decrement_stock, so Inventory.save is skipped on purpose
+    Inventory.objects.bulk_create([
+        Inventory(
+            product_id=product_id,
+            transaction_type='sale',
+            quantity=quantity,
+            reference=reference,
+            business_id=business_id,
+            created_by_id=user_id,
+        )
+        for product_id, quantity, reference in rows
+    ])
+
+
+def record_popularity(business_id, quantities):
+    """Deferred: add sold (product_id, quantity) pairs to ProductPopularity"""
+    # Make sure every row exists, then add to all of them in one UPDATE
+    ProductPopularity.objects.bulk_create(
+        [ProductPopularity(business_id=business_id, product_id=product_id) for product_id, _ in quantities],
+        ignore_conflicts=True,
+    )
+    ProductPopularity.objects.filter(product_id__in=[product_id for product_id, _ in quantities]).update(
+        quantity_sold=Case(
+            *[When(product_id=product_id, then=F('quantity_sold') + quantity) for product_id, quantity in quantities],
+            output_field=models.BigIntegerField(),
+        )
+    )
+
+
+def apply_customer_balances(balances):
+    """Add (customer_id, loyalty_points, debt) deltas to customer balances in one UPDATE"""
+    if not balances:
+        return
+    deltas = [(customer_id, Decimal(points), Decimal(debt)) for customer_id, points, debt in balances]
+    Customer.objects.filter(pk__in=[customer_id for customer_id, _, _ in deltas]).update(
+        loyalty_points=Case(
+            *[When(pk=customer_id, then=F('loyalty_points') + points) for customer_id, points, _ in deltas],
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ),
+        current_debt=Case(
+            *[When(pk=customer_id, then=F('current_debt') + debt) for customer_id, _, debt in deltas],
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def price_sale(business, employee, customer, data, idempotency_key=None):
+    """Price a terminal's sale payload at catalog prices, ready for place_sale"""
+    rates = load_cart_rates(business, data['items'])
+    return prepare_sale(business, employee, customer, data, rates, idempotency_key)
+
+
+def place_sale(business, user, prepared):
+    """
+    Create a priced sale, its items and the stock decrement.
+
+    Query count is independent of basket size: prices come from the cached
+    rate table, sale items are bulk-inserted and stock is decremented with a
+    single UPDATE, all inside one transaction along with customer balances.
+    The inventory ledger and product popularity are written by post-commit
+    tasks.
+
+    When an idempotency key is given it is recorded in the same transaction,
+    so a concurrent resend of the same key raises DuplicateSubmission instead
+    of creating a second sale. Overselling is handled by the business's
+    stock_policy: InsufficientStock is raised (after the rollback) under the
+    block policy.
+
+    Returns (sale, stock_warnings).
+    """
+    try:
+        with transaction.atomic():
+            warnings = write_sales(business, user, [prepared], get_config(business).stock_policy)
+    except IntegrityError:
+        submitted = find_submitted_sale(business, prepared.idempotency_key)
+        if submitted is None:
+            raise
+        raise DuplicateSubmission(*submitted)
+
+    return prepared.sale, warnings
+
+
+def _sale_result(index, sale_id, invoice_number, replayed=False):
+    result = {'index': index, 'success': True, 'sale_id': sale_id, 'invoice_number': invoice_number}
+    if replayed:
+        result['replayed'] = True
+    return result
+
+
+def _error_result(index, message):
+    return {'index': index, 'success': False, 'error': message}
+
+
+def ingest_sales(business, user, employee, payloads, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Record a batch of completed sales uploaded by a terminal that was offline.
+
+    Prices, customers and already-seen idempotency keys are resolved once for
+    the whole batch; lines keep the price the terminal charged. Valid sales are then written in chunks of
+    ``chunk_size``, one transaction per chunk; if a chunk fails the sales in
+    it are retried one by one so a single bad sale does not sink its
+    neighbours; any other failure rejects the chunk's sales. Credit limits
+    are not enforced here, and a block stock policy is downgraded to warn,
+    because the sales already happened at the till. Loyalty points spent are
+    checked against what earlier sales of the batch left.
+
+    Returns one result dict per payload, in input order.
+    """
+    results = [None] * len(payloads)
+
+    keys = set()
+    customer_ids = set()
+    for data in payloads:
+        if not isinstance(data, dict):
+            continue
+        try:
+            key = _clean_idempotency_key(data.get('idempotency_key'))
+        except CheckoutError:
+            continue
+        if key:
+            keys.add(key)
+        if data.get('customer_id'):
+            try:
+                customer_ids.add(int(data['customer_id']))
+            except (TypeError, ValueError):
+                pass
+
+    submitted = {}
+    if keys:
+        submitted = {
+            key: (sale_id, invoice_number)
+            for key, sale_id, invoice_number in SaleSubmission.objects.filter(
+                business=business, key__in=keys
+            ).values_list('key', 'sale_id', 'sale__invoice_number')
+        }
+    rates = get_rate_table(business)
+    customers = Customer.objects.filter(business=business).in_bulk(customer_ids) if customer_ids else {}
+
+    stock_policy = get_config(business).stock_policy
+    if stock_policy == STOCK_POLICY_BLOCK:
+        stock_policy = STOCK_POLICY_WARN
+
+    prepared = []
+    seen_keys = set()
+    points_spent = {}
+    for index, data in enumerate(payloads):
+        try:
+            validate_sale_payload(data)
+            key = _clean_idempotency_key(data.get('idempotency_key'))
+            if key in submitted:
+                results[index] = _sale_result(index, *submitted[key], replayed=True)
+                continue
+            if key and key in seen_keys:
+                raise CheckoutError('Duplicate idempotency_key in batch')
+
+            customer = None
+            if data.get('customer_id'):
+                try:
+                    customer = customers.get(int(data['customer_id']))
+                except (TypeError, ValueError):
+                    customer = None
+                if customer is None:
+                    raise CheckoutError('Customer not found')
+            if data['payment_method'] == 'credit' and not customer:
+                raise CheckoutError('Customer required for credit sales')
+
+            _check_products(_cart_product_ids(data['items']), rates)
+            sale = prepare_sale(
+                business, employee, customer, data, rates, key, use_catalog_prices=False,
+                points_spent=points_spent.get(customer.pk, Decimal('0')) if customer else Decimal('0'),
+            )
+            prepared.append((index, sale))
+            if customer and sale.sale.loyalty_points_used:
+                points_spent[customer.pk] = points_spent.get(customer.pk, Decimal('0')) + sale.sale.loyalty_points_used
+            if key:
+                seen_keys.add(key)
+        except CheckoutError as e:
+            results[index] = _error_result(index, str(e))
+
+    for start in range(0, len(prepared), chunk_size):
+        chunk = prepared[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                write_sales(business, user, [sale for _, sale in chunk], stock_policy)
+        except IntegrityError:
+            _retry_individually(business, user, employee, payloads, rates, chunk, results, stock_policy)
+            continue
+        except Exception as e:
+            # Earlier chunks are committed, so report this one instead of failing the request
+            logger.exception('sale batch chunk failed', extra={'sales': len(chunk)})
+            for index, _ in chunk:
+                results[index] = _error_result(index, f'Error saving sale: {e}')
+            continue
+        for index, sale in chunk:
+            results[index] = _sale_result(index, sale.sale.pk, sale.sale.invoice_number)
+
+    return results
+
+
+def _retry_individually(business, user, employee, payloads, rates, chunk, results, stock_policy):
+    for index, failed in chunk:
+        key = failed.idempotency_key
+        # The rolled-back attempt left primary keys on the instances, so rebuild them
+        prepared = prepare_sale(
+            business, employee, failed.sale.customer, payloads[index], rates, key, use_catalog_prices=False
+        )
+        try:
+            with transaction.atomic():
+                write_sales(business, user, [prepared], stock_policy)
+        except IntegrityError as e:
+            previous = find_submitted_sale(business, key)
+            if previous:
+                results[index] = _sale_result(index, *previous, replayed=True)
+            else:
+                results[index] = _error_result(index, f'Error saving sale: {e}')
+            continue
+        except Exception as e:
+            logger.exception('sale batch retry failed')
+            results[index] = _error_result(index, f'Error saving sale: {e}')
+            continue
+        results[index] = _sale_result(index, prepared.sale.pk, prepared.sale.invoice_number)
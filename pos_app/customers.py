@@ -0,0 +1,93 @@
+# pos_app/customers.py
+"""
+Customer lookup on normalized, indexed keys.
+
+Customer.save stores three search keys next to the raw fields:
+
+* phone_key: the phone number as E.164 digits without the "+", so
+  "0712 345 678", "+254712345678" and "254-712-345678" are all 254712345678
+* name_key: "first last", and surname_key: "last first", lowercased and
+  normalized like product search text
+
+Lookups are prefix matches on those keys, which the (business, key) indexes
+answer directly however many customers a business has.
+"""
+import re
+
+from django.conf import settings
+from django.db.models import Q
+
+from .search import normalize
+
+LOOKUP_LIMIT = 10
+# Length of Customer.phone_key: a 20 character phone field plus a country code
+PHONE_KEY_LENGTH = 24
+
+_NON_DIGIT = re.compile(r'\D')
+_LETTER = re.compile(r'[^\W\d_]')
+
+
+def country_code():
+    return getattr(settings, 'DEFAULT_PHONE_COUNTRY_CODE', '254')
+
+
+def normalize_phone(phone, code=None):
+    """
+    E.164 digits of a phone number, or a prefix of them for a partly typed one.
+
+    Numbers without a country code are taken to be local to
+    DEFAULT_PHONE_COUNTRY_CODE: a trunk "0" is replaced by the code, and a
+    bare subscriber number ("712...") gets it in front. The result is capped
+    at PHONE_KEY_LENGTH digits, the same for stored keys and lookups.
+    """
+    return _phone_digits(phone, code or country_code())[:PHONE_KEY_LENGTH]
+
+
+def _phone_digits(phone, code):
+    raw = (phone or '').strip()
+    digits = _NON_DIGIT.sub('', raw)
+    if not digits:
+        return ''
+    if raw.startswith('+'):
+        return digits
+    if digits.startswith('00'):
+        return digits[2:]
+    if digits.startswith('0'):
+        return code + digits[1:]
+    if digits.startswith(code) or code.startswith(digits):
+        return digits
+    return code + digits
+
+
+def name_keys(first_name, last_name):
+    """(name_key, surname_key) for a customer's names"""
+    first = normalize(first_name)
+    last = normalize(last_name)
+    return f'{first} {last}'.strip(), f'{last} {first}'.strip()
+
+
+def looks_like_phone(query):
+    return not _LETTER.search(query) and len(_NON_DIGIT.sub('', query)) >= 3
+
+
+def lookup_filter(query):
+    """Q matching customers whose phone or name starts with query, or None for an empty query"""
+    query = query.strip()
+    if not query:
+        return None
+    if looks_like_phone(query):
+        return Q(phone_key__startswith=normalize_phone(query))
+    if '@' in query:
+        return Q(email__iexact=query)
+    name = normalize(query)
+    if not name:
+        return None
+    return Q(name_key__startswith=name) | Q(surname_key__startswith=name)
+
+
+def find_customers(customers, query):
+    """customers (already scoped to a business) matching query, by name"""
+    condition = lookup_filter(query)
+    if condition is None:
+        return customers.none()
+    return customers.filter(condition).order_by('name_key', 'pk')
@@ -0,0 +1,177 @@
+# pos_app/db_pool/__init__.py
+"""
+A per-process pool of MySQL connections.
+
+Set DATABASE_POOL=True to use it: the database ENGINE becomes pos_app.db_pool,
+whose DatabaseWrapper (base.py) checks a connection out of the pool where
+Django would connect, and checks it back in where Django would close it. With
+CONN_MAX_AGE=0 that is at the end of every request and every deferred task.
+
+A process never holds more than max_size connections; a thread that finds
+them all in use waits up to timeout seconds, then fails with an
+OperationalError. Connections older than recycle seconds are closed rather
+than reused, and with CONN_HEALTH_CHECKS an idle connection is pinged before
+it is handed out. Connections returned mid-transaction or after a database
+error are closed.
+
+pool_stats() counts checkouts, waits, timeouts and opened, recycled and
+discarded connections, and every stats_interval seconds the pool logs them
+to the pos_app.db logger.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('pos_app.db')
+
+DEFAULTS = {
+    'max_size': 10,
+    'timeout': 10,  # seconds a checkout waits for a free connection
+    'recycle': 1800,  # seconds a connection is used for, below MySQL's wait_timeout
+    'health_checks': True,
+    'stats_interval': 60,  # seconds between stats log lines, 0 for none
+}
+
+_lock = threading.Lock()
+_pools = {}  # alias -> ConnectionPool
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, alias='default', max_size=10, timeout=10, recycle=1800, health_checks=True, stats_interval=60):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.health_checks = health_checks
+        self.stats_interval = stats_interval
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = collections.deque()  # (connection, opened at), most recently returned last
+        self._opened_at = {}  # id(connection) -> opened at, for connections checked out
+        self._stats = collections.Counter()
+        self._logged_at = time.monotonic()
+
+    def checkout(self, connect):
+        """A connection from the pool, or a new one from connect()"""
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count(timeouts=1)
+                logger.warning('No database connection free', extra=self.stats())
+                raise PoolTimeout(f'All {self.max_size} database connections stayed in use for {self.timeout}s')
+            self._count(waits=1, wait_ms=round((time.monotonic() - started) * 1000))
+        try:
+            connection, opened_at = self._reuse()
+            if connection is None:
+                connection, opened_at = connect(), time.monotonic()
+                self._count(opened=1)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._opened_at[id(connection)] = opened_at
+            self._stats['checkouts'] += 1
+        return connection
+
+    def _reuse(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                connection, opened_at = self._idle.pop()
+            if time.monotonic() - opened_at > self.recycle:
+                self._close(connection, 'recycled')
+            elif self.health_checks and not self._alive(connection):
+                self._close(connection, 'discarded')
+            else:
+                return connection, opened_at
+
+    def checkin(self, connection, discard=False):
+        """Give a checked-out connection back; discard closes it instead"""
+        with self._lock:
+            opened_at = self._opened_at.pop(id(connection), None)
+        if opened_at is None:
+            # Not ours: opened before this process forked, or already returned
+            return
+        try:
+            if discard:
+                self._close(connection, 'discarded')
+            elif time.monotonic() - opened_at > self.recycle:
+                self._close(connection, 'recycled')
+            else:
+                with self._lock:
+                    self._idle.append((connection, opened_at))
+        finally:
+            self._slots.release()
+        self._maybe_log()
+
+    def _alive(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close(self, connection, reason):
+        self._count(**{reason: 1})
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _count(self, **counts):
+        with self._lock:
+            self._stats.update(counts)
+
+    def stats(self):
+        with self._lock:
+            stats = {name: self._stats[name] for name in (
+                'checkouts', 'waits', 'wait_ms', 'timeouts', 'opened', 'recycled', 'discarded',
+            )}
+            stats.update(idle=len(self._idle), in_use=len(self._opened_at))
+        stats.update(alias=self.alias, max_size=self.max_size)
+        return stats
+
+    def _maybe_log(self):
+        if not self.stats_interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._logged_at < self.stats_interval:
+                return
+            self._logged_at = now
+        logger.info('db pool stats', extra=self.stats())
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for connection, _ in idle:
+            self._close(connection, 'recycled')
+
+
+def get_pool(alias, options=None):
+    """The process's pool for a database alias, made from options on first use"""
+    pid = os.getpid()
+    pool = _pools.get(alias)
+    if pool is None or pool.pid != pid:
+        with _lock:
+            pool = _pools.get(alias)
+            # A forked worker must not share its parent's sockets, so it
+            # starts a pool of its own and leaves the parent's alone
+            if pool is None or pool.pid != pid:
+                pool = ConnectionPool(alias, **{**DEFAULTS, **(options or {})})
+                _pools[alias] = pool
+    return pool
+
+
+def pool_stats():
+    """{alias: counters} of this process's pools"""
+    return {alias: pool.stats() for alias, pool in list(_pools.items())}
@@ -0,0 +1,34 @@
+# pos_app/db_pool/base.py
+"""The MySQL backend, with connections handed out by pos_app.db_pool"""
+from django.db.backends.mysql import base as mysql
+
+from . import PoolTimeout, get_pool
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    @property
+    def pool(self):
+        options = dict(self.settings_dict.get('POOL') or {})
+        options.setdefault('health_checks', self.settings_dict.get('CONN_HEALTH_CHECKS', True))
+        return get_pool(self.alias, options)
+
+    def get_new_connection(self, conn_params):
+        try:
+            return self.pool.checkout(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as exc:
+            raise mysql.Database.OperationalError(str(exc)) from exc
+
+    def init_connection_state(self):
+        # Session variables are set once per connection, not once per checkout
+        if not getattr(self.connection, 'pool_initialized', False):
+            super().init_connection_state()
+            self.connection.pool_initialized = True
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # A connection with a transaction open, or that raised an error, is not reused
+        discard = self.in_atomic_block or not self.autocommit or self.errors_occurred
+        with self.wrap_database_errors:
+            self.pool.checkin(self.connection, discard=discard)
@@ -5,8 +5,9 @@ from django.contrib.auth.models import User
 from .models import (
     Business, BusinessSettings, Category, Product, Customer, 
     Employee, Sale, SaleItem, Inventory, Supplier, Purchase, 
-    PurchaseItem, Expense
+    PurchaseItem, Expense, PriceChangeBatch, VATCategory
 )
+from .repricing import ROUNDING_CHOICES
 
 class UserRegistrationForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -82,7 +83,8 @@ class BusinessSettingsForm(forms.ModelForm):
                  'enable_low_stock_alerts', 'low_stock_threshold',
                  'enable_customer_loyalty', 'points_per_purchase', 'points_value',
                  'enable_vat', 'vat_inclusive_pricing', 'default_vat_category', 
-                 'kra_pin', 'vat_number', 'show_vat_on_receipt', 'vat_rounding')
+                 'kra_pin', 'vat_number', 'show_vat_on_receipt', 'vat_rounding',
+                 'stock_policy')
         widgets = {
             'receipt_header': forms.Textarea(attrs={'rows': 3}),
             'receipt_footer': forms.Textarea(attrs={'rows': 3}),
@@ -99,6 +101,7 @@ class BusinessSettingsForm(forms.ModelForm):
             'vat_number': 'VAT Registration Number',
             'show_vat_on_receipt': 'Show VAT on Receipts',
             'vat_rounding': 'VAT Rounding Method',
+            'stock_policy': 'When a Sale Exceeds Stock',
         }
     
     def __init__(self, *args, **kwargs):
@@ -288,4 +291,42 @@ class ExpenseForm(forms.ModelForm):
         widgets = {
             'description': forms.Textarea(attrs={'rows': 3}),
             'date': forms.DateInput(attrs={'type': 'date'}),
-        }
\ No newline at end of file
+        }
+
+class BulkPriceChangeForm(forms.Form):
+    """Which products to reprice (at least one criterion) and how"""
+    category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False)
+    vat_category = forms.ModelChoiceField(queryset=VATCategory.objects.none(), required=False, label='VAT Category')
+    supplier = forms.ModelChoiceField(queryset=Supplier.objects.none(), required=False)
+    search = forms.CharField(required=False, max_length=100)
+    rule = forms.ChoiceField(choices=PriceChangeBatch.RULE_CHOICES)
+    value = forms.DecimalField(max_digits=10, decimal_places=2, widget=forms.NumberInput(attrs={'step': '0.01'}))
+    round_to = forms.ChoiceField(choices=[(step, step) for step in ROUNDING_CHOICES], initial='0.01', label='Round to')
+    
+    def __init__(self, *args, **kwargs):
+        business = kwargs.pop('business', None)
+        super().__init__(*args, **kwargs)
+        if business:
+            self.fields['category'].queryset = Category.objects.filter(business=business)
+            self.fields['vat_category'].queryset = VATCategory.objects.filter(business=business)
+            self.fields['supplier'].queryset = Supplier.objects.filter(business=business)
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if not any(cleaned_data.get(name) for name in ('category', 'vat_category', 'supplier', 'search')):
+            raise forms.ValidationError('Choose a category, VAT category, supplier or search to select products')
+        rule, value = cleaned_data.get('rule'), cleaned_data.get('value')
+        if value is not None:
+            if rule == 'percent' and value <= -100:
+                self.add_error('value', 'A price cannot go down by 100% or more')
+            if rule == 'margin' and not 0 <= value < 100:
+                self.add_error('value', 'A margin must be at least 0% and below 100%')
+        return cleaned_data
+    
+    def selection(self):
+        """Human readable summary of the criteria, for the audit record"""
+        parts = [
+            f'{self.fields[name].label or name.replace("_", " ").title()}: {self.cleaned_data[name]}'
+            for name in ('category', 'vat_category', 'supplier', 'search') if self.cleaned_data.get(name)
+        ]
+        return ', '.join(parts)
@@ -0,0 +1,142 @@
+# pos_app/images.py
+"""
+Product thumbnails.
+
+Uploaded product images are served at whatever size they were uploaded,
+which is far more than a product grid needs. For every image this makes
+square thumbnails in THUMBNAIL_SIZES, each as WebP and as JPEG for browsers
+without WebP, stored as
+
+    product_images/variants/<hash>-<size>.<webp|jpg>
+
+where <hash> is taken from the original image's content. A changed image
+gets new names, so variants never change once written and can be served
+with far-future cache headers (see django_pos/urls.py).
+
+Thumbnails are made by a deferred task after a product is saved with a new
+image (see pos_app.signals), and for existing products by the
+generate_thumbnails command. Product.thumbnail_source records which image
+the current Product.thumbnail_hash was made from.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Product
+from .pricing import bump_catalog_version
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'product_images/variants'
+THUMBNAIL_SIZES = (96, 192)  # the POS grid and product form, at 2x
+GRID_SIZE = THUMBNAIL_SIZES[0]
+HASH_LENGTH = 16
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+# Apache serves media directly on cPanel, so the variants directory carries
+# its own caching rule there
+HTACCESS = '''<IfModule mod_headers.c>
+Header set Cache-Control "public, max-age=31536000, immutable"
+</IfModule>
+'''
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def variant_name(digest, size, fmt):
+    return f'{VARIANTS_DIR}/{digest}-{size}.{fmt}'
+
+
+def thumbnail_url(digest, size=GRID_SIZE, fmt='webp'):
+    """URL of one variant, or '' for a product without thumbnails"""
+    if not digest:
+        return ''
+    return default_storage.url(variant_name(digest, size, fmt))
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpg':
+        if image.mode != 'RGB':
+            # JPEG has no alpha channel: put transparent images on white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+            image = background
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def make_variants(data):
+    """
+    Write the thumbnails of an image's content, unless they exist already.
+
+    Returns the content hash; raises UnidentifiedImageError (or OSError) if
+    the data is not an image Pillow can read.
+    """
+    digest = content_hash(data)
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        for size in THUMBNAIL_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for fmt in ('webp', 'jpg'):
+                name = variant_name(digest, size, fmt)
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(_encode(thumbnail, fmt)))
+    _ensure_htaccess()
+    return digest
+
+
+def _ensure_htaccess():
+    name = f'{VARIANTS_DIR}/.htaccess'
+    try:
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(HTACCESS.encode()))
+    except NotImplementedError:
+        pass  # not a filesystem storage
+
+
+def generate_thumbnails(product_id, bump=True):
+    """
+    Deferred: bring a product's thumbnails in line with its current image.
+
+    Images Pillow cannot read are logged and recorded as done without
+    thumbnails, since retrying would not help. Backfills pass bump=False and
+    bump the catalog version once at the end instead of once per product.
+    """
+    product = Product.objects.filter(pk=product_id).only('pk', 'business_id', 'image', 'thumbnail_source').first()
+    if product is None:
+        return
+    source = product.image.name or ''
+    digest = ''
+    if source:
+        try:
+            with product.image.open('rb') as f:
+                data = f.read()
+            digest = make_variants(data)
+        except FileNotFoundError:
+            logger.warning('Image %s of product %s is missing', source, product_id)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+            logger.warning('Cannot make thumbnails of %s for product %s', source, product_id, exc_info=True)
+    # update() skips post_save, so this does not queue the task again
+    Product.objects.filter(pk=product_id).update(
+        thumbnail_hash=digest, thumbnail_source=source, updated_at=timezone.now(),
+    )
+    if bump:
+        bump_catalog_version(product.business_id)
+    return digest
+
+
+def needs_thumbnails(product):
+    return (product.image.name or '') != product.thumbnail_source
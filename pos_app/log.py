@@ -0,0 +1,107 @@
+# pos_app/log.py
+"""
+Structured logging for the POS app.
+
+RequestContextMiddleware opens a context for each request, and ContextFilter
+copies its request ID, business ID and elapsed time onto every log record.
+JSONFormatter writes one JSON object per line, including any ``extra`` fields.
+
+Verbose per-sale traces go to the ``pos_app.trace`` logger. TraceSampler keeps
+them only for a sampled fraction of requests (LOG_TRACE_SAMPLE_RATE), so the
+whole trace of a sampled request is kept and everything else costs nothing.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+trace = logging.getLogger('pos_app.trace')
+
+_context = contextvars.ContextVar('pos_log_context', default=None)
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_CONTEXT_ATTRS = {'request_id', 'business_id', 'elapsed_ms'}
+
+
+class RequestContext:
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.business_id = None
+        self.sampled = sampled
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+
+def start_request(request_id=None, sample_rate=0.0):
+    """Open a logging context for a request; returns (context, token) for end_request"""
+    context = RequestContext(request_id or uuid.uuid4().hex, random.random() < sample_rate)
+    return context, _context.set(context)
+
+
+def end_request(token):
+    _context.reset(token)
+
+
+def current():
+    return _context.get()
+
+
+def bind_business(business_id):
+    """Tag the rest of the current request's log records with a business"""
+    context = _context.get()
+    if context is not None:
+        context.business_id = business_id
+
+
+class ContextFilter(logging.Filter):
+    """Add request_id, business_id and elapsed_ms of the current request to records"""
+
+    def filter(self, record):
+        context = _context.get()
+        record.request_id = context.request_id if context else None
+        record.business_id = context.business_id if context else None
+        record.elapsed_ms = context.elapsed_ms if context else None
+        return True
+
+
+class TraceSampler(logging.Filter):
+    """Keep trace records only for requests picked by the sampler"""
+
+    def __init__(self, rate=0.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        context = _context.get()
+        if context is not None:
+            return context.sampled
+        return random.random() < self.rate
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for attr in ('request_id', 'business_id', 'elapsed_ms'):
+            value = getattr(record, attr, None)
+            if value is not None:
+                entry[attr] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in _CONTEXT_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
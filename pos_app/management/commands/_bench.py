@@ -0,0 +1,59 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks seed a throwaway owner, business and catalog, run against it and
+delete the owner afterwards, which cascades to everything they created.
+"""
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from pos_app.models import Business, BusinessSettings, Category, Product, VATCategory
+
+
+def seed_business(product_count, stock, stock_policy='block'):
+    """Create a throwaway owner and business with product_count products. Returns (user, business, products)"""
+    tag = uuid.uuid4().hex[:8]
+    user = User.objects.create_user(username=f'bench-{tag}', password=uuid.uuid4().hex)
+    business = Business.objects.create(name=f'Bench {tag}', owner=user)
+    BusinessSettings.objects.create(business=business, stock_policy=stock_policy)
+    vat = VATCategory.objects.create(
+        business=business, name='Standard Rated (A)', code='A', rate=Decimal('16.00')
+    )
+    category = Category.objects.create(business=business, name='Bench')
+    products = Product.objects.bulk_create([
+        Product(
+            business=business,
+            category=category,
+            vat_category=vat,
+            name=f'Bench Product {i}',
+            sku=f'BENCH-{tag}-{i:05d}',
+            purchase_price=Decimal('50.00'),
+            selling_price=Decimal('100.00'),
+            stock_quantity=stock,
+        )
+        for i in range(product_count)
+    ])
+    return user, business, products
+
+
+def cart_payload(products, quantity=1):
+    """A process_sale payload selling quantity of each product at its selling price"""
+    total = sum(p.selling_price * quantity for p in products)
+    return {
+        'subtotal': str(total),
+        'tax_amount': '0',
+        'discount_amount': '0',
+        'total_amount': str(total),
+        'payment_method': 'cash',
+        'items': [
+            {'product_id': p.pk, 'quantity': quantity, 'unit_price': str(p.selling_price)}
+            for p in products
+        ],
+    }
+
+
+def teardown(user):
+    """Delete a seeded owner and, through cascades, everything the benchmark wrote"""
+    user.delete()
@@ -0,0 +1,135 @@
+import json
+import random
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from pos_app.tasks import flush
+
+from ._bench import cart_payload, seed_business, teardown
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = 'Replay synthetic carts through process_sale and report latency, queries per sale and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=1000, help='Number of sales to replay (default: 1000)')
+        parser.add_argument('--catalog', type=int, default=500, help='Products in the seeded catalog (default: 500)')
+        parser.add_argument('--basket', type=int, default=5, help='Distinct products per cart (default: 5)')
+        parser.add_argument('--max-quantity', type=int, default=3, help='Largest quantity per line (default: 3)')
+        parser.add_argument('--concurrency', type=int, default=1, help='Concurrent terminals (default: 1)')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured sales per terminal first (default: 20)')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for the carts (default: 1)')
+        parser.add_argument('--host', help='Host header to send (default: first ALLOWED_HOSTS entry)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded business for inspection')
+
+    def handle(self, *args, **options):
+        if options['basket'] > options['catalog']:
+            raise CommandError('--basket cannot be larger than --catalog')
+
+        host = options['host'] or next((h for h in settings.ALLOWED_HOSTS if h and '*' not in h), 'localhost')
+        # Plenty of stock and the allow policy, so the benchmark measures checkout rather than rejections
+        stock = options['sales'] * options['max_quantity'] + 1000
+        user, business, products = seed_business(options['catalog'], stock, stock_policy='allow')
+        self.stdout.write(
+            f"Seeded business {business.pk} with {options['catalog']} products; "
+            f"{options['sales']} sales of {options['basket']} lines, {options['concurrency']} terminal(s)"
+        )
+
+        rng = random.Random(options['seed'])
+        carts = [self.random_cart(rng, products, options) for _ in range(options['sales'])]
+        warmup = [self.random_cart(rng, products, options) for _ in range(options['warmup'])]
+        url = reverse('pos:process_sale')
+
+        latencies = []
+        queries = []
+        failures = {}
+        lock = threading.Lock()
+        shares = [carts[i::options['concurrency']] for i in range(options['concurrency'])]
+        start = threading.Barrier(options['concurrency'] + 1)
+
+        def terminal(share):
+            client = Client(HTTP_HOST=host)
+            client.force_login(user)
+            try:
+                for payload in warmup:
+                    client.post(url, json.dumps(payload), content_type='application/json')
+            except Exception:
+                start.abort()  # don't leave the other terminals waiting
+                raise
+            try:
+                start.wait()
+                for payload in share:
+                    body = json.dumps(payload)
+                    with CaptureQueriesContext(connection) as ctx:
+                        began = time.perf_counter()
+                        response = client.post(url, body, content_type='application/json')
+                        elapsed = time.perf_counter() - began
+                    with lock:
+                        if response.status_code == 200:
+                            latencies.append(elapsed * 1000)
+                            queries.append(len(ctx.captured_queries))
+                        else:
+                            failures[response.status_code] = failures.get(response.status_code, 0) + 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=terminal, args=(share,)) for share in shares]
+        try:
+            for worker in workers:
+                worker.start()
+            start.wait()
+            began = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            wall = time.perf_counter() - began
+            flush()
+        finally:
+            if options['keep']:
+                self.stdout.write(f'Kept business {business.pk} ({business.name})')
+            else:
+                teardown(user)
+
+        self.report(latencies, queries, failures, wall)
+
+    def random_cart(self, rng, products, options):
+        lines = rng.sample(products, options['basket'])
+        payload = cart_payload(lines)
+        for item in payload['items']:
+            item['quantity'] = rng.randint(1, options['max_quantity'])
+        total = sum(p.selling_price * item['quantity'] for p, item in zip(lines, payload['items']))
+        payload['subtotal'] = payload['total_amount'] = str(total)
+        return payload
+
+    def report(self, latencies, queries, failures, wall):
+        if not latencies:
+            raise CommandError(f'No sale succeeded; responses by status: {failures}')
+
+        latencies.sort()
+        self.stdout.write(
+            f"Completed {len(latencies)} sales in {wall:.2f}s: {len(latencies) / wall:.1f} sales/s"
+        )
+        self.stdout.write(
+            f"Latency ms: p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  "
+            f"p99 {percentile(latencies, 99):.1f}  max {latencies[-1]:.1f}"
+        )
+        self.stdout.write(
+            f"Queries per sale: mean {statistics.mean(queries):.1f}  min {min(queries)}  max {max(queries)}"
+        )
+        if failures:
+            self.stdout.write(self.style.WARNING(f'Failed responses by status: {failures}'))
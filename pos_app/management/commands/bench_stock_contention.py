@@ -0,0 +1,104 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from pos_app.checkout import place_sale, price_sale
+from pos_app.models import Inventory, Product, Sale
+from pos_app.stock import InsufficientStock
+from pos_app.tasks import flush
+
+from ._bench import cart_payload, seed_business, teardown
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent checkouts against the same products and verify stock matches the ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent tills (default: 4)')
+        parser.add_argument('--sales', type=int, default=50, help='Sales per till (default: 50)')
+        parser.add_argument('--products', type=int, default=3, help='Products in every basket (default: 3)')
+        parser.add_argument('--stock', type=int, default=100, help='Initial stock per product (default: 100)')
+        parser.add_argument('--quantity', type=int, default=1, help='Quantity of each product per sale (default: 1)')
+        parser.add_argument(
+            '--policy',
+            choices=['allow', 'warn', 'block'],
+            default='block',
+            help='Stock policy for the benchmark business (default: block)'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded business for inspection')
+
+    def handle(self, *args, **options):
+        user, business, products = seed_business(options['products'], options['stock'], options['policy'])
+        business.settings  # load once so the tills share it
+        payload = cart_payload(products, options['quantity'])
+
+        counts = {'completed': 0, 'blocked': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(options['threads'])
+
+        def till():
+            start.wait()
+            try:
+                for _ in range(options['sales']):
+                    try:
+                        place_sale(business, user, price_sale(business, None, None, payload))
+                        outcome = 'completed'
+                    except InsufficientStock:
+                        outcome = 'blocked'
+                    except OperationalError as e:
+                        self.stderr.write(f'Till error: {e}')
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=till) for _ in range(options['threads'])]
+        began = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+        flush()  # the inventory ledger is written after commit
+
+        try:
+            problems = self.check_consistency(business, products, options)
+        finally:
+            if not options['keep']:
+                teardown(user)
+
+        attempted = options['threads'] * options['sales']
+        self.stdout.write(
+            f"{attempted} sales in {elapsed:.2f}s ({attempted / elapsed:.1f}/s): "
+            f"{counts['completed']} completed, {counts['blocked']} blocked, {counts['errors']} errors"
+        )
+        if options['keep']:
+            self.stdout.write(f'Kept business {business.pk} ({business.name})')
+        if problems:
+            raise CommandError('Stock is inconsistent:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Stock and ledger are consistent'))
+
+    def check_consistency(self, business, products, options):
+        """Compare each product's stock with its initial stock plus the ledger"""
+        problems = []
+        ledger = dict(
+            Inventory.objects.filter(business=business)
+            .values_list('product_id')
+            .annotate(total=Sum('quantity'))
+        )
+        sold = Sale.objects.filter(business=business).count()
+        for pk, name, stock in Product.objects.filter(pk__in=[p.pk for p in products]).values_list(
+            'pk', 'name', 'stock_quantity'
+        ):
+            expected = options['stock'] + (ledger.get(pk) or 0)
+            if stock != expected:
+                problems.append(f'{name}: stock {stock}, ledger says {expected}')
+            if options['policy'] == 'block' and stock < 0:
+                problems.append(f'{name}: oversold to {stock} under the block policy')
+            if expected != options['stock'] - sold * options['quantity']:
+                problems.append(f'{name}: ledger does not match {sold} completed sales')
+        return problems
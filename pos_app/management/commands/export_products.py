@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app.models import Business
+from pos_app.product_io import FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Write the products of a business as CSV or JSON lines, in the format import_products reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('business', type=int, help='Business id')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write instead of standard output')
+
+    def handle(self, *args, **options):
+        try:
+            business = Business.objects.get(pk=options['business'])
+        except Business.DoesNotExist:
+            raise CommandError(f"Business with ID {options['business']} does not exist")
+
+        lines = stream_export(business, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+            f.writelines(lines)
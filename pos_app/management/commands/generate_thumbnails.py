@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from pos_app.images import generate_thumbnails
+from pos_app.models import Product
+from pos_app.pricing import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = 'Make the thumbnails of product images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help='Only the products of this business id')
+        parser.add_argument('--force', action='store_true', help='Redo products whose thumbnails look current')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['business']:
+            products = products.filter(business_id=options['business'])
+        if not options['force']:
+            products = products.exclude(image=F('thumbnail_source'))
+        # Nothing to do for products that never had an image
+        products = products.exclude(Q(image='') | Q(image__isnull=True), thumbnail_source='')
+
+        made = cleared = failed = 0
+        businesses = set()
+        for pk, business_id, image in products.values_list('pk', 'business_id', 'image').order_by('pk').iterator():
+            digest = generate_thumbnails(pk, bump=False)
+            if digest is None:
+                continue  # deleted while we ran
+            if not image:
+                cleared += 1  # image removed, old thumbnails dropped
+            elif digest:
+                made += 1
+            else:
+                failed += 1
+            businesses.add(business_id)
+        # One catalog rebuild per business rather than one per product
+        for business_id in sorted(businesses):
+            bump_catalog_version(business_id)
+        self.stdout.write(self.style.SUCCESS(f'Made thumbnails for {made} products, cleared {cleared}, {failed} failed'))
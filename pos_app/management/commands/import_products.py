@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app.models import Business
+from pos_app.product_io import FORMATS, IMPORT_CHUNK_SIZE, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = 'Create and update the products of a business from a CSV or JSON lines file, matched by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('business', type=int, help='Business id')
+        parser.add_argument('path', help='CSV or JSON lines file')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            business = Business.objects.get(pk=options['business'])
+        except Business.DoesNotExist:
+            raise CommandError(f"Business with ID {options['business']} does not exist")
+
+        fmt = options['format'] or detect_format(options['path'])
+        with open(options['path'], 'rb') as f:
+            result = import_products(business, f, fmt, chunk_size=options['chunk_size'])
+
+        for line, message in result.errors:
+            self.stderr.write(f'line {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} created, {result.updated} updated, {result.unchanged} unchanged, '
+            f'{result.failed} skipped'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pos_app.catalog import tombstone_retention
+from pos_app.models import ProductTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete product tombstones older than CATALOG_TOMBSTONE_DAYS'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows deleted per statement (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        # Terminals with an older cursor get a full catalog, so these are no longer needed
+        cutoff = timezone.now() - tombstone_retention()
+        stale = ProductTombstone.objects.filter(deleted_at__lt=cutoff)
+
+        deleted = 0
+        while True:
+            pks = list(stale.values_list('pk', flat=True)[:options['chunk_size']])
+            if not pks:
+                break
+            deleted += ProductTombstone.objects.filter(pk__in=pks).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} product tombstones older than {cutoff:%Y-%m-%d}'))
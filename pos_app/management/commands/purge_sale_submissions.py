@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pos_app.models import SaleSubmission
+
+
+class Command(BaseCommand):
+    help = 'Delete sale idempotency keys older than the terminal retry window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Keep keys newer than this many days (default: 30)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows deleted per statement (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        stale = SaleSubmission.objects.filter(created_at__lt=cutoff)
+
+        deleted = 0
+        while True:
+            pks = list(stale.values_list('pk', flat=True)[:options['chunk_size']])
+            if not pks:
+                break
+            deleted += SaleSubmission.objects.filter(pk__in=pks).delete()[0]
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {deleted} sale submission keys older than {options["days"]} days')
+        )
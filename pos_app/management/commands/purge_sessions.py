@@ -0,0 +1,44 @@
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions from the database a chunk at a time (instead of clearsessions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of rows deleted per statement (default: 1000)'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to wait between chunks, to go easy on a busy database (default: 0)'
+        )
+
+    def handle(self, *args, **options):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            # Cache and cookie sessions expire by themselves
+            self.stdout.write(f'{settings.SESSION_ENGINE} keeps no sessions in the database')
+            return
+        model = store.get_model_class()
+        expired = model.objects.filter(expire_date__lt=timezone.now())
+
+        deleted = 0
+        while True:
+            keys = list(expired.values_list('pk', flat=True)[:options['chunk_size']])
+            if not keys:
+                break
+            deleted += model.objects.filter(pk__in=keys).delete()[0]
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions'))
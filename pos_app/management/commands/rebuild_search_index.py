@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pos_app.models import Product
+from pos_app.search import index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index, e.g. after products were bulk-created or edited with update()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help='Only reindex the products of this business id')
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['business']:
+            products = products.filter(business_id=options['business'])
+
+        count = index_products(products)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
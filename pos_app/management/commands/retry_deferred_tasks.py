@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from pos_app.models import DeferredTaskFailure
+from pos_app.tasks import MAX_ATTEMPTS, attempt_task
+
+
+class Command(BaseCommand):
+    help = 'Run post-commit tasks that failed after their retries again'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100,
+            help='Maximum number of failed tasks to retry (default: 100)'
+        )
+
+    def handle(self, *args, **options):
+        failures = DeferredTaskFailure.objects.filter(resolved_at__isnull=True).order_by('pk')[:options['limit']]
+
+        resolved = 0
+        failed = 0
+        for failure in failures:
+            error = attempt_task(failure.task, failure.args)
+            if error is None:
+                DeferredTaskFailure.objects.filter(pk=failure.pk).update(resolved_at=timezone.now())
+                resolved += 1
+            else:
+                DeferredTaskFailure.objects.filter(pk=failure.pk).update(
+                    attempts=F('attempts') + MAX_ATTEMPTS, error=repr(error)
+                )
+                failed += 1
+                self.stdout.write(self.style.WARNING(f'{failure.task} #{failure.pk} still failing: {error!r}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Resolved {resolved} deferred tasks, {failed} still failing'))
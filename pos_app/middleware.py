@@ -0,0 +1,143 @@
+# pos_app/middleware.py
+import io
+import logging
+import re
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from . import log, routers
+from .tenancy import tenant_for_request
+
+logger = logging.getLogger('pos_app.requests')
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestContextMiddleware:
+    """
+    Give every request a request ID and logging context.
+
+    A well-formed X-Request-ID from the proxy is reused so log lines can be
+    matched across services; the ID is echoed back on the response. Requests
+    slower than SLOW_REQUEST_MS are logged as warnings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'LOG_TRACE_SAMPLE_RATE', 0.0)
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 1000)
+
+    def __call__(self, request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = None
+
+        context, token = log.start_request(request_id, self.sample_rate)
+        request.request_id = context.request_id
+        try:
+            response = self.get_response(request)
+            response[REQUEST_ID_HEADER] = context.request_id
+
+            level = logging.WARNING if context.elapsed_ms >= self.slow_ms else logging.DEBUG
+            logger.log(level, 'request finished', extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+            })
+            return response
+        finally:
+            log.end_request(token)
+
+
+class RequestDecompressionMiddleware:
+    """
+    Accept request bodies sent with Content-Encoding: gzip or deflate.
+
+    Terminals on mobile data compress their sale uploads. The decompressed
+    body is capped at DATA_UPLOAD_MAX_MEMORY_SIZE, like an uncompressed one.
+    """
+
+    ENCODINGS = {'gzip', 'deflate'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = request.headers.get('Content-Encoding', '').strip().lower()
+        if encoding in self.ENCODINGS:
+            limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 2621440
+            # wbits=47 accepts both gzip and zlib framing
+            decompressor = zlib.decompressobj(wbits=47)
+            try:
+                body = decompressor.decompress(request.body, limit + 1)
+            except zlib.error:
+                return JsonResponse({'error': 'Malformed compressed request body'}, status=400)
+            if len(body) > limit or decompressor.unconsumed_tail:
+                return JsonResponse({'error': 'Request body too large'}, status=413)
+
+            request._body = body
+            request._stream = io.BytesIO(body)
+            request.META['CONTENT_LENGTH'] = str(len(body))
+            del request.META['HTTP_CONTENT_ENCODING']
+        return self.get_response(request)
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """
+    Gzip JSON responses for clients that accept it.
+
+    Limited to JSON so HTML pages carrying CSRF tokens are not exposed to
+    compression side channels (BREACH); static files are already
+    precompressed by WhiteNoise.
+    """
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+        return super().process_response(request, response)
+
+
+class TenantMiddleware:
+    """
+    Attach request.tenant: the business, role and employee the user acts as.
+
+    Resolved on first use through the session (see pos_app.tenancy), so
+    requests that never look at it cost nothing. Must come after
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = SimpleLazyObject(lambda: tenant_for_request(request))
+        return self.get_response(request)
+
+
+class ReplicaPinMiddleware:
+    """
+    Keep a client that has just written on the primary database for
+    REPLICA_PIN_SECONDS, so its reports are not read from a lagging replica
+    (see pos_app.routers). Not used without a replica.
+    """
+
+    def __init__(self, get_response):
+        if not routers.replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in routers.SAFE_METHODS:
+            response.set_cookie(
+                routers.PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax',
+                secure=request.is_secure(),
+            )
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0008_debtpayment_sale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sale_submissions', to='pos_app.business')),
+                ('sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='pos_app.sale')),
+            ],
+            options={
+                'unique_together': {('business', 'key')},
+            },
+        ),
+    ]
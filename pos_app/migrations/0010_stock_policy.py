@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0009_salesubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businesssettings',
+            name='stock_policy',
+            field=models.CharField(choices=[('block', 'Block sales that exceed stock'), ('warn', 'Allow negative stock and warn'), ('allow', 'Allow negative stock')], default='block', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='stock_quantity',
+            field=models.IntegerField(default=0),
+        ),
+    ]
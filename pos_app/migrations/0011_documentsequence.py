@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0010_stock_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10)),
+                ('next_value', models.BigIntegerField(default=1)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_sequences', to='pos_app.business')),
+            ],
+            options={
+                'unique_together': {('business', 'prefix')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0011_documentsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='business',
+            name='catalog_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
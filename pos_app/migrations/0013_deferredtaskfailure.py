@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0012_business_catalog_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeferredTaskFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=255)),
+                ('args', models.JSONField(default=list)),
+                ('error', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
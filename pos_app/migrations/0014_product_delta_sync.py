@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0013_deferredtaskfailure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['business', 'updated_at'], name='product_business_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='producttombstone',
+            name='business',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tombstones', to='pos_app.business'),
+        ),
+        migrations.AddIndex(
+            model_name='producttombstone',
+            index=models.Index(fields=['business', 'deleted_at'], name='tombstone_business_deleted_idx'),
+        ),
+    ]
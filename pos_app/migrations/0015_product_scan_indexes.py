@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0014_product_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['business', 'barcode'], name='product_business_barcode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['business', 'sku'], name='product_business_sku_idx'),
+        ),
+    ]
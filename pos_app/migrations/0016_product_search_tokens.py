@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_existing_products(apps, schema_editor):
+    from pos_app.search import product_tokens
+
+    Product = apps.get_model('pos_app', 'Product')
+    ProductSearchToken = apps.get_model('pos_app', 'ProductSearchToken')
+    tokens = []
+    for pk, business_id, name, sku, barcode in Product.objects.values_list(
+        'pk', 'business_id', 'name', 'sku', 'barcode'
+    ).iterator(chunk_size=500):
+        tokens.extend(
+            ProductSearchToken(business_id=business_id, product_id=pk, token=token)
+            for token in product_tokens(name, sku, barcode)
+        )
+        if len(tokens) >= 5000:
+            ProductSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    ProductSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0015_product_scan_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=8)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_search_tokens', to='pos_app.business')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='pos_app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['business', 'token', 'product'], name='search_token_lookup_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
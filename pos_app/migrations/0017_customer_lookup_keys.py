@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:57
+
+from django.db import migrations, models
+
+
+def fill_lookup_keys(apps, schema_editor):
+    from pos_app.customers import name_keys, normalize_phone
+
+    Customer = apps.get_model('pos_app', 'Customer')
+    batch = []
+    for customer in Customer.objects.only('pk', 'first_name', 'last_name', 'phone').iterator(chunk_size=1000):
+        customer.phone_key = normalize_phone(customer.phone)
+        customer.name_key, customer.surname_key = name_keys(customer.first_name, customer.last_name)
+        batch.append(customer)
+        if len(batch) == 1000:
+            Customer.objects.bulk_update(batch, ['phone_key', 'name_key', 'surname_key'])
+            batch = []
+    Customer.objects.bulk_update(batch, ['phone_key', 'name_key', 'surname_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0016_product_search_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='name_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='surname_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=201),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'phone_key'], name='customer_business_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'name_key'], name='customer_business_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'surname_key'], name='customer_business_surname_idx'),
+        ),
+        migrations.RunPython(fill_lookup_keys, migrations.RunPython.noop),
+    ]
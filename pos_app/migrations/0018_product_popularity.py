@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def count_past_sales(apps, schema_editor):
+    Product = apps.get_model('pos_app', 'Product')
+    ProductPopularity = apps.get_model('pos_app', 'ProductPopularity')
+    totals = Product.objects.filter(sale_items__isnull=False).values_list('pk', 'business_id').annotate(
+        sold=Sum('sale_items__quantity')
+    )
+    ProductPopularity.objects.bulk_create(
+        [ProductPopularity(product_id=pk, business_id=business_id, quantity_sold=sold) for pk, business_id, sold in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0017_customer_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity_sold', models.BigIntegerField(default=0)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_popularity', to='pos_app.business')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='popularity', to='pos_app.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product popularity',
+                'indexes': [models.Index(fields=['business', '-quantity_sold'], name='popularity_business_sold_idx')],
+            },
+        ),
+        migrations.RunPython(count_past_sales, migrations.RunPython.noop),
+    ]
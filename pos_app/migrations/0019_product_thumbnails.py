@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0018_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
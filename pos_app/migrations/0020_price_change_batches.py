@@ -0,0 +1,43 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0019_product_thumbnails'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChangeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rule', models.CharField(choices=[('percent', 'Percentage change'), ('delta', 'Fixed amount change'), ('margin', 'Target margin')], max_length=10)),
+                ('value', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('round_to', models.DecimalField(decimal_places=2, default=0.01, max_digits=10)),
+                ('selection', models.CharField(blank=True, max_length=255)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_change_batches', to='pos_app.business')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='price_change_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('new_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='pos_app.product')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='pos_app.pricechangebatch')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0020_price_change_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='business',
+            name='staff_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
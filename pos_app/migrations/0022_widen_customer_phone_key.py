@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0021_business_staff_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='phone_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=24),
+        ),
+    ]
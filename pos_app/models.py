@@ -1,8 +1,7 @@
 # pos_app/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
-import uuid
 from django.core.validators import MinValueValidator
 
 class Business(models.Model):
@@ -33,6 +32,8 @@ class Business(models.Model):
     tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
     currency_symbol = models.CharField(max_length=5, choices=CURRENCY_SYMBOL_CHOICES, default='$')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_businesses')
+    catalog_version = models.BigIntegerField(default=0, editable=False)  # Bumped on product/VAT changes, see pos_app.pricing
+    staff_version = models.BigIntegerField(default=0, editable=False)  # Bumped on employee changes, see pos_app.tenancy
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -59,6 +60,14 @@ class BusinessSettings(models.Model):
     show_vat_on_receipt = models.BooleanField(default=True)
     vat_rounding = models.CharField(max_length=10, choices=[('round', 'Round'), ('floor', 'Floor'), ('ceil', 'Ceiling')], default='round')
     
+    # Overselling
+    STOCK_POLICY_CHOICES = [
+        ('block', 'Block sales that exceed stock'),
+        ('warn', 'Allow negative stock and warn'),
+        ('allow', 'Allow negative stock'),
+    ]
+    stock_policy = models.CharField(max_length=10, choices=STOCK_POLICY_CHOICES, default='block')
+    
     def __str__(self):
         return f"Settings for {self.business.name}"
 
@@ -126,14 +135,26 @@ class Product(models.Model):
     vat_category = models.ForeignKey(VATCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')  # New VAT category
     purchase_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     selling_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
-    stock_quantity = models.PositiveIntegerField(default=0)
+    stock_quantity = models.IntegerField(default=0)  # Negative only when BusinessSettings.stock_policy allows it
     unit = models.CharField(max_length=10, choices=UNIT_CHOICES, default='pcs')
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    # Content hash of the thumbnails made from `thumbnail_source`; see pos_app.images
+    thumbnail_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
+    thumbnail_source = models.CharField(max_length=255, blank=True, default='', editable=False)
     is_active = models.BooleanField(default=True)
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='products')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Delta catalog sync: products of a business changed since a cursor
+            models.Index(fields=['business', 'updated_at'], name='product_business_updated_idx'),
+            # Scanner lookups (pos_app.scan)
+            models.Index(fields=['business', 'barcode'], name='product_business_barcode_idx'),
+            models.Index(fields=['business', 'sku'], name='product_business_sku_idx'),
+        ]
+    
     def __str__(self):
         return self.name
     
@@ -143,11 +164,21 @@ class Product(models.Model):
             return ((self.selling_price - self.purchase_price) / self.selling_price) * 100
         return 0
     
+    def cached_vat_category(self):
+        """The product's VAT category from the per-worker cache (pos_app.business_config), without a query"""
+        from .business_config import vat_category
+        return vat_category(self.business_id, self.vat_category_id)
+    
+    def _charges_vat(self):
+        category = self.cached_vat_category()
+        return category is not None and category.vat_type != 'exempt'
+    
     @property
     def vat_rate(self):
         """Get the VAT rate for this product"""
-        if self.vat_category:
-            return self.vat_category.rate
+        category = self.cached_vat_category()
+        if category:
+            return category.rate
         return 0
     
     def calculate_vat_amount(self, price=None):
@@ -155,7 +186,7 @@ class Product(models.Model):
         if price is None:
             price = self.selling_price
         
-        if self.vat_category and self.vat_category.vat_type != 'exempt':
+        if self._charges_vat():
             return (price * self.vat_rate) / 100
         return 0
     
@@ -164,7 +195,7 @@ class Product(models.Model):
         if price is None:
             price = self.selling_price
         
-        if self.vat_category and self.vat_category.vat_type != 'exempt':
+        if self._charges_vat():
             return price / (1 + (self.vat_rate / 100))
         return price
     
@@ -173,10 +204,101 @@ class Product(models.Model):
         if price is None:
             price = self.selling_price
         
-        if self.vat_category and self.vat_category.vat_type != 'exempt':
+        if self._charges_vat():
             return price + self.calculate_vat_amount(price)
         return price
 
+class ProductTombstone(models.Model):
+    """
+    Marks a deleted product so terminals syncing the catalog by delta drop it.
+
+    Old tombstones can be purged with purge_product_tombstones; terminals
+    whose cursor is older than that get a full catalog instead.
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='product_tombstones')
+    product_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'deleted_at'], name='tombstone_business_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Deleted product {self.product_id}"
+
+class ProductSearchToken(models.Model):
+    """
+    One search token of a product, maintained by pos_app.search.
+
+    Tokens are the trigrams and 1-2 character word prefixes of the product's
+    normalized name, SKU and barcode.
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='product_search_tokens')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=8)
+    
+    class Meta:
+        indexes = [
+            # Covers the lookup: products of a business with a token
+            models.Index(fields=['business', 'token', 'product'], name='search_token_lookup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.token} -> {self.product_id}"
+
+class ProductPopularity(models.Model):
+    """
+    Units of a product sold so far, kept up to date after every sale.
+
+    Lets the POS screen show best sellers without aggregating sale history.
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='product_popularity')
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='popularity')
+    quantity_sold = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = 'product popularity'
+        indexes = [
+            models.Index(fields=['business', '-quantity_sold'], name='popularity_business_sold_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity_sold} sold"
+
+class PriceChangeBatch(models.Model):
+    """One bulk price change: which rule was applied to which selection, by whom"""
+    RULE_CHOICES = [
+        ('percent', 'Percentage change'),
+        ('delta', 'Fixed amount change'),
+        ('margin', 'Target margin'),
+    ]
+    
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='price_change_batches')
+    rule = models.CharField(max_length=10, choices=RULE_CHOICES)
+    value = models.DecimalField(max_digits=10, decimal_places=2)
+    round_to = models.DecimalField(max_digits=10, decimal_places=2, default=0.01)
+    selection = models.CharField(max_length=255, blank=True)  # e.g. "category: Drinks, search: soda"
+    product_count = models.PositiveIntegerField(default=0)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='price_change_batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.get_rule_display()} {self.value} on {self.product_count} products"
+
+class PriceChange(models.Model):
+    """Old and new selling price of one product in a PriceChangeBatch"""
+    batch = models.ForeignKey(PriceChangeBatch, on_delete=models.CASCADE, related_name='changes')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='price_changes')
+    old_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.old_price} -> {self.new_price}"
+
 class Customer(models.Model):
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
@@ -187,12 +309,32 @@ class Customer(models.Model):
     credit_limit = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Maximum credit allowed for this customer")
     current_debt = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Current outstanding debt")
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='customers')
+    # Normalized lookup keys, set in save(); see pos_app.customers
+    phone_key = models.CharField(max_length=24, blank=True, default='', editable=False)
+    name_key = models.CharField(max_length=201, blank=True, default='', editable=False)
+    surname_key = models.CharField(max_length=201, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'phone_key'], name='customer_business_phone_idx'),
+            models.Index(fields=['business', 'name_key'], name='customer_business_name_idx'),
+            models.Index(fields=['business', 'surname_key'], name='customer_business_surname_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
     
+    def save(self, *args, **kwargs):
+        from .customers import name_keys, normalize_phone
+        self.phone_key = normalize_phone(self.phone)
+        self.name_key, self.surname_key = name_keys(self.first_name, self.last_name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'phone_key', 'name_key', 'surname_key'}
+        super().save(*args, **kwargs)
+    
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
@@ -233,6 +375,23 @@ class Employee(models.Model):
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.get_role_display()}"
 
+class DocumentSequence(models.Model):
+    """
+    Next free number of a per-business document series (invoices, credit notes, ...).
+
+    Worker processes reserve blocks of numbers from this row and hand them out
+    from memory, see pos_app.sequences.
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='document_sequences')
+    prefix = models.CharField(max_length=10)
+    next_value = models.BigIntegerField(default=1)
+    
+    class Meta:
+        unique_together = ('business', 'prefix')
+    
+    def __str__(self):
+        return f"{self.prefix} #{self.next_value} for {self.business_id}"
+
 class Sale(models.Model):
     PAYMENT_CHOICES = [
         ('cash', 'Cash'),
@@ -273,7 +432,8 @@ class Sale(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.invoice_number:
-            self.invoice_number = f"INV-{uuid.uuid4().hex[:8].upper()}"
+            from .sequences import next_document_number
+            self.invoice_number = next_document_number(self.business_id, 'INV')
         super().save(*args, **kwargs)
     
     @property
@@ -320,6 +480,25 @@ class Sale(models.Model):
         """Check if this is a credit sale"""
         return self.payment_method == 'credit'
 
+class SaleSubmission(models.Model):
+    """
+    Idempotency key sent by a POS terminal with a sale.
+
+    A terminal that resends the same key gets the original sale back instead
+    of a duplicate. Rows are small and can be purged once terminals no longer
+    retry them (see the purge_sale_submissions command).
+    """
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='sale_submissions')
+    key = models.CharField(max_length=64)
+    sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='submissions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('business', 'key')
+    
+    def __str__(self):
+        return f"{self.key} -> {self.sale_id}"
+
 class SaleItem(models.Model):
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sale_items')
@@ -350,8 +529,8 @@ class SaleItem(models.Model):
         # Calculate subtotal
         self.subtotal = self.quantity * self.unit_price
         
-        # Calculate VAT amount per unit
-        if self.product and self.product.vat_category:
+        # Calculate VAT amount per unit (the VAT category comes from the per-worker cache)
+        if self.product and self.product.vat_category_id:
             self.vat_amount = self.product.calculate_vat_amount(self.unit_price)
         else:
             self.vat_amount = 0
@@ -386,10 +565,19 @@ class Inventory(models.Model):
     def save(self, *args, **kwargs):
         # Update product stock quantity
         is_new = self.pk is None
-        if is_new:  # Only update stock on new records to prevent double-counting on updates
-            self.product.stock_quantity += self.quantity
-            self.product.save()
-        super().save(*args, **kwargs)
+        if not is_new:
+            super().save(*args, **kwargs)
+            return
+        
+        # Only update stock on new records to prevent double-counting on updates.
+        # The increment runs in the database so concurrent tills cannot lose updates.
+        from .catalog import invalidate_cached_stock
+        from .stock import adjust_stock
+        with transaction.atomic():
+            adjust_stock(self.product_id, self.quantity)
+            super().save(*args, **kwargs)
+            invalidate_cached_stock(self.business_id)
+        self.product.refresh_from_db(fields=['stock_quantity'])
 
 class Supplier(models.Model):
     name = models.CharField(max_length=255)
@@ -492,8 +680,8 @@ class CreditNote(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.credit_note_number:
-            import uuid
-            self.credit_note_number = f"CN-{uuid.uuid4().hex[:8].upper()}"
+            from .sequences import next_document_number
+            self.credit_note_number = next_document_number(self.business_id, 'CN')
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -523,8 +711,8 @@ class DebtPayment(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.payment_reference:
-            import uuid
-            self.payment_reference = f"DP-{uuid.uuid4().hex[:8].upper()}"
+            from .sequences import next_document_number
+            self.payment_reference = next_document_number(self.business_id, 'DP')
         
         # Update customer debt when payment is saved
         if self.pk is None:  # Only on creation
@@ -534,4 +722,21 @@ class DebtPayment(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Payment {self.payment_reference} - {self.customer.full_name} - {self.amount}"
\ No newline at end of file
+        return f"Payment {self.payment_reference} - {self.customer.full_name} - {self.amount}"
+
+class DeferredTaskFailure(models.Model):
+    """
+    A post-commit task that still failed after its retries (see pos_app.tasks).
+
+    The task and its arguments are kept so it can be run again with the
+    retry_deferred_tasks command once the cause is fixed.
+    """
+    task = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    error = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.task} ({self.attempts} attempts)"
@@ -0,0 +1,123 @@
+# pos_app/pricing.py
+"""
+Server-side cart pricing and VAT.
+
+Each business's catalog is cached as a rate table, {product_id: ProductRate},
+keyed by Business.catalog_version. The version is bumped whenever a product or
+VAT category changes (see pos_app.signals), so every worker picks up a fresh
+table on its next request without any cross-process invalidation, and a warm
+table prices a cart without touching the database.
+"""
+import time
+from collections import namedtuple
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import Business, Product
+
+CENT = Decimal('0.01')
+RATE_TABLE_TIMEOUT = 60 * 60 * 24
+ROUNDING_MODES = {
+    'round': ROUND_HALF_UP,
+    'floor': ROUND_FLOOR,
+    'ceil': ROUND_CEILING,
+}
+
+ProductRate = namedtuple('ProductRate', ['price', 'vat_rate'])
+PricedLine = namedtuple('PricedLine', ['product_id', 'quantity', 'unit_price', 'unit_vat', 'subtotal'])
+
+
+class PricedCart:
+    """Priced lines and the sale totals derived from them"""
+
+    def __init__(self, lines, subtotal, tax_amount, discount_amount, total_amount):
+        self.lines = lines
+        self.subtotal = subtotal
+        self.tax_amount = tax_amount
+        self.discount_amount = discount_amount
+        self.total_amount = total_amount
+
+    def as_dict(self):
+        return {
+            'subtotal': str(self.subtotal),
+            'tax_amount': str(self.tax_amount),
+            'discount_amount': str(self.discount_amount),
+            'total_amount': str(self.total_amount),
+        }
+
+
+def rate_table_key(business):
+    return f'pricing:rates:{business.pk}:{business.catalog_version}'
+
+
+def get_rate_table(business):
+    """Return {product_id: ProductRate(price, vat_rate)} for every product of the business"""
+    key = rate_table_key(business)
+    table = cache.get(key)
+    if table is None:
+        rows = Product.objects.filter(business=business).values_list(
+            'pk', 'selling_price', 'vat_category__rate', 'vat_category__vat_type'
+        )
+        table = {
+            pk: ProductRate(price, rate if rate is not None and vat_type != 'exempt' else Decimal('0'))
+            for pk, price, rate, vat_type in rows
+        }
+        cache.set(key, table, RATE_TABLE_TIMEOUT)
+    return table
+
+
+def bump_catalog_version(business_id):
+    """
+    Invalidate the cached rate tables of a business.
+
+    The new version is the current time in microseconds (or the old one plus
+    one, whichever is larger), so a version from a rolled-back transaction is
+    never handed out again with different catalog contents.
+    """
+    now = int(time.time() * 1_000_000)
+    Business.objects.filter(pk=business_id).update(
+        catalog_version=Greatest(F('catalog_version') + 1, Value(now))
+    )
+
+
+def unit_vat(unit_price, vat_rate, inclusive, rounding=ROUND_HALF_UP):
+    """VAT contained in (inclusive) or added to (exclusive) one unit, rounded to cents"""
+    if not vat_rate:
+        return Decimal('0.00')
+    if inclusive:
+        vat = unit_price * vat_rate / (100 + vat_rate)
+    else:
+        vat = unit_price * vat_rate / 100
+    return vat.quantize(CENT, rounding=rounding)
+
+
+def price_cart(business_settings, rates, lines, discount_amount=Decimal('0')):
+    """
+    Price (product_id, quantity, unit_price) lines in one pass.
+
+    VAT is worked out per unit and rounded with BusinessSettings.vat_rounding,
+    which is what SaleItem.vat_amount stores; line and sale VAT are exact
+    multiples of it, so receipts always add up.
+    """
+    inclusive = business_settings.vat_inclusive_pricing
+    rounding = ROUNDING_MODES.get(business_settings.vat_rounding, ROUND_HALF_UP)
+
+    priced = []
+    net = Decimal('0')
+    tax = Decimal('0')
+    for product_id, quantity, unit_price in lines:
+        vat = Decimal('0.00')
+        if business_settings.enable_vat:
+            vat = unit_vat(unit_price, rates[product_id].vat_rate, inclusive, rounding)
+        line_total = unit_price * quantity
+        line_vat = vat * quantity
+        net += line_total - line_vat if inclusive else line_total
+        tax += line_vat
+        priced.append(PricedLine(product_id, quantity, unit_price, vat, line_total))
+
+    net = net.quantize(CENT)
+    tax = tax.quantize(CENT)
+    return PricedCart(priced, net, tax, discount_amount, net + tax - discount_amount)
@@ -0,0 +1,377 @@
+# pos_app/product_io.py
+"""
+Bulk product import and export as CSV or JSON lines.
+
+Rows are keyed by SKU: a row whose SKU the business already uses updates
+that product, any other row creates one. Files are read as a stream and
+written a chunk of rows at a time, each chunk in its own transaction with a
+handful of queries: one to load and lock the chunk's existing products, one
+to check barcodes, bulk_create / bulk_update for the products, one UPDATE
+adjusting their stock and bulk_create for their Inventory rows. Categories and VAT categories are resolved through
+dicts built once per import; unknown categories are created.
+
+A row only changes the columns the file has, so a file with just sku and
+selling_price reprices products and leaves everything else alone. Rows with
+errors are skipped and reported with their line number.
+
+bulk_create and bulk_update skip signals, so every chunk reindexes the
+products it touched for search and bumps Business.catalog_version itself.
+"""
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, Inventory, Product, VATCategory
+from .pricing import bump_catalog_version
+from .search import index_products
+from .stock import decrement_stock
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'jsonl')
+# Column order of exports, which import again unchanged
+COLUMNS = (
+    'sku', 'name', 'barcode', 'description', 'category', 'vat_code', 'unit',
+    'purchase_price', 'selling_price', 'stock_quantity', 'is_active',
+)
+TEXT_COLUMNS = ('name', 'barcode', 'description', 'unit')
+PRICE_COLUMNS = ('purchase_price', 'selling_price')
+# Columns whose change needs the search index updated
+INDEXED_COLUMNS = ('name', 'sku', 'barcode')
+
+# Limits of the price columns (max_digits=10, decimal_places=2) and of the
+# stock_quantity integer column
+MAX_PRICE = Decimal('100000000')
+MIN_STOCK, MAX_STOCK = -2**31, 2**31 - 1
+
+UNITS = {value for value, _ in Product.UNIT_CHOICES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'active'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'inactive'}
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)  # (line, message), the first MAX_REPORTED_ERRORS
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+        }
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt='csv'):
+    """(line number, {column: text}) pairs of a binary or text stream"""
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                yield line, None
+                continue
+            yield line, row if isinstance(row, dict) else None
+        return
+    reader = csv.DictReader(stream)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _price(value, column):
+    try:
+        price = Decimal(_text(value).replace(',', ''))
+    except InvalidOperation:
+        raise RowError(f'{column} is not a number')
+    if not price.is_finite():
+        raise RowError(f'{column} is not a number')
+    if price < 0:
+        raise RowError(f'{column} cannot be negative')
+    if price >= MAX_PRICE:
+        raise RowError(f'{column} must be below {MAX_PRICE}')
+    return price.quantize(Decimal('0.01'))
+
+
+def _stock(value):
+    try:
+        stock = int(Decimal(_text(value)))
+    except (InvalidOperation, ValueError, OverflowError):
+        raise RowError('stock_quantity is not a number')
+    if not MIN_STOCK <= stock <= MAX_STOCK:
+        raise RowError(f'stock_quantity must be between {MIN_STOCK} and {MAX_STOCK}')
+    return stock
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = _text(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise RowError('is_active must be true or false')
+
+
+def parse_row(row):
+    """
+    The product fields a row sets, as {field: value}; raises RowError.
+
+    Empty cells count as missing, except for barcode and description, which
+    they clear.
+    """
+    if row is None:
+        raise RowError('not a JSON object')
+    row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+    sku = _text(row.get('sku'))
+    if not sku:
+        raise RowError('sku is required')
+    if len(sku) > 50:
+        raise RowError('sku is longer than 50 characters')
+
+    values = {'sku': sku}
+    for column in TEXT_COLUMNS:
+        if column in row:
+            text = _text(row[column])
+            if text or column in ('barcode', 'description'):
+                values[column] = text or None
+    if 'unit' in values and values['unit'] not in UNITS:
+        raise RowError(f'unknown unit {values["unit"]!r}')
+    for column, length in (('name', 255), ('barcode', 100)):
+        if values.get(column) and len(values[column]) > length:
+            raise RowError(f'{column} is longer than {length} characters')
+    for column in PRICE_COLUMNS:
+        if _text(row.get(column)):
+            values[column] = _price(row[column], column)
+    if _text(row.get('stock_quantity')):
+        values['stock_quantity'] = _stock(row['stock_quantity'])
+    if _text(row.get('is_active')):
+        values['is_active'] = _boolean(row['is_active'])
+    if _text(row.get('category')):
+        values['category'] = _text(row['category'])[:100]
+    if _text(row.get('vat_code')):
+        values['vat_code'] = _text(row['vat_code']).upper()
+    return values
+
+
+class ProductImporter:
+    """Upserts rows into one business's products; use import_products"""
+
+    def __init__(self, business, user=None, chunk_size=IMPORT_CHUNK_SIZE):
+        self.business = business
+        self.user = user
+        self.chunk_size = chunk_size
+        self.result = ImportResult()
+        self.categories = {}
+        for pk, name in Category.objects.filter(business=business).order_by('-pk').values_list('pk', 'name'):
+            self.categories[name.strip().lower()] = pk  # the oldest of same-named categories wins
+        self.vat_categories = {
+            code.upper(): pk for code, pk in VATCategory.objects.filter(business=business).values_list('code', 'pk')
+        }
+
+    def run(self, rows):
+        chunk = []
+        for line, row in rows:
+            chunk.append((line, row))
+            if len(chunk) == self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.write_chunk(chunk)
+        return self.result
+
+    def category_id(self, name):
+        key = name.lower()
+        if key not in self.categories:
+            self.categories[key] = Category.objects.create(business=self.business, name=name).pk
+        return self.categories[key]
+
+    def parse_chunk(self, chunk):
+        """{sku: (line, values)} of the chunk's valid rows; a repeated SKU keeps its last row"""
+        parsed = {}
+        for line, row in chunk:
+            try:
+                values = parse_row(row)
+                code = values.pop('vat_code', None)
+                if code is not None:
+                    if code not in self.vat_categories:
+                        raise RowError(f'unknown VAT code {code!r}')
+                    values['vat_category_id'] = self.vat_categories[code]
+            except RowError as exc:
+                self.result.error(line, str(exc))
+                continue
+            parsed[values['sku']] = (line, values)
+        return parsed
+
+    def check_barcodes(self, parsed, existing):
+        """Drop rows whose barcode is already taken by another product (barcodes are unique across businesses)"""
+        claimed = {}
+        for sku, (line, values) in list(parsed.items()):
+            barcode = values.get('barcode')
+            if barcode:
+                if barcode in claimed:
+                    self.result.error(line, f'barcode {barcode} is repeated in the file')
+                    del parsed[sku]
+                else:
+                    claimed[barcode] = sku
+        if not claimed:
+            return
+        taken = Product.objects.filter(barcode__in=claimed).values_list('barcode', 'pk')
+        for barcode, pk in taken:
+            sku = claimed[barcode]
+            if sku in parsed and (sku not in existing or existing[sku].pk != pk):
+                self.result.error(parsed.pop(sku)[0], f'barcode {barcode} belongs to another product')
+
+    def write_chunk(self, chunk):
+        parsed = self.parse_chunk(chunk)
+        if not parsed:
+            return
+        with transaction.atomic():
+            existing = {}
+            # Locked, so stock sold meanwhile cannot slip between reading it and adjusting it
+            products = Product.objects.select_for_update().filter(business=self.business, sku__in=parsed)
+            for product in products.order_by('-pk'):
+                existing[product.sku] = product  # the oldest of products sharing a SKU wins
+            self.check_barcodes(parsed, existing)
+
+            now = timezone.now()
+            created, changed, changed_fields, reindex, stock_moves = [], [], set(), [], []
+            adjustments = {}  # product id -> stock delta
+            updated = 0
+            for sku, (line, values) in parsed.items():
+                category = values.pop('category', None)
+                if category is not None:
+                    values['category_id'] = self.category_id(category)
+                product = existing.get(sku)
+                if product is None:
+                    if not values.get('name') or 'selling_price' not in values:
+                        self.result.error(line, 'name and selling_price are required for new products')
+                        continue
+                    values.setdefault('purchase_price', Decimal('0.00'))
+                    created.append(Product(business=self.business, **values))
+                    continue
+                updates = {name: value for name, value in values.items() if getattr(product, name) != value}
+                if not updates:
+                    self.result.unchanged += 1
+                    continue
+                updated += 1
+                if 'stock_quantity' in updates:
+                    # Applied as an adjustment, the same one the ledger records
+                    adjustments[product.pk] = updates.pop('stock_quantity') - product.stock_quantity
+                    stock_moves.append((product.pk, adjustments[product.pk], 'Import'))
+                    if not updates:
+                        continue
+                for name, value in updates.items():
+                    setattr(product, name, value)
+                product.updated_at = now
+                changed.append(product)
+                changed_fields.update(updates)
+                if any(name in updates for name in INDEXED_COLUMNS):
+                    reindex.append(product.pk)
+
+            if created:
+                Product.objects.bulk_create(created, batch_size=self.chunk_size)
+                # Not every database returns primary keys from bulk_create
+                ids = dict(
+                    Product.objects.filter(business=self.business, sku__in=[p.sku for p in created])
+                    .order_by('pk').values_list('sku', 'pk')
+                )
+                for product in created:
+                    product.pk = product.pk or ids[product.sku]
+                    reindex.append(product.pk)
+                    if product.stock_quantity:
+                        stock_moves.append((product.pk, product.stock_quantity, 'Initial Stock'))
+            if changed:
+                Product.objects.bulk_update(changed, sorted(changed_fields) + ['updated_at'], batch_size=self.chunk_size)
+            if adjustments:
+                decrement_stock({pk: -delta for pk, delta in adjustments.items()})
+            if stock_moves:
+                Inventory.objects.bulk_create([
+                    Inventory(
+                        product_id=pk, transaction_type='adjustment', quantity=quantity, reference=reference,
+                        business=self.business, created_by=self.user,
+                    )
+                    for pk, quantity, reference in stock_moves if quantity
+                ], batch_size=self.chunk_size)
+            if reindex:
+                index_products(Product.objects.filter(pk__in=reindex))
+            if created or updated:
+                bump_catalog_version(self.business.pk)
+
+        self.result.created += len(created)
+        self.result.updated += updated
+
+
+def import_products(business, stream, fmt='csv', user=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Upsert the products of a CSV or JSON lines stream by SKU; returns an ImportResult"""
+    return ProductImporter(business, user, chunk_size).run(read_rows(stream, fmt))
+
+
+def export_rows(business):
+    """The business's products as dicts of COLUMNS, read in one joined query"""
+    products = Product.objects.filter(business=business).order_by('pk').values_list(
+        'sku', 'name', 'barcode', 'description', 'category__name', 'vat_category__code', 'unit',
+        'purchase_price', 'selling_price', 'stock_quantity', 'is_active',
+    )
+    for row in products.iterator(chunk_size=IMPORT_CHUNK_SIZE):
+        values = dict(zip(COLUMNS, row))
+        for column in ('sku', 'barcode', 'description', 'category', 'vat_code'):
+            values[column] = values[column] or ''
+        for column in PRICE_COLUMNS:
+            values[column] = str(values[column])
+        yield values
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def stream_export(business, fmt='csv'):
+    """Lines of an export file, to feed a StreamingHttpResponse or a file"""
+    rows = export_rows(business)
+    if fmt == 'jsonl':
+        return (json.dumps(row) + '\n' for row in rows)
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow([row[column] for column in COLUMNS])
+    return lines()
@@ -0,0 +1,134 @@
+# pos_app/repricing.py
+"""
+Bulk price changes.
+
+A rule turns into one SQL expression over the product row:
+
+* percent: selling_price * (1 + value / 100)
+* delta:   selling_price + value
+* margin:  purchase_price / (1 - value / 100), the price that earns a
+  value% margin on the selling price (Product.profit_margin)
+
+rounded to a multiple of round_to and never below zero. The preview
+annotates the selected products with that expression, and applying it is
+one UPDATE ... SET selling_price = <expression> over the rows that change,
+so both always agree. The rows are locked while the change is applied and
+every changed price is recorded in a PriceChangeBatch.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .models import PriceChange, PriceChangeBatch, Product, PurchaseItem
+from .pricing import bump_catalog_version
+from .search import search_product_ids
+
+RULES = ('percent', 'delta', 'margin')
+ROUNDING_CHOICES = ('0.01', '1', '5', '10')
+PREVIEW_LIMIT = 200
+
+PRICE = DecimalField(max_digits=10, decimal_places=2)
+
+
+class RepricingError(ValueError):
+    pass
+
+
+def select_products(business, category=None, vat_category=None, supplier=None, query=''):
+    """
+    Active products of the business matching every given criterion.
+
+    A supplier selects the products that were ever bought from it; a query
+    goes through the product search index and selects every match, not just
+    the first page an interactive search would show.
+    """
+    products = Product.objects.filter(business=business, is_active=True)
+    if category is not None:
+        products = products.filter(category=category)
+    if vat_category is not None:
+        products = products.filter(vat_category=vat_category)
+    if supplier is not None:
+        bought = PurchaseItem.objects.filter(purchase__supplier=supplier, purchase__business=business)
+        products = products.filter(pk__in=bought.values('product_id'))
+    if query:
+        products = products.filter(pk__in=search_product_ids(business, query, products, all_matches=True))
+    return products
+
+
+def price_expression(rule, value, round_to=Decimal('0.01')):
+    """The new selling price of a product row under a rule, as an expression"""
+    value = Decimal(value)
+    round_to = Decimal(round_to)
+    if round_to <= 0:
+        raise RepricingError('Rounding must be positive')
+    if rule == 'percent':
+        if value <= -100:
+            raise RepricingError('A price cannot go down by 100% or more')
+        price = F('selling_price') * Value(1 + value / 100, output_field=PRICE)
+    elif rule == 'delta':
+        price = F('selling_price') + Value(value, output_field=PRICE)
+    elif rule == 'margin':
+        if not 0 <= value < 100:
+            raise RepricingError('A margin must be at least 0% and below 100%')
+        price = F('purchase_price') / Value(1 - value / 100, output_field=PRICE)
+    else:
+        raise RepricingError(f'Unknown rule {rule}')
+    # The outer Round keeps binary floating point (SQLite) from leaving
+    # 110.00000000000001 behind after multiplying by the step
+    rounded = Round(Round(price / Value(round_to, output_field=PRICE)) * Value(round_to, output_field=PRICE), 2)
+    return Greatest(rounded, Value(Decimal('0.00'), output_field=PRICE), output_field=PRICE)
+
+
+def applicable(products, rule):
+    """Margins are worked out from the purchase price, so products without one are left alone"""
+    if rule == 'margin':
+        return products.filter(purchase_price__gt=0)
+    return products
+
+
+def price_changes(products, rule, value, round_to=Decimal('0.01')):
+    """(product_id, name, sku, old price, new price) of the products whose price would change"""
+    rows = (
+        applicable(products, rule).annotate(new_price=price_expression(rule, value, round_to))
+        .order_by('name', 'pk').values_list('pk', 'name', 'sku', 'selling_price', 'new_price')
+    )
+    return [
+        (pk, name, sku, old, Decimal(new).quantize(Decimal('0.01')))
+        for pk, name, sku, old, new in rows
+        if Decimal(new).quantize(Decimal('0.01')) != old
+    ]
+
+
+def preview(products, rule, value, round_to=Decimal('0.01'), limit=PREVIEW_LIMIT):
+    """{"count", "changes", "skipped"}: the first `limit` changes of a rule, without applying it"""
+    changes = price_changes(products, rule, value, round_to)
+    return {
+        'count': len(changes),
+        'changes': changes[:limit],
+        'skipped': products.count() - applicable(products, rule).count(),
+    }
+
+
+def apply_price_change(business, products, rule, value, round_to=Decimal('0.01'), user=None, selection=''):
+    """Change the selling price of the products in one UPDATE; returns the PriceChangeBatch"""
+    expression = price_expression(rule, value, round_to)
+    with transaction.atomic():
+        # Lock the selection so the audit records exactly what the UPDATE does
+        changes = price_changes(products.select_for_update(), rule, value, round_to)
+        batch = PriceChangeBatch.objects.create(
+            business=business, rule=rule, value=value, round_to=round_to,
+            selection=selection[:255], product_count=len(changes), created_by=user,
+        )
+        if not changes:
+            return batch
+        changed = [pk for pk, *_ in changes]
+        Product.objects.filter(pk__in=changed).update(selling_price=expression, updated_at=timezone.now())
+        PriceChange.objects.bulk_create([
+            PriceChange(batch=batch, product_id=pk, old_price=old, new_price=new)
+            for pk, _, _, old, new in changes
+        ], batch_size=1000)
+        bump_catalog_version(business.pk)
+    return batch
@@ -0,0 +1,92 @@
+# pos_app/routers.py
+"""
+Read replica routing for reports and exports.
+
+Views wrapped in @use_replica read the POS tables from the 'replica'
+database when one is configured (DATABASE_REPLICA_HOST); every other read,
+every write, and sessions and auth everywhere stay on the primary. So does a
+read inside a transaction on the primary, which has to see its own writes.
+
+Replicas lag a little. A client that has just written, meaning it made any
+request other than GET, HEAD or OPTIONS, is pinned to the primary for
+REPLICA_PIN_SECONDS by a cookie (ReplicaPinMiddleware), so a report opened
+right after a sale or an edit includes it.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+PIN_COOKIE = 'pos_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_reading = contextvars.ContextVar('pos_replica_reads', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def pinned_to_primary(request):
+    return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+
+@contextmanager
+def replica_reads():
+    """Send reads of POS tables in this block to the replica"""
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def _stream_from_replica(content):
+    iterator = iter(content)
+    while True:
+        with replica_reads():
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+def use_replica(view):
+    """Run a read-only view against the replica, unless the client is pinned to the primary"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replica_configured() or pinned_to_primary(request):
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            response = view(request, *args, **kwargs)
+        if response.streaming:
+            # Streamed rows are read after the view returns
+            response.streaming_content = _stream_from_replica(response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if (
+            _reading.get()
+            and model._meta.app_label == 'pos_app'
+            and replica_configured()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,56 @@
+# pos_app/scan.py
+"""
+Exact barcode/SKU lookup for scanners.
+
+Each worker keeps a small LRU of code -> product entry, keyed by business and
+Business.catalog_version, so any catalog change makes the old entries
+unreachable. Entries also expire after SCAN_CACHE_TTL seconds, which bounds
+how stale the stock they carry can get. A miss costs one indexed query on
+(business, barcode) and, failing that, one on (business, sku).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .catalog import catalog_entry, product_rows
+from .models import Product
+
+SCAN_CACHE_SIZE = 5000
+SCAN_CACHE_TTL = 30  # seconds
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (business_id, catalog_version, code) -> (expires, entry or None)
+
+
+def find_code(business, code):
+    """Catalog entry of the active product with this barcode (or else SKU), or None"""
+    products = Product.objects.filter(business=business, is_active=True)
+    for field in ('barcode', 'sku'):
+        row = next(product_rows(products.filter(**{field: code})), None)
+        if row is not None:
+            return catalog_entry(row)
+    return None
+
+
+def lookup_code(business, code):
+    """find_code through the worker's LRU; unknown codes are remembered too"""
+    key = (business.pk, business.catalog_version, code)
+    now = time.monotonic()
+    with _lock:
+        cached = _entries.get(key)
+        if cached is not None and cached[0] > now:
+            _entries.move_to_end(key)
+            return cached[1]
+
+    entry = find_code(business, code)
+    with _lock:
+        _entries[key] = (now + SCAN_CACHE_TTL, entry)
+        _entries.move_to_end(key)
+        while len(_entries) > SCAN_CACHE_SIZE:
+            _entries.popitem(last=False)
+    return entry
+
+
+def clear_scan_cache():
+    with _lock:
+        _entries.clear()
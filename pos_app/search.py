@@ -0,0 +1,161 @@
+# pos_app/search.py
+"""
+Product search without LIKE '%...%' table scans.
+
+Products are indexed as ProductSearchToken rows: the trigrams of every word
+of their normalized name, SKU and barcode, plus 1 and 2 character word
+prefixes (stored as "^a", "^ab") so short queries work too. A query word of
+three or more characters matches products that have all of its trigrams; a
+shorter one matches products with a word starting with it. Candidates are
+then checked against their actual text and ranked: exact SKU or barcode
+first, then fields starting with the query, then everything else by name.
+
+A post_save receiver keeps the index current (see pos_app.signals).
+bulk_create skips signals, so code that bulk-creates products calls
+index_products afterwards; rebuild_search_index reindexes existing data.
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Case, Count, IntegerField, Q, When
+
+from .models import Product, ProductSearchToken
+
+SEARCH_LIMIT = 50
+MAX_CANDIDATES = 2000
+INDEX_CHUNK_SIZE = 500
+
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_SUBSTRING = 2
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    """Lowercase ASCII words separated by single spaces ("Café-Latte" -> "cafe latte")"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower()
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def word_tokens(word):
+    tokens = {'^' + word[:n] for n in (1, 2) if len(word) >= n}
+    tokens.update(word[i:i + 3] for i in range(len(word) - 2))
+    return tokens
+
+
+def query_tokens(word):
+    if len(word) < 3:
+        return {'^' + word}
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def product_tokens(name, sku, barcode):
+    tokens = set()
+    for text in (name, sku, barcode):
+        for word in normalize(text).split():
+            tokens |= word_tokens(word)
+    return tokens
+
+
+def index_product(product):
+    """Bring one product's tokens up to date, writing only the difference"""
+    tokens = product_tokens(product.name, product.sku, product.barcode)
+    existing = set(ProductSearchToken.objects.filter(product=product).values_list('token', flat=True))
+    if existing - tokens:
+        ProductSearchToken.objects.filter(product=product, token__in=existing - tokens).delete()
+    if tokens - existing:
+        ProductSearchToken.objects.bulk_create([
+            ProductSearchToken(business_id=product.business_id, product_id=product.pk, token=token)
+            for token in tokens - existing
+        ])
+
+
+def index_products(queryset):
+    """Rebuild the tokens of many products, a chunk at a time; returns how many were indexed"""
+    rows = queryset.values_list('pk', 'business_id', 'name', 'sku', 'barcode').order_by('pk')
+    count = 0
+    chunk = []
+    for row in rows.iterator(chunk_size=INDEX_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == INDEX_CHUNK_SIZE:
+            count += _index_chunk(chunk)
+            chunk = []
+    if chunk:
+        count += _index_chunk(chunk)
+    return count
+
+
+def _index_chunk(rows):
+    ProductSearchToken.objects.filter(product_id__in=[row[0] for row in rows]).delete()
+    # A product has a few dozen tokens, so bulk imports write them with a plain
+    # executemany rather than building a model instance for each
+    meta = ProductSearchToken._meta
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(meta.get_field(name).column) for name in ('business', 'product', 'token'))
+    sql = f'INSERT INTO {quote(meta.db_table)} ({columns}) VALUES (%s, %s, %s)'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (business_id, pk, token)
+            for pk, business_id, name, sku, barcode in rows
+            for token in product_tokens(name, sku, barcode)
+        ])
+    return len(rows)
+
+
+def match_rank(query, words, name, sku, barcode):
+    """Rank of a candidate for a query, or None when it does not really match"""
+    code = query.strip().lower()
+    if code and code in ((sku or '').lower(), (barcode or '').lower()):
+        return RANK_EXACT
+    fields = [normalize(text) for text in (name, sku, barcode)]
+    if not all(any(word in field for field in fields) for word in words):
+        return None  # every trigram is there, but not next to each other
+    phrase = ' '.join(words)
+    if any(field.startswith(phrase) for field in fields):
+        return RANK_PREFIX
+    return RANK_SUBSTRING
+
+
+def search_product_ids(business, query, products=None, limit=SEARCH_LIMIT, all_matches=False):
+    """
+    Ids of the business's products matching query, best first.
+
+    products narrows the search (active only, a category, ...) and defaults
+    to all products of the business. Interactive searches look at no more
+    than MAX_CANDIDATES index hits and return limit ids; all_matches returns
+    every match instead.
+    """
+    words = normalize(query).split()
+    if not words:
+        return []
+    if products is None:
+        products = Product.objects.filter(business=business)
+
+    tokens = set().union(*(query_tokens(word) for word in words))
+    candidates = (
+        ProductSearchToken.objects.filter(business=business, token__in=tokens)
+        .values('product').annotate(hits=Count('token', distinct=True)).filter(hits=len(tokens))
+        .values_list('product', flat=True)
+    )
+    if not all_matches:
+        candidates = list(candidates[:MAX_CANDIDATES])
+    code = query.strip()
+    matches = products.filter(Q(pk__in=candidates) | Q(sku=code) | Q(barcode=code))
+
+    ranked = []
+    for pk, name, sku, barcode in matches.values_list('pk', 'name', 'sku', 'barcode'):
+        rank = match_rank(query, words, name, sku, barcode)
+        if rank is not None:
+            ranked.append((rank, name.lower(), pk))
+    ranked.sort()
+    return [pk for _, _, pk in (ranked if all_matches else ranked[:limit])]
+
+
+def in_rank_order(queryset, ids):
+    """queryset restricted to ids, ordered as ids are"""
+    if not ids:
+        return queryset.none()
+    order = Case(*[When(pk=pk, then=i) for i, pk in enumerate(ids)], output_field=IntegerField())
+    return queryset.filter(pk__in=ids).order_by(order)
@@ -0,0 +1,95 @@
+# pos_app/sequences.py
+"""
+Per-business document numbers (INV-, CN-, DP-) allocated hi/lo style.
+
+Each worker process reserves a block of numbers from DocumentSequence in one
+short transaction and then hands them out from memory, so most documents get
+their number without touching the database. Numbers are increasing per worker
+and unique per business, but not gapless: a block that a worker does not use
+up before it restarts is skipped.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import DocumentSequence
+
+NUMBER_WIDTH = 6
+
+_lock = threading.Lock()
+_blocks = {}  # (business_id, prefix) -> [next, end)
+_owner_pid = os.getpid()
+
+
+def format_document_number(prefix, business_id, value):
+    return f"{prefix}-{business_id}-{value:0{NUMBER_WIDTH}d}"
+
+
+def _block_size():
+    return getattr(settings, 'DOCUMENT_SEQUENCE_BLOCK_SIZE', 50)
+
+
+def _in_transaction():
+    return connection.in_atomic_block
+
+
+def reserve_block(business_id, prefix, size):
+    """Reserve size numbers of a series and return the first one"""
+    with transaction.atomic():
+        updated = DocumentSequence.objects.filter(business_id=business_id, prefix=prefix).update(
+            next_value=F('next_value') + size
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(business_id=business_id, prefix=prefix, next_value=1 + size)
+                return 1
+            except IntegrityError:
+                # Another worker created the row first
+                DocumentSequence.objects.filter(business_id=business_id, prefix=prefix).update(
+                    next_value=F('next_value') + size
+                )
+        end = DocumentSequence.objects.filter(business_id=business_id, prefix=prefix).values_list(
+            'next_value', flat=True
+        ).get()
+    return end - size
+
+
+def next_document_number(business_id, prefix):
+    """
+    Return the next number of a business's document series, e.g. INV-12-000042.
+
+    Inside a caller's transaction a block cannot be cached, because rolling the
+    transaction back would hand the same numbers to another worker; a single
+    number is reserved in that transaction instead. Allocate before opening the
+    transaction to get the cached fast path.
+    """
+    global _owner_pid
+
+    if _in_transaction():
+        return format_document_number(prefix, business_id, reserve_block(business_id, prefix, 1))
+
+    with _lock:
+        # Blocks inherited from a parent process (preforking servers) belong to the parent
+        if _owner_pid != os.getpid():
+            _blocks.clear()
+            _owner_pid = os.getpid()
+
+        block = _blocks.get((business_id, prefix))
+        if block is None or block[0] >= block[1]:
+            size = _block_size()
+            start = reserve_block(business_id, prefix, size)
+            block = _blocks[(business_id, prefix)] = [start, start + size]
+
+        value = block[0]
+        block[0] += 1
+    return format_document_number(prefix, business_id, value)
+
+
+def clear_cached_blocks():
+    """Forget reserved blocks; their unused numbers are skipped"""
+    with _lock:
+        _blocks.clear()
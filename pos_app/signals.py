@@ -0,0 +1,88 @@
+# pos_app/signals.py
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .business_config import invalidate as invalidate_business_config
+from .images import generate_thumbnails, needs_thumbnails
+from .models import Business, BusinessSettings, Category, Employee, Product, ProductTombstone, VATCategory
+from .pricing import bump_catalog_version
+from .search import index_product
+from .tasks import defer
+from .tenancy import bump_staff_version
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=VATCategory)
+@receiver(post_delete, sender=VATCategory)
+def invalidate_catalog(sender, instance, **kwargs):
+    """The catalog changed, so cached rate tables and catalogs of the business are stale"""
+    bump_catalog_version(instance.business_id)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    index_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def queue_thumbnails(sender, instance, raw=False, **kwargs):
+    """A new or removed image needs its thumbnails (re)made"""
+    if not raw and needs_thumbnails(instance):
+        defer(generate_thumbnails, instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def record_product_tombstone(sender, instance, origin=None, **kwargs):
+    """Leave a tombstone so terminals syncing deltas drop the product"""
+    # Products going away with their business need no tombstone (and would
+    # point it at a business that is being deleted too)
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is not Product:
+        return
+    ProductTombstone.objects.create(business_id=instance.business_id, product_id=instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+@receiver(post_save, sender=VATCategory)
+@receiver(pre_delete, sender=VATCategory)
+def touch_category_products(sender, instance, **kwargs):
+    """Products show their category name and VAT rate, so they change with them"""
+    field = 'category' if sender is Category else 'vat_category'
+    Product.objects.filter(**{field: instance}).update(updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=Employee)
+def employee_moving(sender, instance, raw=False, **kwargs):
+    """An employee moved to another business leaves the old one too"""
+    if raw or instance.pk is None:
+        return
+    old_business = Employee.objects.filter(pk=instance.pk).values_list('business_id', flat=True).first()
+    if old_business is not None and old_business != instance.business_id:
+        bump_staff_version([old_business])
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def employee_changed(sender, instance, **kwargs):
+    """Cached tenants (roles) of the business's staff are stale"""
+    bump_staff_version([instance.business_id])
+
+
+@receiver(post_save, sender=Business)
+def business_owner_changed(sender, instance, raw=False, **kwargs):
+    """Owning a business outranks being employed by another one"""
+    if not raw:
+        bump_staff_version(Employee.objects.filter(user_id=instance.owner_id).values_list('business_id', flat=True))
+
+
+@receiver(post_save, sender=BusinessSettings)
+@receiver(post_delete, sender=BusinessSettings)
+@receiver(post_save, sender=VATCategory)
+@receiver(post_delete, sender=VATCategory)
+def business_config_changed(sender, instance, **kwargs):
+    invalidate_business_config(instance.business_id)
@@ -0,0 +1,84 @@
+# pos_app/stock.py
+from django.db import models
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from .models import Product
+
+STOCK_POLICY_ALLOW = 'allow'
+STOCK_POLICY_WARN = 'warn'
+STOCK_POLICY_BLOCK = 'block'
+
+
+class InsufficientStock(Exception):
+    """Raised when a conditional stock decrement would oversell a product"""
+
+    def __init__(self, quantities):
+        super().__init__('Insufficient stock')
+        self.quantities = quantities
+
+    def shortages(self):
+        """
+        Products that cannot cover the requested quantity.
+
+        Call this after the failed transaction has been rolled back, otherwise
+        the rows the UPDATE did match are already decremented.
+        """
+        rows = Product.objects.filter(pk__in=self.quantities.keys()).values_list('pk', 'name', 'stock_quantity')
+        return [
+            {'product_id': pk, 'name': name, 'available': stock, 'requested': self.quantities[pk]}
+            for pk, name, stock in rows
+            if stock < self.quantities[pk]
+        ]
+
+
+def adjust_stock(product_id, delta):
+    """Atomically add delta (positive or negative) to a product's stock"""
+    return Product.objects.filter(pk=product_id).update(
+        stock_quantity=F('stock_quantity') + delta, updated_at=timezone.now()
+    )
+
+
+def decrement_stock(quantities, policy=STOCK_POLICY_ALLOW):
+    """
+    Decrement stock for {product_id: quantity} with one set-based UPDATE.
+
+    The decrement happens in the database (stock = stock - n), so concurrent
+    tills never overwrite each other's changes. With the block policy the
+    UPDATE only matches rows that still have enough stock; if any row is
+    short, InsufficientStock is raised and the caller's transaction must be
+    rolled back before looking at its shortages(). With the warn policy the
+    decrement always happens and the products that went negative are returned.
+    """
+    if not quantities:
+        return []
+
+    whens = [
+        When(pk=product_id, then=F('stock_quantity') - quantity)
+        for product_id, quantity in quantities.items()
+    ]
+    products = Product.objects.filter(pk__in=quantities.keys())
+
+    if policy == STOCK_POLICY_BLOCK:
+        enough = Q()
+        for product_id, quantity in quantities.items():
+            enough |= Q(pk=product_id, stock_quantity__gte=quantity)
+        products = products.filter(enough)
+
+    # updated_at moves too, so terminals syncing the catalog by delta see the new stock
+    updated = products.update(
+        stock_quantity=Case(*whens, output_field=models.IntegerField()), updated_at=timezone.now()
+    )
+
+    if policy == STOCK_POLICY_BLOCK and updated < len(quantities):
+        raise InsufficientStock(quantities)
+
+    if policy == STOCK_POLICY_WARN:
+        return [
+            {'product_id': pk, 'name': name, 'stock': stock}
+            for pk, name, stock in Product.objects.filter(
+                pk__in=quantities.keys(), stock_quantity__lt=0
+            ).values_list('pk', 'name', 'stock_quantity')
+        ]
+
+    return []
@@ -0,0 +1,130 @@
+# pos_app/tasks.py
+"""
+Post-commit dispatch of work that does not need to hold up a response.
+
+defer(func, *args) runs func(*args) on a small in-process thread pool once the
+current transaction commits (immediately when there is none). Tasks are
+referred to by dotted path and take JSON-serializable arguments, so a task
+that keeps failing after its retries is stored as a DeferredTaskFailure and
+can be run again later with the retry_deferred_tasks command.
+
+The pool is bounded: when DEFERRED_TASK_QUEUE_SIZE tasks are already waiting
+the task runs inline instead, which slows the request down rather than
+letting the backlog grow without limit. With DEFERRED_TASKS_SYNC every task
+runs inline, which is what tests want.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 0.5  # seconds, doubled after every failed attempt
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+_pending = set()
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_setting('DEFERRED_TASK_WORKERS', 2),
+                thread_name_prefix='pos-deferred',
+            )
+            _slots = threading.BoundedSemaphore(_setting('DEFERRED_TASK_QUEUE_SIZE', 1000))
+        return _executor, _slots
+
+
+def defer(func, *args):
+    """Run func(*args) after the current transaction commits, off the request path"""
+    name = task_name(func)
+    transaction.on_commit(lambda: submit(name, list(args)))
+
+
+def submit(name, args):
+    if _setting('DEFERRED_TASKS_SYNC', False):
+        run_task(name, args)
+        return
+
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        logger.warning('Deferred task queue is full, running %s inline', name)
+        run_task(name, args)
+        return
+
+    future = executor.submit(_run_in_worker, name, args)
+    with _lock:
+        _pending.add(future)
+
+    def done(f):
+        slots.release()
+        with _lock:
+            _pending.discard(f)
+
+    future.add_done_callback(done)
+
+
+def _run_in_worker(name, args):
+    close_old_connections()
+    try:
+        run_task(name, args)
+    finally:
+        close_old_connections()
+
+
+def attempt_task(name, args, attempts=MAX_ATTEMPTS):
+    """Run a task, retrying with backoff; returns the last error, or None on success"""
+    delay = RETRY_DELAY
+    error = None
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic():
+                import_string(name)(*args)
+            return None
+        except Exception as e:
+            error = e
+            logger.warning('Deferred task %s failed (attempt %d/%d): %s', name, attempt, attempts, e)
+            if attempt < attempts:
+                time.sleep(delay)
+                delay *= 2
+    return error
+
+
+def run_task(name, args):
+    """Run a task with retries and record it as a DeferredTaskFailure if it still fails"""
+    from .models import DeferredTaskFailure
+
+    error = attempt_task(name, args)
+    if error is None:
+        return True
+    try:
+        DeferredTaskFailure.objects.create(task=name, args=args, error=repr(error), attempts=MAX_ATTEMPTS)
+    except Exception:
+        logger.exception('Could not record failure of deferred task %s %r', name, args)
+    return False
+
+
+def flush(timeout=None):
+    """Wait for tasks already handed to the pool to finish"""
+    with _lock:
+        pending = list(_pending)
+    if pending:
+        wait(pending, timeout=timeout)
@@ -1,9 +1,17 @@
 from django import template
 
+from pos_app.images import thumbnail_url
+
 register = template.Library()
 
 @register.filter
 def add_class(field, css_class):
     if hasattr(field, 'as_widget'):
         return field.as_widget(attrs={"class": css_class})
-    return field  # Return the field as is if it's not a form field
\ No newline at end of file
+    return field  # Return the field as is if it's not a form field
+
+@register.filter
+def thumbnail(digest, variant):
+    """URL of a product thumbnail: {{ product.thumbnail_hash|thumbnail:"192.webp" }}"""
+    size, fmt = variant.split('.')
+    return thumbnail_url(digest, int(size), fmt)
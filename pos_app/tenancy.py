@@ -0,0 +1,101 @@
+# pos_app/tenancy.py
+"""
+The business and role a request acts for.
+
+TenantMiddleware puts a Tenant on every request as request.tenant, resolved
+on first use: the business the user owns, or else the one they are an
+active employee of. The resolution is kept in the session, so later
+requests cost one query for the business instead of looking up ownership
+and employment again. business.settings comes from pos_app.business_config.
+
+A cached resolution stays valid while the user still owns the business, or
+for employees, while Business.staff_version is unchanged. Saving or
+deleting an employee and creating or handing over a business bump it (see
+pos_app.signals), which sends everyone affected through a fresh resolution.
+"""
+from django.db.models import F
+
+from . import log
+from .business_config import attach_settings
+from .models import Business, Employee
+
+SESSION_KEY = 'pos_tenant'
+
+
+class Tenant:
+    """business, role and employee (None for owners) of a request; business is None without one"""
+
+    def __init__(self, business=None, role=None, employee_id=None):
+        self.business = business
+        self.role = role
+        self.employee_id = employee_id
+
+    @property
+    def employee(self):
+        if self.employee_id is None:
+            return None
+        if not hasattr(self, '_employee'):
+            self._employee = Employee.objects.filter(pk=self.employee_id).first()
+        return self._employee
+
+
+def resolve(user):
+    """Tenant of a user, looked up without any cache"""
+    if not user.is_authenticated:
+        return Tenant()
+    business = Business.objects.filter(owner=user).first()
+    if business is not None:
+        return Tenant(business, 'owner')
+    employee = Employee.objects.select_related('business').filter(user=user, is_active=True).first()
+    if employee is not None:
+        return Tenant(employee.business, employee.role, employee.pk)
+    return Tenant()
+
+
+def _cached(request, user):
+    entry = request.session.get(SESSION_KEY)
+    if not entry or entry.get('user') != user.pk:
+        return None
+    business = Business.objects.filter(pk=entry['business']).first()
+    if business is None:
+        return None
+    if entry['role'] == 'owner':
+        if business.owner_id != user.pk:
+            return None
+    elif business.staff_version != entry['version']:
+        return None
+    return Tenant(business, entry['role'], entry['employee'])
+
+
+def tenant_for_request(request):
+    """The request's Tenant, from the session when it is still valid"""
+    user = request.user
+    if not user.is_authenticated:
+        return Tenant()
+    session = getattr(request, 'session', None)
+    tenant = _cached(request, user) if session is not None else None
+    if tenant is None:
+        tenant = resolve(user)
+        if session is not None:
+            if tenant.business is None:
+                # Not cached, so setting up a business takes effect at once
+                session.pop(SESSION_KEY, None)
+            else:
+                session[SESSION_KEY] = {
+                    'user': user.pk,
+                    'business': tenant.business.pk,
+                    'employee': tenant.employee_id,
+                    'role': tenant.role,
+                    'version': tenant.business.staff_version,
+                }
+    if tenant.business is not None:
+        attach_settings(tenant.business)
+        log.bind_business(tenant.business.pk)
+    return tenant
+
+
+def bump_staff_version(business_ids):
+    """Make cached tenants of these businesses' employees resolve again"""
+    business_ids = [pk for pk in business_ids if pk is not None]
+    if business_ids:
+        Business.objects.filter(pk__in=business_ids).update(staff_version=F('staff_version') + 1)
@@ -1,3 +1,1154 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import logging
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from django_pos.urls import serve_thumbnail
+
+from . import log, tasks
+from .business_config import clear_config_cache, get_config
+from .catalog import CATALOG_FIELDS, catalog_cache_key, catalog_products, make_cursor, product_rows, stream_catalog, top_sellers
+from .checkout import ingest_sales, write_sales
+from .customers import normalize_phone
+from .db_pool import ConnectionPool, PoolTimeout
+from .images import THUMBNAIL_SIZES, variant_name
+from .middleware import ReplicaPinMiddleware
+from .models import (
+    Business, BusinessSettings, Category, Customer, DeferredTaskFailure, DocumentSequence, Employee, Inventory, PriceChange,
+    Product, ProductPopularity, Sale, VATCategory
+)
+from .pricing import bump_catalog_version
+from .product_io import import_products
+from .repricing import apply_price_change, preview, select_products
+from .routers import PIN_COOKIE, ReplicaRouter, replica_reads, use_replica
+from .scan import clear_scan_cache
+from .search import index_products, search_product_ids
+from .sequences import clear_cached_blocks, next_document_number
+from .stock import adjust_stock
+
+
+@override_settings(DEFERRED_TASKS_SYNC=True)
+class POSTestCase(TestCase):
+    """Shared fixture: one owner, one business and a small VAT-rated catalog"""
+
+    product_count = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='secret')
+        cls.business = Business.objects.create(name='Duka', owner=cls.user)
+        BusinessSettings.objects.create(business=cls.business)
+        cls.vat = VATCategory.objects.create(
+            business=cls.business, name='Standard Rated (A)', code='A', rate=Decimal('16.00')
+        )
+        cls.category = Category.objects.create(business=cls.business, name='General')
+        cls.products = Product.objects.bulk_create([
+            Product(
+                business=cls.business,
+                category=cls.category,
+                vat_category=cls.vat,
+                name=f'Product {i}',
+                sku=f'SKU{i:04d}',
+                purchase_price=Decimal('50.00'),
+                selling_price=Decimal('100.00'),
+                stock_quantity=100,
+            )
+            for i in range(cls.product_count)
+        ])
+        index_products(Product.objects.filter(business=cls.business))
+
+    def setUp(self):
+        # Every test runs inside TestCase's own transaction; only blocks opened
+        # by the test count as a transaction for document numbering, and the
+        # blocks cleared here keep numbers from leaking between tests
+        outer = len(connection.atomic_blocks)
+        patcher = mock.patch('pos_app.sequences._in_transaction', lambda: len(connection.atomic_blocks) > outer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clear_cached_blocks()
+        clear_scan_cache()
+        clear_config_cache()
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def update_settings(self, **fields):
+        settings = BusinessSettings.objects.get(business=self.business)
+        for name, value in fields.items():
+            setattr(settings, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            settings.save()
+
+    def cart(self, products, quantity=1):
+        items = [
+            {'product_id': p.pk, 'quantity': quantity, 'unit_price': float(p.selling_price)}
+            for p in products
+        ]
+        total = sum(float(p.selling_price) * quantity for p in products)
+        return {
+            'subtotal': total,
+            'tax_amount': 0,
+            'discount_amount': 0,
+            'total_amount': total,
+            'payment_method': 'cash',
+            'items': items,
+        }
+
+    def post_sale(self, payload, run_deferred=True):
+        with self.captureOnCommitCallbacks(execute=run_deferred):
+            return self.client.post(
+                reverse('pos:process_sale'), json.dumps(payload), content_type='application/json'
+            )
+
+
+class ProcessSaleTests(POSTestCase):
+
+    def count_sale_queries(self, products):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_sale(self.cart(products))
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_constant_in_basket_size(self):
+        self.post_sale(self.cart(self.products[:1]))  # reserve an invoice number block
+        single = self.count_sale_queries(self.products[:1])
+        full = self.count_sale_queries(self.products)
+        self.assertEqual(single, full)
+
+    def test_query_count_is_pinned(self):
+        # session, user, business with its settings (request.tenant),
+        # savepoint, sale, items, stock update, release
+        self.post_sale(self.cart(self.products[:1]))  # reserve invoice numbers, cache the rate table
+        with self.assertNumQueries(8):
+            self.post_sale(self.cart(self.products), run_deferred=False)
+
+    def test_sale_writes_items_ledger_and_stock(self):
+        response = self.post_sale(self.cart(self.products[:3], quantity=2))
+        sale = Sale.objects.get(pk=response.json()['sale_id'])
+
+        self.assertEqual(sale.items.count(), 3)
+        item = sale.items.first()
+        self.assertEqual(item.subtotal, Decimal('200.00'))
+        self.assertEqual(item.vat_amount, Decimal('13.79'))  # 16% contained in 100.00
+        self.assertEqual(
+            Inventory.objects.filter(reference=sale.invoice_number, quantity=-2).count(), 3
+        )
+        for product in self.products[:3]:
+            product.refresh_from_db()
+            self.assertEqual(product.stock_quantity, 98)
+
+    def test_unknown_product_rolls_back(self):
+        payload = self.cart(self.products[:2])
+        payload['items'].append({'product_id': 999999, 'quantity': 1, 'unit_price': 10})
+        response = self.post_sale(payload)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.exists())
+
+
+class IdempotentSaleTests(POSTestCase):
+
+    def test_replayed_key_returns_original_sale(self):
+        payload = self.cart(self.products[:2])
+        payload['idempotency_key'] = 'till-1-0001'
+
+        first = self.post_sale(payload).json()
+        second = self.post_sale(payload).json()
+
+        self.assertEqual(first['sale_id'], second['sale_id'])
+        self.assertEqual(first['invoice_number'], second['invoice_number'])
+        self.assertTrue(second['replayed'])
+        self.assertEqual(Sale.objects.count(), 1)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 99)
+
+    def test_header_key_is_accepted(self):
+        payload = self.cart(self.products[:1])
+        for _ in range(2):
+            self.client.post(
+                reverse('pos:process_sale'), json.dumps(payload),
+                content_type='application/json', HTTP_IDEMPOTENCY_KEY='till-1-0002'
+            )
+        self.assertEqual(Sale.objects.count(), 1)
+
+
+class SaleBatchTests(POSTestCase):
+
+    def post_batch(self, sales):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('pos:process_sale_batch'), json.dumps({'sales': sales}),
+                content_type='application/json'
+            )
+
+    def test_batch_reports_per_sale_results(self):
+        good = self.cart(self.products[:2])
+        good['idempotency_key'] = 'offline-1'
+        good['created_at'] = '2026-01-05T10:15:00+03:00'
+        bad = self.cart(self.products[:1])
+        bad['items'][0]['product_id'] = 999999
+
+        response = self.post_batch([good, bad, self.cart(self.products[2:5])])
+        body = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['accepted'], 2)
+        self.assertEqual([r['success'] for r in body['results']], [True, False, True])
+        sale = Sale.objects.get(pk=body['results'][0]['sale_id'])
+        self.assertEqual(sale.created_at.year, 2026)
+        self.assertEqual(sale.created_at.month, 1)
+
+    def test_batch_replays_known_keys(self):
+        sale = self.cart(self.products[:1])
+        sale['idempotency_key'] = 'offline-2'
+        first = self.post_batch([sale]).json()['results'][0]
+        again = self.post_batch([sale]).json()['results'][0]
+
+        self.assertEqual(first['sale_id'], again['sale_id'])
+        self.assertTrue(again['replayed'])
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_batch_query_count_does_not_scale_with_sales(self):
+        sales = [self.cart(self.products[i:i + 3]) for i in range(11)]
+        self.post_batch(sales[:1])  # reserve an invoice number block
+        with CaptureQueriesContext(connection) as one:
+            self.post_batch(sales[:1])
+        with CaptureQueriesContext(connection) as ten:
+            self.post_batch(sales[1:])
+        # Only the per-sale INSERT grows with the batch; post-commit work is per batch
+        self.assertEqual(len(ten.captured_queries) - len(one.captured_queries), 9)
+
+    def test_batch_loyalty_points_are_checked_against_what_is_left(self):
+        self.update_settings(enable_customer_loyalty=True)
+        customer = Customer.objects.create(
+            business=self.business, first_name='Amina', last_name='Hassan', loyalty_points=Decimal('20')
+        )
+        sales = [self.cart(self.products[:1]) for _ in range(3)]
+        for sale in sales:
+            sale.update(customer_id=customer.pk, loyalty_points_used=8)
+
+        results = self.post_batch(sales).json()['results']
+
+        self.assertEqual([r['success'] for r in results], [True, True, False])
+        self.assertIn('only 4.00 loyalty points', results[2]['error'])
+
+    def test_failed_chunk_is_reported_not_raised(self):
+        sales = [self.cart(self.products[i:i + 1]) for i in range(2)]
+        calls = []
+
+        def flaky_write(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError('lost connection')
+            return write_sales(*args)
+
+        with mock.patch('pos_app.checkout.write_sales', flaky_write), self.captureOnCommitCallbacks(execute=True):
+            results = ingest_sales(self.business, self.user, None, sales, chunk_size=1)
+
+        self.assertEqual([r['success'] for r in results], [False, True])
+        self.assertIn('lost connection', results[0]['error'])
+        self.assertEqual(Sale.objects.count(), 1)
+
+
+class StockPolicyTests(POSTestCase):
+
+    def set_policy(self, policy):
+        self.update_settings(stock_policy=policy)
+
+    def test_block_policy_rejects_oversell(self):
+        response = self.post_sale(self.cart(self.products[:2], quantity=101))
+
+        self.assertEqual(response.status_code, 409)
+        shortages = response.json()['insufficient_stock']
+        self.assertEqual([s['available'] for s in shortages], [100, 100])
+        self.assertFalse(Sale.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 100)
+
+    def test_warn_policy_allows_negative_stock(self):
+        self.set_policy('warn')
+        response = self.post_sale(self.cart(self.products[:1], quantity=105))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock_warnings'][0]['stock'], -5)
+
+    def test_inventory_save_adjusts_stock_in_place(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(stock_quantity=90)
+        Inventory.objects.create(
+            product=product, business=self.business, transaction_type='purchase', quantity=10
+        )
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 100)
+
+
+class DocumentSequenceTests(POSTestCase):
+
+    def test_invoice_numbers_increase_per_business(self):
+        numbers = [self.post_sale(self.cart(self.products[:1])).json()['invoice_number'] for _ in range(3)]
+
+        self.assertEqual(numbers, [f'INV-{self.business.pk}-{n:06d}' for n in (1, 2, 3)])
+
+    def test_block_is_reserved_once(self):
+        next_document_number(self.business.pk, 'CN')
+        with self.assertNumQueries(0):
+            next_document_number(self.business.pk, 'CN')
+        self.assertEqual(
+            DocumentSequence.objects.get(business=self.business, prefix='CN').next_value,
+            1 + settings.DOCUMENT_SEQUENCE_BLOCK_SIZE,
+        )
+
+    def test_allocation_inside_transaction_is_not_cached(self):
+        with transaction.atomic():
+            first = next_document_number(self.business.pk, 'DP')
+        second = next_document_number(self.business.pk, 'DP')
+
+        self.assertEqual(first, f'DP-{self.business.pk}-000001')
+        self.assertEqual(second, f'DP-{self.business.pk}-000002')
+
+
+class PricingTests(POSTestCase):
+
+    def test_inclusive_prices_split_out_vat(self):
+        body = self.post_sale(self.cart(self.products[:2], quantity=3)).json()
+
+        self.assertEqual(body['total_amount'], '600.00')
+        self.assertEqual(body['tax_amount'], '82.74')
+        self.assertEqual(body['subtotal'], '517.26')
+
+    def test_exclusive_prices_add_vat_with_rounding(self):
+        self.update_settings(vat_inclusive_pricing=False, vat_rounding='floor')
+        Product.objects.filter(pk=self.products[0].pk).update(selling_price=Decimal('9.99'))
+        bump_catalog_version(self.business.pk)
+        payload = self.cart(self.products[:1])
+        payload['total_amount'] = 11.58
+
+        body = self.post_sale(payload).json()
+
+        # 16% of 9.99 is 1.5984, floored to 1.59
+        self.assertEqual(body['tax_amount'], '1.59')
+        self.assertEqual(body['total_amount'], '11.58')
+
+    def test_till_total_for_exclusive_prices_matches(self):
+        self.update_settings(vat_inclusive_pricing=False)
+        Product.objects.filter(pk=self.products[0].pk).update(selling_price=Decimal('12.35'))
+        bump_catalog_version(self.business.pk)
+        payload = self.cart(self.products[:1], quantity=5)
+        # What the till sends: 16% of 12.35 is 1.976, 1.98 a unit, 9.90 for five
+        payload['total_amount'] = 71.65
+
+        response = self.post_sale(payload)
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['tax_amount'], '9.90')
+
+    def test_till_total_without_vat_matches(self):
+        self.update_settings(enable_vat=False)
+        payload = self.cart(self.products[:2], quantity=3)
+        payload['total_amount'] = 600.00
+
+        response = self.post_sale(payload)
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['tax_amount'], '0.00')
+
+    def test_catalog_rates_of_exempt_products_are_zero(self):
+        self.vat.vat_type = 'exempt'
+        self.vat.save()
+        row = next(product_rows(Product.objects.filter(pk=self.products[0].pk)))
+        self.assertEqual(row[CATALOG_FIELDS.index('vat_rate')], 0)
+
+    def test_loyalty_points_used_are_validated(self):
+        self.update_settings(enable_customer_loyalty=True)
+        customer = Customer.objects.create(
+            business=self.business, first_name='Amina', last_name='Hassan', loyalty_points=Decimal('20')
+        )
+        for points, status in (('lots', 400), (-5, 400), (50, 400), (10, 200)):
+            payload = self.cart(self.products[:1])
+            payload.update(customer_id=customer.pk, loyalty_points_used=points, idempotency_key=f'points-{points}')
+            response = self.post_sale(payload)
+            self.assertEqual(response.status_code, status, response.content)
+        self.assertEqual(Sale.objects.get(customer=customer).loyalty_points_used, Decimal('10'))
+
+    def test_stale_terminal_total_is_rejected(self):
+        payload = self.cart(self.products[:1])
+        self.post_sale(payload)  # cache the rate table
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.selling_price = Decimal('120.00')
+        product.save()
+
+        response = self.post_sale(payload)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['totals']['total_amount'], '120.00')
+
+
+class DeferredTaskTests(POSTestCase):
+
+    def test_ledger_is_written_after_commit(self):
+        response = self.post_sale(self.cart(self.products[:2]), run_deferred=False)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Inventory.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_quantity, 99)
+
+    def test_credit_sales_update_debt_in_the_sale_transaction(self):
+        customer = Customer.objects.create(
+            business=self.business, first_name='Amina', last_name='Hassan', credit_limit=Decimal('150.00')
+        )
+        payload = self.cart(self.products[:1])
+        payload.update(payment_method='credit', customer_id=customer.pk)
+
+        response = self.post_sale(payload, run_deferred=False)
+        self.assertEqual(response.status_code, 200, response.content)
+        customer.refresh_from_db()
+        self.assertEqual(customer.current_debt, Decimal('100.00'))
+
+        # The next credit sale sees that debt and goes over the limit
+        payload['idempotency_key'] = 'second-sale'
+        response = self.post_sale(payload, run_deferred=False)
+        self.assertTrue(response.json().get('credit_limit_exceeded'))
+
+    def test_failed_task_is_recorded(self):
+        with mock.patch('pos_app.tasks.RETRY_DELAY', 0):
+            ok = tasks.run_task('pos_app.checkout.apply_customer_balances', [[[1, 'not-a-number', '0']]])
+
+        self.assertFalse(ok)
+        failure = DeferredTaskFailure.objects.get()
+        self.assertEqual(failure.task, 'pos_app.checkout.apply_customer_balances')
+        self.assertEqual(failure.attempts, tasks.MAX_ATTEMPTS)
+
+
+class StructuredLoggingTests(POSTestCase):
+
+    def test_response_carries_request_id(self):
+        response = self.client.get(reverse('pos:pos'), HTTP_X_REQUEST_ID='till-7-abc')
+        self.assertEqual(response['X-Request-ID'], 'till-7-abc')
+
+    def test_json_formatter_includes_context_and_extra(self):
+        context, token = log.start_request('req-1')
+        log.bind_business(42)
+        try:
+            record = logging.LogRecord('pos_app.views', logging.INFO, __file__, 1, 'sale placed', (), None)
+            record.sale_id = 7
+            log.ContextFilter().filter(record)
+        finally:
+            log.end_request(token)
+
+        entry = json.loads(log.JSONFormatter().format(record))
+        self.assertEqual(entry['request_id'], 'req-1')
+        self.assertEqual(entry['business_id'], 42)
+        self.assertEqual(entry['sale_id'], 7)
+        self.assertIn('elapsed_ms', entry)
+
+    def test_trace_is_kept_only_for_sampled_requests(self):
+        record = logging.LogRecord('pos_app.trace', logging.DEBUG, __file__, 1, 'sale priced', (), None)
+        sampler = log.TraceSampler()
+        for rate, kept in ((0.0, False), (1.0, True)):
+            context, token = log.start_request(sample_rate=rate)
+            try:
+                self.assertEqual(sampler.filter(record), kept)
+            finally:
+                log.end_request(token)
+
+
+class WireFormatTests(POSTestCase):
+
+    def compact_sale(self, products):
+        return {
+            'k': 'till-3-0001',
+            'p': 'cash',
+            't': 100 * len(products),
+            'i': [[p.pk, 1] for p in products],
+        }
+
+    def test_compact_gzipped_sale(self):
+        body = gzip.compress(json.dumps(self.compact_sale(self.products[:3])).encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('pos:process_sale'), body, content_type='application/json',
+                HTTP_CONTENT_ENCODING='gzip', HTTP_X_POS_ENCODING='compact'
+            )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        sale = Sale.objects.get(pk=response.json()['sale_id'])
+        self.assertEqual(sale.items.count(), 3)
+        self.assertEqual(sale.submissions.get().key, 'till-3-0001')
+
+    def test_malformed_gzip_is_rejected(self):
+        response = self.client.post(
+            reverse('pos:process_sale'), b'not gzip', content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_compact_products_are_columnar_and_compressed(self):
+        response = self.client.get(
+            reverse('pos:api_products'), HTTP_X_POS_ENCODING='compact', HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(response.getvalue()))
+        self.assertEqual(len(body['rows']), self.product_count)
+        self.assertEqual(body['rows'][0][body['fields'].index('id')], self.products[0].pk)
+
+
+class CatalogSyncTests(POSTestCase):
+
+    def sync(self, since, **headers):
+        response = self.client.get(reverse('pos:api_products'), {'since': since}, **headers)
+        return json.loads(response.getvalue()) if response.status_code == 200 else response
+
+    def test_delta_returns_changes_since_cursor(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        Product.objects.filter(business=self.business).update(updated_at=an_hour_ago)
+        cursor = make_cursor(timezone.now() - timedelta(minutes=10))
+
+        changed = Product.objects.get(pk=self.products[0].pk)
+        changed.selling_price = Decimal('120.00')
+        changed.save()
+        Product.objects.get(pk=self.products[1].pk).delete()
+        hidden = Product.objects.get(pk=self.products[2].pk)
+        hidden.is_active = False
+        hidden.save()
+
+        body = self.sync(cursor)
+
+        self.assertFalse(body['full'])
+        self.assertEqual([p['id'] for p in body['products']], [changed.pk])
+        self.assertEqual(body['products'][0]['price'], 120.0)
+        self.assertCountEqual(body['removed'], [self.products[1].pk, hidden.pk])
+        self.assertEqual(self.sync(body['cursor'])['removed'], body['removed'])  # overlap window
+
+    def test_zero_cursor_is_a_full_download(self):
+        body = self.sync('0', HTTP_X_POS_ENCODING='compact')
+
+        self.assertTrue(body['full'])
+        self.assertEqual(len(body['products']['rows']), self.product_count)
+        self.assertEqual(self.sync('garbage').status_code, 400)
+
+    def test_unchanged_catalog_is_not_modified(self):
+        first = self.client.get(reverse('pos:api_products'))
+        again = self.client.get(reverse('pos:api_products'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        self.post_sale(self.cart(self.products[:1]))
+        changed = self.client.get(reverse('pos:api_products'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+
+    def test_gzip_clients_revalidate(self):
+        first = self.client.get(reverse('pos:api_products'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(first['ETag'].startswith('W/'))
+        again = self.client.get(
+            reverse('pos:api_products'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(again.status_code, 304)
+
+class CatalogStreamTests(POSTestCase):
+
+    def get_products(self, **headers):
+        response = self.client.get(reverse('pos:api_products'), **headers)
+        self.assertTrue(response.streaming)
+        return json.loads(response.getvalue())
+
+    def test_catalog_is_read_in_one_query(self):
+        self.get_products()  # warm the session and business lookups
+        Product.objects.create(
+            business=self.business, name='No category', purchase_price=1, selling_price=Decimal('2.50')
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            products = self.get_products()
+        catalog_queries = [q for q in ctx.captured_queries if 'pos_app_product' in q['sql'] and 'COUNT' not in q['sql']]
+        self.assertEqual(len(catalog_queries), 1)
+
+        self.assertEqual(len(products), self.product_count + 1)
+        self.assertEqual(products[0]['category_name'], 'General')
+        self.assertEqual(products[0]['vat_rate'], '16.00')
+        self.assertEqual(products[-1]['category_name'], 'Uncategorized')
+        self.assertEqual(products[-1]['vat_rate'], 0)
+        self.assertEqual(products[-1]['price'], 2.5)
+
+    def test_long_catalogs_are_chunked(self):
+        with mock.patch('pos_app.wire.STREAM_CHUNK_SIZE', 7):
+            chunks = list(stream_catalog(product_rows(catalog_products(self.business)), 10, compact=True))
+        body = json.loads(''.join(chunks))
+        self.assertEqual(len(body['rows']), self.product_count)
+        self.assertGreater(len(chunks), self.product_count // 7)
+
+
+class CatalogCacheTests(POSTestCase):
+
+    def get_products(self):
+        return json.loads(self.client.get(reverse('pos:api_products')).getvalue())
+
+    def test_catalog_is_served_from_cache(self):
+        self.get_products()
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_products()
+        self.assertFalse([q for q in ctx.captured_queries if 'pos_app_product"."name' in q['sql']])
+
+    def test_sales_refresh_cached_stock(self):
+        self.get_products()
+        version = Business.objects.get(pk=self.business.pk).catalog_version
+
+        self.post_sale(self.cart(self.products[:1], quantity=4))
+
+        self.assertEqual(Business.objects.get(pk=self.business.pk).catalog_version, version)
+        self.assertEqual(self.get_products()[0]['stock_quantity'], 96)
+        # Only the small stock map was reloaded; the cached rows were left alone
+        rows = cache.get(catalog_cache_key(self.business.pk, version))
+        self.assertEqual(rows[self.products[0].pk][CATALOG_FIELDS.index('stock_quantity')], 100)
+
+    def test_product_edits_refresh_cached_stock(self):
+        self.get_products()
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.stock_quantity = 7
+        product.save()
+        self.assertEqual(self.get_products()[0]['stock_quantity'], 7)
+
+    def test_catalog_changes_invalidate_cache(self):
+        self.get_products()
+        self.category.name = 'Groceries'
+        self.category.save()
+        self.assertEqual(self.get_products()[0]['category_name'], 'Groceries')
+
+
+class ScanTests(POSTestCase):
+
+    def scan(self, code):
+        return self.client.get(reverse('pos:api_scan'), {'code': code}).json()
+
+    def test_exact_barcode_and_sku(self):
+        Product.objects.filter(pk=self.products[3].pk).update(barcode='5012345678900')
+
+        self.assertEqual(self.scan('5012345678900')['product']['id'], self.products[3].pk)
+        self.assertEqual(self.scan(' SKU0004 ')['product']['id'], self.products[4].pk)
+
+    def test_repeat_scans_skip_the_database(self):
+        self.scan('SKU0001')
+        with CaptureQueriesContext(connection) as ctx:
+            body = self.scan('SKU0001')
+        self.assertTrue(body['found'])
+        self.assertFalse([q for q in ctx.captured_queries if 'pos_app_product' in q['sql']])
+
+    def test_miss_falls_back_to_search(self):
+        body = self.scan('Product 2')
+
+        self.assertFalse(body['found'])
+        self.assertIn(self.products[2].pk, [p['id'] for p in body['matches']])
+
+
+class ProductSearchTests(POSTestCase):
+
+    def make(self, name, sku=None, barcode=None):
+        return Product.objects.create(
+            business=self.business, name=name, sku=sku, barcode=barcode,
+            purchase_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+        )
+
+    def test_ranks_exact_code_then_prefix_then_substring(self):
+        inside = self.make('Fresh Milk 500ml')
+        prefix = self.make('Milk Powder')
+        code = self.make('Yoghurt', sku='MILK')
+
+        ids = search_product_ids(self.business, 'milk')
+
+        self.assertEqual(ids[:3], [code.pk, prefix.pk, inside.pk])
+
+    def test_short_and_accented_queries(self):
+        cafe = self.make('Café-Latte Sachets')
+
+        self.assertIn(cafe.pk, search_product_ids(self.business, 'la'))
+        self.assertIn(cafe.pk, search_product_ids(self.business, 'cafe latte'))
+        self.assertNotIn(cafe.pk, search_product_ids(self.business, 'ettal'))
+
+    def test_index_follows_renames(self):
+        product = self.make('Sugar 1kg')
+        product.name = 'Salt 1kg'
+        product.save()
+
+        self.assertEqual(search_product_ids(self.business, 'sugar'), [])
+        self.assertEqual(search_product_ids(self.business, 'salt'), [product.pk])
+
+    def test_product_list_search(self):
+        response = self.client.get(reverse('pos:product_list'), {'search': 'product 7'})
+
+        self.assertEqual([p.pk for p in response.context['products']], [self.products[7].pk])
+
+
+class CustomerLookupTests(POSTestCase):
+
+    def make(self, first_name, last_name, phone=None):
+        return Customer.objects.create(business=self.business, first_name=first_name, last_name=last_name, phone=phone)
+
+    def lookup(self, q):
+        response = self.client.get(reverse('pos:api_customer_lookup'), {'q': q})
+        return [c['id'] for c in response.json()['customers']]
+
+    def test_phone_formats_share_one_key(self):
+        for phone in ('0712 345 678', '+254712345678', '254-712-345678', '712345678'):
+            self.assertEqual(normalize_phone(phone), '254712345678')
+        self.assertEqual(normalize_phone('+44 20 7946 0958'), '442079460958')
+
+    def test_prefix_lookup_by_phone_and_name(self):
+        wanjiku = self.make('Grace', 'Wanjiku', '0712 345 678')
+        otieno = self.make('Brian', 'Otieno', '+254 733 000 111')
+
+        self.assertEqual(self.lookup('0712'), [wanjiku.pk])
+        self.assertEqual(self.lookup('+2547'), [otieno.pk, wanjiku.pk])
+        self.assertEqual(self.lookup('gra'), [wanjiku.pk])
+        self.assertEqual(self.lookup('otieno b'), [otieno.pk])
+        self.assertEqual(self.lookup(''), [])
+
+    def test_long_international_numbers_fit_the_key(self):
+        phone = '0' + '7' * 19  # a full 20 character phone field, trunk prefixed
+        customer = self.make('Grace', 'Wanjiku', phone)
+
+        customer.refresh_from_db()
+        self.assertLessEqual(len(customer.phone_key), Customer._meta.get_field('phone_key').max_length)
+        self.assertEqual(normalize_phone(phone, code='99999'), '99999' + '7' * 19)
+        self.assertEqual(self.lookup(phone), [customer.pk])
+
+    def test_keys_follow_edits(self):
+        customer = self.make('Grace', 'Wanjiku', '0712345678')
+        customer.phone = '0799 111 222'
+        customer.save(update_fields=['phone'])
+
+        self.assertEqual(self.lookup('0799'), [customer.pk])
+        self.assertEqual(self.lookup('0712'), [])
+
+
+class PopularityTests(POSTestCase):
+
+    def test_sales_add_to_popularity(self):
+        self.post_sale(self.cart(self.products[:2], quantity=3))
+        self.post_sale(self.cart(self.products[1:2], quantity=2))
+
+        sold = dict(ProductPopularity.objects.values_list('product_id', 'quantity_sold'))
+        self.assertEqual(sold, {self.products[0].pk: 3, self.products[1].pk: 5})
+        self.assertEqual(top_sellers(self.business)[:2], [self.products[1].pk, self.products[0].pk])
+
+    def test_pos_screen_does_not_scan_sale_history(self):
+        self.post_sale(self.cart(self.products[:1]))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('pos:pos'))
+
+        self.assertEqual(response.context['most_purchased'][0]['id'], self.products[0].pk)
+        self.assertFalse([q for q in ctx.captured_queries if 'pos_app_saleitem' in q['sql']])
+        self.assertNotIn('customers', response.context)
+
+    def test_customer_lookup_pages(self):
+        for i in range(12):
+            Customer.objects.create(business=self.business, first_name='Amina', last_name=f'Hassan {i:02d}')
+
+        url = reverse('pos:api_customer_lookup')
+        first = self.client.get(url, {'q': 'amina'}).json()
+        second = self.client.get(url, {'q': 'amina', 'page': 2}).json()
+
+        self.assertEqual((len(first['customers']), first['has_more']), (10, True))
+        self.assertEqual((len(second['customers']), second['has_more']), (2, False))
+
+
+class ThumbnailTests(POSTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, product, fmt='PNG', size=(640, 480)):
+        buffer = io.BytesIO()
+        Image.new('RGBA' if fmt == 'PNG' else 'RGB', size, (200, 40, 40)).save(buffer, fmt)
+        product.image = SimpleUploadedFile(f'photo.{fmt.lower()}', buffer.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        return product
+
+    def test_upload_makes_variants(self):
+        product = self.upload(self.products[0])
+
+        self.assertEqual(product.thumbnail_source, product.image.name)
+        for size in THUMBNAIL_SIZES:
+            for fmt in ('webp', 'jpg'):
+                with default_storage.open(variant_name(product.thumbnail_hash, size, fmt)) as f:
+                    self.assertEqual(Image.open(f).size, (size, size))
+
+    def test_catalog_exposes_thumbnails(self):
+        product = self.upload(self.products[0], fmt='JPEG')
+        entry = next(p for p in json.loads(self.client.get(reverse('pos:api_products')).getvalue())
+                     if p['id'] == product.pk)
+
+        self.assertTrue(entry['thumbnail_webp'].endswith(f'{product.thumbnail_hash}-96.webp'))
+        self.assertTrue(entry['thumbnail'].endswith(f'{product.thumbnail_hash}-96.jpg'))
+        path = entry['thumbnail_webp'].removeprefix(settings.MEDIA_URL)
+        response = serve_thumbnail(RequestFactory().get(entry['thumbnail_webp']), path)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_unreadable_image_is_not_retried(self):
+        product = self.products[0]
+        product.image = SimpleUploadedFile('broken.jpg', b'not an image')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+
+        self.assertEqual((product.thumbnail_hash, product.thumbnail_source), ('', product.image.name))
+        self.assertFalse(DeferredTaskFailure.objects.exists())
+
+    def test_oversized_image_is_not_retried(self):
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            product = self.upload(self.products[0])
+
+        self.assertEqual((product.thumbnail_hash, product.thumbnail_source), ('', product.image.name))
+        self.assertFalse(DeferredTaskFailure.objects.exists())
+
+    def test_backfill_counts_removed_images_as_cleared(self):
+        product = self.upload(self.products[0])
+        Product.objects.filter(pk=product.pk).update(image='')
+        out = io.StringIO()
+
+        call_command('generate_thumbnails', stdout=out)
+
+        self.assertIn('cleared 1, 0 failed', out.getvalue())
+
+    def test_backfill_bumps_the_catalog_once(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 200), (40, 200, 40)).save(buffer, 'JPEG')
+        name = default_storage.save('product_images/backfill.jpg', io.BytesIO(buffer.getvalue()))
+        Product.objects.filter(pk__in=[p.pk for p in self.products[:3]]).update(image=name)
+
+        with mock.patch('pos_app.management.commands.generate_thumbnails.bump_catalog_version') as bump, \
+                mock.patch('pos_app.images.bump_catalog_version') as bump_each:
+            call_command('generate_thumbnails', stdout=io.StringIO())
+
+        bump.assert_called_once_with(self.business.pk)
+        bump_each.assert_not_called()
+        self.assertEqual(Product.objects.exclude(thumbnail_hash='').count(), 3)
+
+class ProductImportTests(POSTestCase):
+
+    def run_import(self, text, fmt='csv', **kwargs):
+        return import_products(self.business, io.BytesIO(text.encode()), fmt, user=self.user, **kwargs)
+
+    def test_upserts_by_sku(self):
+        result = self.run_import(
+            'sku,name,category,vat_code,selling_price,stock_quantity\n'
+            'SKU0000,Product 0,General,A,120.00,100\n'       # price change
+            'SKU0001,Product 1,General,A,100.00,100\n'       # unchanged
+            'NEW1,Unga 2kg,Flour,a,180,12\n'                 # new, in a new category
+            'NEW2,,General,A,10,1\n'                         # new without a name
+            'SKU0002,Product 2,General,Z,100,100\n',         # unknown VAT code
+            chunk_size=2,
+        )
+
+        self.assertEqual((result.created, result.updated, result.unchanged, result.failed), (1, 1, 1, 2))
+        self.assertEqual([line for line, _ in result.errors], [5, 6])
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).selling_price, Decimal('120.00'))
+        new = Product.objects.get(business=self.business, sku='NEW1')
+        self.assertEqual((new.category.name, new.vat_category, new.stock_quantity), ('Flour', self.vat, 12))
+        self.assertEqual(list(new.inventory_records.values_list('quantity', flat=True)), [12])
+        self.assertEqual(search_product_ids(self.business, 'unga'), [new.pk])
+
+    def test_partial_rows_keep_other_columns(self):
+        self.run_import('{"sku": "SKU0003", "stock_quantity": 40}\n', fmt='jsonl')
+
+        product = Product.objects.get(pk=self.products[3].pk)
+        self.assertEqual((product.name, product.selling_price, product.stock_quantity), ('Product 3', Decimal('100.00'), 40))
+        self.assertEqual(list(product.inventory_records.values_list('quantity', flat=True)), [-60])
+
+    def test_out_of_range_values_are_row_errors(self):
+        result = self.run_import(
+            'sku,name,selling_price,stock_quantity\n'
+            'N1,A,NaN,1\n'
+            'N2,B,100000000,1\n'
+            'N3,C,10,Infinity\n'
+            'N4,D,10,1e30\n'
+            'N5,E,10,5\n'
+        )
+
+        self.assertEqual((result.created, result.failed), (1, 4))
+        self.assertEqual([line for line, _ in result.errors], [2, 3, 4, 5])
+
+    def test_stock_is_adjusted_not_overwritten(self):
+        product = self.products[3]
+
+        def sell_meanwhile(importer, parsed, existing):
+            # A sale that commits after the importer read the product
+            adjust_stock(product.pk, -5)
+
+        with mock.patch('pos_app.product_io.ProductImporter.check_barcodes', sell_meanwhile):
+            self.run_import('sku,stock_quantity\nSKU0003,40\n')
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock_quantity, 35)
+        self.assertEqual(list(product.inventory_records.values_list('quantity', flat=True)), [-60])
+
+    def test_import_invalidates_catalog(self):
+        self.client.get(reverse('pos:api_products'))
+        self.run_import('sku,selling_price\nSKU0000,150\n')
+
+        products = json.loads(self.client.get(reverse('pos:api_products')).getvalue())
+        self.assertEqual(products[0]['price'], 150.0)
+
+    def test_export_imports_unchanged(self):
+        response = self.client.get(reverse('pos:product_export'))
+        exported = b''.join(response.streaming_content).decode()
+
+        self.assertEqual(exported.splitlines()[1], 'SKU0000,Product 0,,,General,A,pcs,50.00,100.00,100,True')
+        result = self.run_import(exported)
+        self.assertEqual((result.unchanged, result.updated, result.created), (self.product_count, 0, 0))
+
+    def test_upload_endpoint(self):
+        upload = SimpleUploadedFile('products.csv', b'sku,name,selling_price\nNEW1,Soap,55\n')
+        response = self.client.post(reverse('pos:product_import'), {'file': upload}, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.json()['created'], 1)
+
+
+class BulkPriceChangeTests(POSTestCase):
+
+    def prices(self):
+        return set(Product.objects.filter(business=self.business).values_list('selling_price', flat=True))
+
+    def test_preview_matches_applied_prices(self):
+        products = select_products(self.business, category=self.category)
+        planned = preview(products, 'percent', Decimal('7.5'), Decimal('5'))
+
+        self.assertEqual(planned['count'], self.product_count)
+        self.assertEqual(planned['changes'][0][4], Decimal('110.00'))  # 107.50 rounded to a multiple of 5
+        self.assertEqual(self.prices(), {Decimal('100.00')})
+
+        with CaptureQueriesContext(connection) as ctx:
+            batch = apply_price_change(self.business, products, 'percent', Decimal('7.5'), Decimal('5'), user=self.user)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "pos_app_product"')]), 1)
+        self.assertEqual(self.prices(), {Decimal('110.00')})
+        self.assertEqual(batch.product_count, self.product_count)
+        self.assertEqual(set(PriceChange.objects.values_list('old_price', 'new_price')), {(Decimal('100.00'), Decimal('110.00'))})
+
+    def test_margin_and_search_selection(self):
+        products = select_products(self.business, query='SKU0001')
+        apply_price_change(self.business, products, 'margin', Decimal('60'))
+
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).selling_price, Decimal('125.00'))
+        self.assertEqual(Product.objects.get(pk=self.products[2].pk).selling_price, Decimal('100.00'))
+
+    def test_broad_search_selects_every_match(self):
+        with mock.patch('pos_app.search.MAX_CANDIDATES', 5):
+            products = select_products(self.business, query='product')
+            self.assertEqual(preview(products, 'delta', Decimal('1'))['count'], self.product_count)
+
+    def test_view_previews_then_applies(self):
+        url = reverse('pos:bulk_price_change')
+        form = {'category': self.category.pk, 'rule': 'delta', 'value': '-15', 'round_to': '0.01'}
+        version = Business.objects.get(pk=self.business.pk).catalog_version
+
+        response = self.client.post(url, dict(form, action='preview'))
+        self.assertEqual(response.context['preview']['count'], self.product_count)
+        self.assertEqual(self.prices(), {Decimal('100.00')})
+
+        self.client.post(url, dict(form, action='apply'))
+        self.assertEqual(self.prices(), {Decimal('85.00')})
+        self.assertGreater(Business.objects.get(pk=self.business.pk).catalog_version, version)
+
+    def test_selection_is_required(self):
+        response = self.client.post(reverse('pos:bulk_price_change'), {'rule': 'percent', 'value': '10', 'round_to': '1'})
+        self.assertTrue(response.context['form'].non_field_errors())
+
+
+class TenantTests(POSTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cashier = User.objects.create_user(username='cashier', password='secret')
+        self.employee = Employee.objects.create(user=self.cashier, business=self.business, role='cashier')
+        self.client.force_login(self.cashier)
+
+    def lookup(self):
+        return self.client.get(reverse('pos:api_customer_lookup'), {'q': 'amina'})
+
+    def test_employees_resolve_to_their_business(self):
+        self.assertEqual(self.lookup().status_code, 200)
+
+    def test_resolution_is_cached_in_the_session(self):
+        self.lookup()
+        with CaptureQueriesContext(connection) as ctx:
+            self.lookup()
+        self.assertFalse([q for q in ctx.captured_queries if 'pos_app_employee' in q['sql']])
+
+    def test_deactivated_employee_loses_access(self):
+        self.lookup()
+        self.employee.is_active = False
+        self.employee.save()
+        self.assertEqual(self.lookup().status_code, 404)
+
+    def test_role_changes_apply_to_cached_sessions(self):
+        url = reverse('pos:bulk_price_change')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.employee.role = 'manager'
+        self.employee.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class BusinessConfigTests(POSTestCase):
+
+    def config_queries(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        return [q for q in ctx.captured_queries if 'businesssettings' in q['sql'] or 'vatcategory' in q['sql']]
+
+    def test_repeat_reads_do_not_query(self):
+        get_config(self.business)
+        self.assertEqual(self.config_queries(lambda: get_config(self.business)), [])
+
+    def test_saving_settings_reloads_the_config(self):
+        self.assertEqual(get_config(self.business).stock_policy, 'block')
+        self.update_settings(stock_policy='allow')
+        self.assertEqual(get_config(self.business).stock_policy, 'allow')
+
+    def test_vat_is_worked_out_without_queries(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        get_config(self.business)
+        amounts = []
+        self.assertEqual(self.config_queries(lambda: amounts.append(product.calculate_vat_amount())), [])
+        self.assertEqual(amounts, [Decimal('16.00')])
+
+    def test_vat_category_changes_reach_products(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        self.assertEqual(product.vat_rate, Decimal('16.00'))
+        self.vat.rate = Decimal('8.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vat.save()
+        self.assertEqual(product.vat_rate, Decimal('8.00'))
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise OSError('gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def make_pool(self, **options):
+        return ConnectionPool(**{'max_size': 2, 'timeout': 0.05, 'stats_interval': 0, **options})
+
+    def test_connections_are_reused(self):
+        pool = self.make_pool()
+        first = pool.checkout(FakeConnection)
+        pool.checkin(first)
+        self.assertIs(pool.checkout(FakeConnection), first)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+
+    def test_checkout_waits_then_times_out(self):
+        pool = self.make_pool()
+        pool.checkout(FakeConnection)
+        pool.checkout(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_waiting_checkout_gets_a_returned_connection(self):
+        pool = self.make_pool(max_size=1, timeout=5)
+        held = pool.checkout(FakeConnection)
+        timer = threading.Timer(0.05, pool.checkin, [held])
+        timer.start()
+        self.assertIs(pool.checkout(FakeConnection), held)
+        timer.join()
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_old_dead_and_discarded_connections_are_closed(self):
+        pool = self.make_pool()
+        dead = pool.checkout(FakeConnection)
+        broken = pool.checkout(FakeConnection)
+        pool.checkin(dead)
+        pool.checkin(broken, discard=True)
+        dead.alive = False
+        fresh = pool.checkout(FakeConnection)
+        self.assertNotIn(fresh, (dead, broken))
+        self.assertTrue(dead.closed and broken.closed)
+        self.assertEqual(pool.stats()['discarded'], 2)
+
+        pool.recycle = 0
+        pool.checkin(fresh)
+        self.assertTrue(fresh.closed)
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+
+@mock.patch('pos_app.routers.replica_configured', return_value=True)
+class ReplicaRoutingTests(SimpleTestCase):
+
+    router = ReplicaRouter()
+
+    def view(self, request):
+        response = HttpResponse()
+        response.db = self.router.db_for_read(Product)
+        return response
+
+    def test_only_pos_reads_in_replica_views_go_to_the_replica(self, configured):
+        self.assertIsNone(self.router.db_for_read(Product))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_recent_writers_are_pinned_to_the_primary(self, configured):
+        factory = RequestFactory()
+        view = use_replica(self.view)
+        self.assertEqual(view(factory.get('/')).db, 'replica')
+        self.assertIsNone(view(factory.post('/')).db)
+
+        response = ReplicaPinMiddleware(lambda request: HttpResponse())(factory.post('/'))
+        request = factory.get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.assertIsNone(view(request).db)
+
+    def test_streamed_content_is_read_from_the_replica(self, configured):
+        def stream(request):
+            return StreamingHttpResponse(self.router.db_for_read(Product) for _ in range(2))
+        self.assertEqual(b''.join(use_replica(stream)(RequestFactory().get('/'))), b'replicareplica')
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+class PurgeSessionsTests(TestCase):
+
+    def test_only_expired_sessions_are_deleted(self):
+        now = timezone.now()
+        for i in range(3):
+            Session.objects.create(session_key=f'old{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + timedelta(days=1))
+        call_command('purge_sessions', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
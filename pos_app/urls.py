@@ -21,10 +21,13 @@ urlpatterns = [
     # POS
     path('sale/', views.pos, name='pos'),
     path('process-sale/', views.process_sale, name='process_sale'),
+    path('process-sale/batch/', views.process_sale_batch, name='process_sale_batch'),
     path('receipt/<int:sale_id>/', views.get_receipt, name='get_receipt'),
     
     # API endpoints
     path('api/products/', views.api_products, name='api_products'),
+    path('api/scan/', views.api_scan, name='api_scan'),
+    path('api/customers/lookup/', views.api_customer_lookup, name='api_customer_lookup'),
     path('api/customer/<int:customer_id>/', views.api_customer, name='api_customer'),
     
     # Products
@@ -32,6 +35,9 @@ urlpatterns = [
     path('products/create/', views.product_create, name='product_create'),
     path('products/<int:pk>/edit/', views.product_edit, name='product_edit'),
     path('products/<int:pk>/delete/', views.product_delete, name='product_delete'),
+    path('products/import/', views.product_import, name='product_import'),
+    path('products/export/', views.product_export, name='product_export'),
+    path('products/reprice/', views.bulk_price_change, name='bulk_price_change'),
     
     # Categories
     path('categories/', views.category_list, name='category_list'),
@@ -8,7 +8,8 @@ from django.db.models import Sum, Count, F, ExpressionWrapper, DecimalField, Q,
 from decimal import Decimal
 from django.db.models.functions import TruncDay, TruncMonth
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
 from datetime import datetime, timedelta
@@ -21,43 +22,37 @@ from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
+import logging
 
+from . import catalog, log, product_io, repricing, scan, search, tenancy, wire
+from .customers import LOOKUP_LIMIT, find_customers
 from .forms import (
     UserRegistrationForm, BusinessForm, BusinessSettingsForm, CategoryForm,
     ProductForm, CustomerForm, EmployeeForm, SaleForm, SaleItemForm,
-    InventoryForm, SupplierForm, PurchaseForm, PurchaseItemForm, ExpenseForm
+    InventoryForm, SupplierForm, PurchaseForm, PurchaseItemForm, ExpenseForm,
+    BulkPriceChangeForm
 )
 from .models import (
-    Business, BusinessSettings, Category, Product, Customer,
+    BusinessSettings, Category, Product, Customer,
     Employee, Sale, SaleItem, Inventory, Supplier, Purchase,
-    PurchaseItem, Expense, VATCategory, DebtPayment
+    PurchaseItem, Expense, VATCategory, DebtPayment, PriceChangeBatch
+)
+from .checkout import (
+    MAX_BATCH_SIZE, CheckoutError, DuplicateSubmission, PriceMismatch, find_submitted_sale,
+    get_idempotency_key, ingest_sales, place_sale, price_sale, validate_sale_payload
 )
+from .routers import use_replica
+from .stock import InsufficientStock
+
+logger = logging.getLogger(__name__)
+
+# Product list searches show at most this many (ranked) matches
+PRODUCT_SEARCH_LIMIT = 200
 
 # Helper functions
 def get_business_for_user(user):
-    """Get the business for the current user (owner or employee)"""
-    try:
-        # If user is a business owner
-        return Business.objects.filter(owner=user).first()
-    except:
-        # If user is an employee
-        try:
-            employee = Employee.objects.filter(user=user, is_active=True).first()
-            if employee:
-                return employee.business
-        except:
-            pass
-    return None
-
-def get_user_role(user, business):
-    """Get the role of the user in the business"""
-    if business and business.owner == user:
-        return 'owner'
-    try:
-        employee = Employee.objects.get(user=user, business=business, is_active=True)
-        return employee.role
-    except Employee.DoesNotExist:
-        return None
+    """Get the business for the current user (owner or employee); views use request.tenant instead"""
+    return tenancy.resolve(user).business
 
 def calculate_actual_customer_debt(customer):
     """Calculate the actual outstanding debt for a customer based on sales and payments"""
@@ -124,7 +119,7 @@ def login_view(request):
 @login_required
 def business_setup(request):
     # Check if the user already has a business
-    existing_business = get_business_for_user(request.user)
+    existing_business = request.tenant.business
     if existing_business:
         return redirect('dashboard')
     
@@ -148,8 +143,7 @@ def business_setup(request):
             messages.success(request, "Your business has been set up successfully!")
             return redirect('pos:dashboard')
         else:
-            # Log form errors for debugging
-            print(form.errors)  # Optional: Remove in production
+            logger.debug('business form invalid', extra={'fields': list(form.errors)})
             
             messages.error(request, "There were errors in your form. Please correct them and try again.")
     else:
@@ -159,13 +153,14 @@ def business_setup(request):
 
 # Dashboard
 @login_required
+@use_replica
 def dashboard(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -318,45 +313,50 @@ def dashboard(request):
 # POS (Point of Sale)
 @login_required
 def pos(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
     
-    # Get all categories and products
+    # Products come from the cached catalog; the page itself shows the best sellers.
+    # Customers are looked up as the cashier types (api_customer_lookup).
     categories = Category.objects.filter(business=business)
-    products = Product.objects.filter(business=business, is_active=True)
-    customers = Customer.objects.filter(business=business)
+    products = catalog.get_catalog(business)
     
     # Get most purchased products (based on total quantity sold)
-    most_purchased = Product.objects.filter(
-        business=business, 
-        is_active=True,
-        sale_items__isnull=False
-    ).annotate(
-        total_sold=Sum('sale_items__quantity')
-    ).order_by('-total_sold')[:20]  # Top 20 most purchased
+    # (from ProductPopularity; a few extra in case some best sellers were deactivated)
+    most_purchased = [
+        catalog.catalog_entry(products[pk]) for pk in catalog.top_sellers(business, limit=40) if pk in products
+    ][:20]
     
     # If no sales history, show products with highest stock
     if not most_purchased:
-        most_purchased = products.order_by('-stock_quantity')[:20]
+        by_stock = sorted(products.values(), key=lambda row: row[catalog.STOCK], reverse=True)[:20]
+        most_purchased = [catalog.catalog_entry(row) for row in by_stock]
     
     context = {
         'business': business,
         'role': role,
         'categories': categories,
-        'products': products,
-        'customers': customers,
         'most_purchased': most_purchased,
     }
     
     return render(request, 'pos_app/pos.html', context)
 
+def sale_replay_response(sale_id, invoice_number):
+    """Response for a sale that was already recorded under the same idempotency key"""
+    return JsonResponse({
+        'success': True,
+        'invoice_number': invoice_number,
+        'sale_id': sale_id,
+        'replayed': True,
+    })
+
 @csrf_exempt
 def process_sale(request):
     if request.method != 'POST':
@@ -366,195 +366,290 @@ def process_sale(request):
     if not request.user.is_authenticated:
         return JsonResponse({'error': 'Authentication required'}, status=401)
     
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
     try:
-        print(f"DEBUG: Raw request body: {request.body}")
         data = json.loads(request.body)
+        if wire.wants_compact(request):
+            data = wire.expand_sale(data)
     except json.JSONDecodeError as e:
-        print(f"DEBUG: JSON decode error: {e}")
+        logger.info('sale rejected: invalid JSON', extra={'reason': str(e)})
         return JsonResponse({'error': f'Invalid JSON: {str(e)}'}, status=400)
     except Exception as e:
-        print(f"DEBUG: General error parsing request: {e}")
+        logger.info('sale rejected: unreadable request', extra={'reason': str(e)})
         return JsonResponse({'error': f'Request parsing error: {str(e)}'}, status=400)
     
     try:
+        # Check required fields and items, and read the idempotency key
+        try:
+            validate_sale_payload(data)
+            idempotency_key = get_idempotency_key(request, data)
+        except CheckoutError as e:
+            logger.info('sale rejected: invalid payload', extra={'reason': str(e)})
+            return JsonResponse({'error': str(e)}, status=400)
         
-        # Debug: Log what we received
-        print(f"DEBUG: Received POST data: {data}")
-        print(f"DEBUG: User authenticated: {request.user.is_authenticated}")
-        print(f"DEBUG: User: {request.user}")
-        
-        # Debug: Check required fields
-        required_fields = ['subtotal', 'tax_amount', 'discount_amount', 'total_amount', 'payment_method', 'items']
-        for field in required_fields:
-            if field not in data:
-                print(f"DEBUG: Missing required field: {field}")
-                return JsonResponse({'error': f'Missing required field: {field}'}, status=400)
+        # Counts and amounts only: payloads carry customer data
+        log.trace.debug('sale received', extra={
+            'user_id': request.user.pk,
+            'items': len(data['items']),
+            'payment_method': data['payment_method'],
+            'has_customer': bool(data.get('customer_id')),
+            'has_idempotency_key': bool(idempotency_key),
+        })
         
-        # Validate items
-        if not data['items'] or len(data['items']) == 0:
-            return JsonResponse({'error': 'No items in cart'}, status=400)
+        # A resent sale returns the original result without doing any work again
+        submitted = find_submitted_sale(business, idempotency_key)
+        if submitted:
+            log.trace.debug('sale replayed', extra={'sale_id': submitted[0]})
+            return sale_replay_response(*submitted)
         
         # Get or create customer
         customer = None
         if data.get('customer_id'):
             customer = Customer.objects.get(id=data['customer_id'], business=business)
         
-        # Get employee
-        employee = None
+        # Get employee (owners sell without an employee record)
+        employee = request.tenant.employee
+        if employee is None and business.owner_id != request.user.id:
+            return JsonResponse({'error': 'Employee not found'}, status=404)
+        
+        # Price the cart on the server; the terminal's totals are only a cross-check
         try:
-            employee = Employee.objects.get(user=request.user, business=business)
-        except Employee.DoesNotExist:
-            # If the user is the business owner, we'll proceed without an employee record
-            if business.owner != request.user:
-                return JsonResponse({'error': 'Employee not found'}, status=404)
+            prepared = price_sale(business, employee, customer, data, idempotency_key)
+        except PriceMismatch as e:
+            logger.info('sale rejected: price mismatch', extra={'total_amount': e.cart.total_amount})
+            return JsonResponse({
+                'error': str(e),
+                'price_mismatch': True,
+                'totals': e.cart.as_dict(),
+            }, status=409)
+        except CheckoutError as e:
+            logger.info('sale rejected: %s', e)
+            return JsonResponse({'error': str(e)}, status=400)
+        log.trace.debug('sale priced', extra={
+            'subtotal': prepared.sale.subtotal,
+            'tax_amount': prepared.sale.tax_amount,
+            'total_amount': prepared.sale.total_amount,
+        })
         
         # Handle credit sales
         if data['payment_method'] == 'credit':
-            print(f"DEBUG: Processing credit sale")
             if not customer:
-                print(f"DEBUG: No customer found for credit sale")
+                logger.info('sale rejected: credit sale without customer')
                 return JsonResponse({'error': 'Customer required for credit sales'}, status=400)
             
-            print(f"DEBUG: Customer found: {customer.full_name}")
             # Check credit limit
-            total_amount = Decimal(str(data['total_amount']))
-            print(f"DEBUG: Total amount: {total_amount}, Current debt: {customer.current_debt}, Credit limit: {customer.credit_limit}")
-            
+            total_amount = prepared.sale.total_amount
             if customer.current_debt + total_amount > customer.credit_limit:
                 exceeded = (customer.current_debt + total_amount) - customer.credit_limit
-                print(f"DEBUG: Credit limit exceeded by {exceeded}")
                 # Allow override if explicitly confirmed by frontend
                 if not data.get('credit_override_confirmed', False):
+                    logger.info('sale rejected: credit limit exceeded', extra={
+                        'customer_id': customer.pk, 'exceeded': exceeded,
+                    })
                     return JsonResponse({
                         'error': f'Credit limit exceeded by {exceeded}',
                         'credit_limit_exceeded': True
                     }, status=400)
-                
-        print(f"DEBUG: About to create sale object")
-        
-        # Create sale
-        try:
-            sale = Sale(
-                business=business,
-                customer=customer,
-                employee=employee,
-                subtotal=data['subtotal'],
-                tax_amount=data['tax_amount'],
-                discount_amount=data['discount_amount'],
-                total_amount=data['total_amount'],
-                payment_method=data['payment_method'],
-                payment_reference=data.get('payment_reference', ''),
-                notes=data.get('notes', ''),
-                status='completed' if data['payment_method'] != 'credit' else 'completed'  # All sales are completed
-            )
-            print(f"DEBUG: Sale object created successfully")
-        except Exception as e:
-            print(f"DEBUG: Error creating sale object: {e}")
-            return JsonResponse({'error': f'Error creating sale: {str(e)}'}, status=400)
-        
-        # Calculate loyalty points if enabled
-        if business.settings.enable_customer_loyalty and customer:
-            points_earned = data['total_amount'] * business.settings.points_per_purchase
-            sale.loyalty_points_earned = points_earned
-            sale.loyalty_points_used = data.get('loyalty_points_used', 0)
-            
-            # Update customer loyalty points
-            customer.loyalty_points += points_earned - sale.loyalty_points_used
-            customer.save()
+                logger.info('credit limit override', extra={'customer_id': customer.pk, 'exceeded': exceeded})
         
         try:
-            print(f"DEBUG: About to save sale")
-            sale.save()
-            print(f"DEBUG: Sale saved successfully with ID: {sale.id}")
-        except Exception as e:
-            print(f"DEBUG: Error saving sale: {e}")
-            return JsonResponse({'error': f'Error saving sale: {str(e)}'}, status=400)
-        
-        # Handle credit debt tracking
-        if data['payment_method'] == 'credit' and customer:
-            customer.current_debt += Decimal(str(data['total_amount']))
-            customer.save()
-            
-            # Create debt payment record (showing the new debt)
-            from .models import DebtPayment
-            # Note: DebtPayment model handles debt differently - we don't create a record for debt increase
-            # The customer.current_debt is updated directly above
-        
-        # Create sale items
-        print(f"DEBUG: About to create {len(data['items'])} sale items")
-        for item_data in data['items']:
-            try:
-                print(f"DEBUG: Creating sale item for product {item_data['product_id']}")
-                product = Product.objects.get(id=item_data['product_id'], business=business)
-                quantity = item_data['quantity']
-                unit_price = item_data['unit_price']
-                
-                SaleItem.objects.create(
-                    sale=sale,
-                    product=product,
-                    quantity=quantity,
-                    unit_price=unit_price,
-                    subtotal=quantity * unit_price
-                )
-                
-                # Update inventory
-                Inventory.objects.create(
-                    product=product,
-                    transaction_type='sale',
-                    quantity=-quantity,
-                    reference=sale.invoice_number,
-                    business=business,
-                    created_by=request.user
-                )
-                print(f"DEBUG: Sale item created successfully for product {product.name}")
-            except Exception as e:
-                print(f"DEBUG: Error creating sale item for product {item_data['product_id']}: {e}")
-                return JsonResponse({'error': f'Error creating sale item: {str(e)}'}, status=400)
+            sale, stock_warnings = place_sale(business, request.user, prepared)
+        except DuplicateSubmission as e:
+            log.trace.debug('sale replayed', extra={'sale_id': e.sale_id})
+            return sale_replay_response(e.sale_id, e.invoice_number)
+        except InsufficientStock as e:
+            logger.info('sale rejected: insufficient stock')
+            return JsonResponse({
+                'error': 'Insufficient stock',
+                'insufficient_stock': e.shortages(),
+            }, status=409)
         
-        return JsonResponse({
+        response = {
             'success': True,
             'invoice_number': sale.invoice_number,
-            'sale_id': sale.id
-        })
+            'sale_id': sale.id,
+            'subtotal': str(sale.subtotal),
+            'tax_amount': str(sale.tax_amount),
+            'total_amount': str(sale.total_amount),
+        }
+        if stock_warnings:
+            logger.warning('sale took stock negative', extra={
+                'sale_id': sale.id, 'product_ids': [w['product_id'] for w in stock_warnings],
+            })
+            response['stock_warnings'] = stock_warnings
+        log.trace.debug('sale placed', extra={'sale_id': sale.id, 'invoice_number': sale.invoice_number})
+        return JsonResponse(response)
+    
+    except Exception as e:
+        logger.exception('sale failed')
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+def process_sale_batch(request):
+    """Record a queue of sales uploaded by a terminal that was offline"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+    
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    business = request.tenant.business
+    if not business:
+        return JsonResponse({'error': 'No business found'}, status=404)
     
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        return JsonResponse({'error': f'Invalid JSON: {str(e)}'}, status=400)
+    
+    sales = data.get('sales') if isinstance(data, dict) else data
+    if not isinstance(sales, list) or not sales:
+        return JsonResponse({'error': 'Expected a non-empty "sales" array'}, status=400)
+    if len(sales) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} sales per batch'}, status=400)
+    if wire.wants_compact(request):
+        sales = [wire.expand_sale(sale) for sale in sales]
+    
+    # Resolved once for the whole batch
+    employee = request.tenant.employee
+    if employee is None and business.owner_id != request.user.id:
+        return JsonResponse({'error': 'Employee not found'}, status=404)
+    
+    try:
+        results = ingest_sales(business, request.user, employee, sales)
     except Exception as e:
+        logger.exception('sale batch failed', extra={'sales': len(sales)})
         return JsonResponse({'error': str(e)}, status=500)
+    
+    accepted = sum(1 for result in results if result['success'])
+    logger.info('sale batch ingested', extra={'accepted': accepted, 'rejected': len(results) - accepted})
+    return JsonResponse({
+        'success': True,
+        'accepted': accepted,
+        'rejected': len(results) - accepted,
+        'results': results,
+    })
 
 @login_required
 def api_products(request):
-    """API endpoint to get all products for POS search functionality"""
-    business = get_business_for_user(request.user)
+    """
+    API endpoint to get products for POS search functionality.
+
+    Without parameters this is the full list of active products, with an ETag.
+    With ?since=<cursor> it is a sync envelope holding the products changed
+    and the ids removed since the cursor, plus the cursor for the next call;
+    since=0, or a cursor older than the kept tombstones, returns everything
+    with "full": true.
+    """
+    business = request.tenant.business
+    if not business:
+        return JsonResponse({'error': 'No business found'}, status=404)
+
+    compact = wire.wants_compact(request)
+    envelope = 'since' in request.GET
+    since = None
+    if envelope:
+        try:
+            since = catalog.parse_cursor(request.GET['since'])
+        except (ValueError, OverflowError, OSError):
+            return JsonResponse({'error': 'Invalid since cursor'}, status=400)
+
+    full = catalog.needs_full_sync(since)
+    etag = None
+    if full:
+        etag = catalog.catalog_etag(business, variant=('-c' if compact else '') + ('-e' if envelope else ''))
+        if catalog.etag_matches(request, etag):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            patch_vary_headers(response, [wire.ENCODING_HEADER])
+            return response
+
+    level = catalog.reorder_level(business)
+    envelope_data = None
+    if full:
+        rows, removed = catalog.get_catalog(business).values(), []
+    else:
+        changed, removed = catalog.catalog_changes(business, since)
+        rows = catalog.product_rows(changed)
+    if envelope:
+        envelope_data = {
+            'cursor': catalog.make_cursor(timezone.now()),
+            'full': full,
+            'reorder_level': level,
+            'removed': removed,
+        }
+
+    response = StreamingHttpResponse(
+        catalog.stream_catalog(rows, level, compact=compact, envelope=envelope_data),
+        content_type='application/json',
+    )
+    if etag:
+        response['ETag'] = etag
+    patch_vary_headers(response, [wire.ENCODING_HEADER])
+    return response
+
+@login_required
+def api_scan(request):
+    """Exact barcode/SKU lookup for scanners, falling back to a search when nothing matches"""
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
-    products = Product.objects.filter(business=business, is_active=True)
+    code = request.GET.get('code', '').strip()
+    if not code:
+        return JsonResponse({'error': 'code is required'}, status=400)
     
-    products_data = []
-    for product in products:
-        products_data.append({
-            'id': product.id,
-            'name': product.name,
-            'sku': product.sku or '',
-            'barcode': product.barcode or '',
-            'description': product.description or '',
-            'category_name': product.category.name if product.category else 'Uncategorized',
-            'vat_rate': product.vat_category.rate if product.vat_category else 0,
-            'price': float(product.selling_price),
-            'stock_quantity': product.stock_quantity,
-            'is_active': product.is_active,
-            'reorder_level': business.settings.low_stock_threshold if hasattr(business, 'settings') else 10,
-        })
+    level = catalog.reorder_level(business)
+    product = scan.lookup_code(business, code)
+    if product:
+        # The entry is shared through the worker's cache, so copy it
+        return JsonResponse({'found': True, 'product': dict(product, reorder_level=level)})
+    
+    matches = catalog.search_catalog(business, code)
+    return JsonResponse({'found': False, 'matches': [dict(match, reorder_level=level) for match in matches]})
+
+@login_required
+def api_customer_lookup(request):
+    """Customers whose phone or name starts with ?q=, a page (?page=) at a time, for the checkout picker"""
+    business = request.tenant.business
+    if not business:
+        return JsonResponse({'error': 'No business found'}, status=404)
     
-    return JsonResponse(products_data, safe=False)
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page'}, status=400)
+    
+    found = find_customers(Customer.objects.filter(business=business), request.GET.get('q', ''))
+    start = (page - 1) * LOOKUP_LIMIT
+    # One row more than a page tells whether there is a next one
+    rows = list(found.values_list(
+        'id', 'first_name', 'last_name', 'phone', 'current_debt', 'credit_limit', 'loyalty_points'
+    )[start:start + LOOKUP_LIMIT + 1])
+    return JsonResponse({
+        'customers': [
+            {
+                'id': pk,
+                'full_name': f'{first_name} {last_name}',
+                'phone': phone or '',
+                'current_debt': float(debt),
+                'credit_limit': float(limit),
+                'available_credit': float(limit - debt),
+                'loyalty_points': float(points),
+            }
+            for pk, first_name, last_name, phone, debt, limit, points in rows[:LOOKUP_LIMIT]
+        ],
+        'page': page,
+        'has_more': len(rows) > LOOKUP_LIMIT,
+    })
 
 @login_required
 def api_customer(request, customer_id):
     """API endpoint to get customer details for credit limit checking"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
@@ -591,7 +686,7 @@ def api_customer(request, customer_id):
 
 @login_required
 def get_receipt(request, sale_id):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
@@ -609,12 +704,12 @@ def get_receipt(request, sale_id):
 # Products
 @login_required
 def product_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -627,14 +722,11 @@ def product_list(request):
     if category_id:
         products_list = products_list.filter(category_id=category_id)
     
-    # Search by name or SKU if provided
+    # Search by name, SKU or barcode if provided, best matches first
     search_query = request.GET.get('search')
     if search_query:
-        products_list = products_list.filter(
-            models.Q(name__icontains=search_query) | 
-            models.Q(sku__icontains=search_query) |
-            models.Q(barcode__icontains=search_query)
-        )
+        matches = search.search_product_ids(business, search_query, products_list, limit=PRODUCT_SEARCH_LIMIT)
+        products_list = search.in_rank_order(products_list, matches)
     
     paginator = Paginator(products_list, 10)  # Show 10 products per page
     page_number = request.GET.get('page')
@@ -656,12 +748,12 @@ def product_list(request):
 
 @login_required
 def product_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to create products')
         return redirect('pos:product_list')
@@ -700,12 +792,12 @@ def product_create(request):
 
 @login_required
 def product_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to edit products')
         return redirect('pos:product_list')
@@ -748,12 +840,12 @@ def product_edit(request, pk):
 
 @login_required
 def product_delete(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete products')
         return redirect('pos:product_list')
@@ -775,15 +867,133 @@ def product_delete(request, pk):
     
     return render(request, 'pos_app/product_confirm_delete.html', context)
 
+@login_required
+def product_import(request):
+    """
+    Upsert products from an uploaded CSV or JSON lines file, by SKU.
+
+    Answers with JSON for API clients (Accept: application/json), otherwise
+    goes back to the product list with a summary message.
+    """
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+    business = request.tenant.business
+    if not business:
+        if wants_json:
+            return JsonResponse({'error': 'No business found'}, status=404)
+        return redirect('pos:business_setup')
+    
+    role = request.tenant.role
+    if role not in ['owner', 'admin', 'manager', 'inventory']:
+        if wants_json:
+            return JsonResponse({'error': 'You do not have permission to import products'}, status=403)
+        messages.error(request, 'You do not have permission to import products')
+        return redirect('pos:product_list')
+    
+    upload = request.FILES.get('file')
+    if request.method != 'POST' or upload is None:
+        if wants_json:
+            return JsonResponse({'error': 'POST a file to import'}, status=400)
+        messages.error(request, 'Choose a CSV or JSON lines file to import')
+        return redirect('pos:product_list')
+    
+    fmt = request.POST.get('format') or product_io.detect_format(upload.name)
+    if fmt not in product_io.FORMATS:
+        return JsonResponse({'error': f'Unknown format {fmt}'}, status=400)
+    try:
+        result = product_io.import_products(business, upload, fmt, user=request.user)
+    except (UnicodeDecodeError, csv.Error) as exc:
+        if wants_json:
+            return JsonResponse({'error': f'Cannot read the file: {exc}'}, status=400)
+        messages.error(request, f'Cannot read the file: {exc}')
+        return redirect('pos:product_list')
+    
+    logger.info('products imported', extra={
+        'products_created': result.created, 'products_updated': result.updated, 'rows_failed': result.failed,
+    })
+    if wants_json:
+        return JsonResponse(result.as_dict())
+    
+    messages.success(request, f'Imported products: {result.created} created, {result.updated} updated, '
+                              f'{result.unchanged} unchanged')
+    if result.failed:
+        lines = ', '.join(str(line) for line, _ in result.errors[:10])
+        messages.warning(request, f'{result.failed} rows were skipped (lines {lines}{"..." if result.failed > 10 else ""}). '
+                                  f'First problem: {result.errors[0][1]}')
+    return redirect('pos:product_list')
+
+@login_required
+@use_replica
+def product_export(request):
+    """All products of the business as CSV (default) or ?format=jsonl, streamed"""
+    business = request.tenant.business
+    if not business:
+        return redirect('pos:business_setup')
+    
+    role = request.tenant.role
+    if role not in ['owner', 'admin', 'manager', 'inventory']:
+        messages.error(request, 'You do not have permission to export products')
+        return redirect('pos:product_list')
+    
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in product_io.FORMATS:
+        return JsonResponse({'error': f'Unknown format {fmt}'}, status=400)
+    content_type = 'application/x-ndjson' if fmt == 'jsonl' else 'text/csv'
+    response = StreamingHttpResponse(product_io.stream_export(business, fmt), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="products_{timezone.now().date()}.{fmt}"'
+    return response
+
+@login_required
+def bulk_price_change(request):
+    """Reprice a selection of products at once: preview the new prices, then apply them"""
+    business = request.tenant.business
+    if not business:
+        return redirect('pos:business_setup')
+    
+    role = request.tenant.role
+    if role not in ['owner', 'admin', 'manager']:
+        messages.error(request, 'You do not have permission to change prices')
+        return redirect('pos:product_list')
+    
+    preview = None
+    if request.method == 'POST':
+        form = BulkPriceChangeForm(request.POST, business=business)
+        if form.is_valid():
+            data = form.cleaned_data
+            products = repricing.select_products(
+                business, data['category'], data['vat_category'], data['supplier'], data['search'].strip()
+            )
+            round_to = Decimal(data['round_to'])
+            if request.POST.get('action') == 'apply':
+                batch = repricing.apply_price_change(
+                    business, products, data['rule'], data['value'], round_to,
+                    user=request.user, selection=form.selection(),
+                )
+                logger.info('bulk price change', extra={'batch_id': batch.pk, 'product_count': batch.product_count})
+                messages.success(request, f'Changed the price of {batch.product_count} products')
+                return redirect('pos:product_list')
+            preview = repricing.preview(products, data['rule'], data['value'], round_to)
+    else:
+        form = BulkPriceChangeForm(business=business)
+    
+    context = {
+        'business': business,
+        'role': role,
+        'form': form,
+        'preview': preview,
+        'recent_batches': PriceChangeBatch.objects.filter(business=business).select_related('created_by')[:10],
+    }
+    
+    return render(request, 'pos_app/bulk_price_change.html', context)
+
 # Categories
 @login_required
 def category_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -801,12 +1011,12 @@ def category_list(request):
 
 @login_required
 def category_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to create categories')
         return redirect('pos:category_list')
@@ -833,12 +1043,12 @@ def category_create(request):
 
 @login_required
 def category_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to edit categories')
         return redirect('pos:category_list')
@@ -866,12 +1076,12 @@ def category_edit(request, pk):
 
 @login_required
 def category_delete(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete categories')
         return redirect('pos:category_list')
@@ -900,12 +1110,12 @@ def category_delete(request, pk):
 # Customers
 @login_required
 def customer_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -913,15 +1123,10 @@ def customer_list(request):
     # Get all customers with pagination
     customers_list = Customer.objects.filter(business=business).order_by('first_name', 'last_name')
     
-    # Search by name, email or phone if provided
+    # Search by phone, name or email if provided (prefix match on the lookup keys)
     search_query = request.GET.get('search')
     if search_query:
-        customers_list = customers_list.filter(
-            models.Q(first_name__icontains=search_query) | 
-            models.Q(last_name__icontains=search_query) |
-            models.Q(email__icontains=search_query) |
-            models.Q(phone__icontains=search_query)
-        )
+        customers_list = find_customers(customers_list, search_query)
     
     paginator = Paginator(customers_list, 10)  # Show 10 customers per page
     page_number = request.GET.get('page')
@@ -938,22 +1143,20 @@ def customer_list(request):
 
 @login_required
 def customer_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'cashier']:
         messages.error(request, 'You do not have permission to create customers')
         return redirect('pos:customer_list')
     
     if request.method == 'POST':
         form = CustomerForm(request.POST)
-        print(f"DEBUG: Form data received: {request.POST}")
-        print(f"DEBUG: Form is valid: {form.is_valid()}")
         if not form.is_valid():
-            print(f"DEBUG: Form errors: {form.errors}")
+            logger.debug('customer form invalid', extra={'fields': list(form.errors)})
         if form.is_valid():
             customer = form.save(commit=False)
             customer.business = business
@@ -976,12 +1179,12 @@ def customer_create(request):
 
 @login_required
 def customer_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'cashier']:
         messages.error(request, 'You do not have permission to edit customers')
         return redirect('pos:customer_list')
@@ -990,10 +1193,8 @@ def customer_edit(request, pk):
     
     if request.method == 'POST':
         form = CustomerForm(request.POST, instance=customer)
-        print(f"DEBUG: Edit form data received: {request.POST}")
-        print(f"DEBUG: Edit form is valid: {form.is_valid()}")
         if not form.is_valid():
-            print(f"DEBUG: Edit form errors: {form.errors}")
+            logger.debug('customer edit form invalid', extra={'fields': list(form.errors)})
         if form.is_valid():
             customer = form.save()
             messages.success(request, f'Customer "{customer.full_name}" has been updated')
@@ -1015,12 +1216,12 @@ def customer_edit(request, pk):
 
 @login_required
 def customer_delete(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete customers')
         return redirect('pos:customer_list')
@@ -1049,12 +1250,12 @@ def customer_delete(request, pk):
 # Employees
 @login_required
 def employee_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view employees')
         return redirect('pos:dashboard')
@@ -1072,12 +1273,12 @@ def employee_list(request):
 
 @login_required
 def employee_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to create employees')
         return redirect('pos:employee_list')
@@ -1129,12 +1330,12 @@ def employee_create(request):
 
 @login_required
 def employee_delete(request, employee_id):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
 
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete employees')
         return redirect('pos:employee_list')
@@ -1149,12 +1350,12 @@ def employee_delete(request, employee_id):
 
 @login_required
 def employee_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to edit employees')
         return redirect('pos:employee_list')
@@ -1197,12 +1398,12 @@ def employee_edit(request, pk):
 
 @login_required
 def employee_toggle_status(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to change employee status')
         return redirect('pos:employee_list')
@@ -1220,12 +1421,12 @@ def employee_toggle_status(request, pk):
 # Sales
 @login_required
 def sales_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -1264,10 +1465,10 @@ def sales_list(request):
     # Search by invoice number or customer name if provided
     search_query = request.GET.get('search')
     if search_query:
+        matching_customers = find_customers(Customer.objects.filter(business=business), search_query)
         sales_list = sales_list.filter(
             models.Q(invoice_number__icontains=search_query) | 
-            models.Q(customer__first_name__icontains=search_query) |
-            models.Q(customer__last_name__icontains=search_query)
+            models.Q(customer__in=matching_customers.values('pk'))
         )
     
     # Calculate totals
@@ -1324,12 +1525,12 @@ def sales_list(request):
 
 @login_required
 def sale_detail(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if not role:
         messages.error(request, 'You do not have access to this business')
         return redirect('pos:login')
@@ -1348,12 +1549,12 @@ def sale_detail(request, pk):
 
 @login_required
 def sale_void(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to void sales')
         return redirect('pos:sales_list')
@@ -1399,12 +1600,12 @@ def sale_void(request, pk):
 
 @login_required
 def sale_refund(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to refund sales')
         return redirect('pos:sales_list')
@@ -1494,12 +1695,12 @@ def sale_refund(request, pk):
 # Inventory
 @login_required
 def inventory_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to view inventory')
         return redirect('pos:dashboard')
@@ -1557,12 +1758,12 @@ def inventory_list(request):
 
 @login_required
 def inventory_adjust(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to adjust inventory')
         return redirect('pos:inventory_list')
@@ -1591,12 +1792,12 @@ def inventory_adjust(request):
 # Suppliers
 @login_required
 def supplier_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to view suppliers')
         return redirect('pos:dashboard')
@@ -1614,12 +1815,12 @@ def supplier_list(request):
 
 @login_required
 def supplier_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to create suppliers')
         return redirect('pos:supplier_list')
@@ -1646,12 +1847,12 @@ def supplier_create(request):
 
 @login_required
 def supplier_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to edit suppliers')
         return redirect('pos:supplier_list')
@@ -1679,12 +1880,12 @@ def supplier_edit(request, pk):
 
 @login_required
 def supplier_delete(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete suppliers')
         return redirect('pos:supplier_list')
@@ -1713,12 +1914,12 @@ def supplier_delete(request, pk):
 # Purchases
 @login_required
 def purchase_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to view purchases')
         return redirect('pos:dashboard')
@@ -1778,12 +1979,12 @@ def purchase_list(request):
 
 @login_required
 def purchase_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to create purchases')
         return redirect('pos:purchase_list')
@@ -1799,8 +2000,7 @@ def purchase_create(request):
             # Redirect to add items
             return redirect('pos:purchase_add_items', pk=purchase.pk)
         else:
-            # Log form errors to the terminal
-            print("Purchase Form Errors:", form.errors)  # Display errors in the terminal
+            logger.debug('purchase form invalid', extra={'fields': list(form.errors)})
             messages.error(request, 'Please correct the errors below.')
     else:
         form = PurchaseForm(business=business)
@@ -1817,12 +2017,12 @@ def purchase_create(request):
 
 @login_required
 def purchase_add_items(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to add purchase items')
         return redirect('pos:purchase_list')
@@ -1844,8 +2044,7 @@ def purchase_add_items(request, pk):
             messages.success(request, f'Item "{item.product.name}" has been added to the purchase')
             return redirect('pos:purchase_add_items', pk=purchase.pk)
         else:
-            # Log form errors to the terminal
-            print("Purchase Item Form Errors:", form.errors)  # Display errors in the terminal
+            logger.debug('purchase item form invalid', extra={'fields': list(form.errors)})
             messages.error(request, 'Please correct the errors below.')
     else:
         form = PurchaseItemForm(business=business)
@@ -1867,7 +2066,7 @@ def purchase_add_items(request, pk):
 @login_required
 def purchase_item_edit(request, item_id):
     # Get the business for the logged-in user
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
 
@@ -1881,8 +2080,7 @@ def purchase_item_edit(request, item_id):
             messages.success(request, f'Item "{item.product.name}" has been updated successfully.')
             return redirect('pos:purchase_add_items', pk=item.purchase.pk)
         else:
-            # Log form errors for debugging
-            print("Edit Purchase Item Form Errors:", form.errors)
+            logger.debug('purchase item edit form invalid', extra={'fields': list(form.errors)})
             messages.error(request, 'Please correct the errors below.')
     else:
         form = PurchaseItemForm(instance=item)
@@ -1900,7 +2098,7 @@ def purchase_item_edit(request, item_id):
 @login_required
 def purchase_item_delete(request, item_id):
     # Get the business for the logged-in user
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
 
@@ -1922,12 +2120,12 @@ def purchase_item_delete(request, item_id):
 
 @login_required
 def purchase_detail(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to view purchase details')
         return redirect('pos:dashboard')
@@ -1946,12 +2144,12 @@ def purchase_detail(request, pk):
 
 @login_required
 def purchase_receive(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to receive purchases')
         return redirect('pos:purchase_list')
@@ -2013,12 +2211,12 @@ def purchase_receive(request, pk):
 
 @login_required
 def purchase_cancel(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to cancel purchases')
         return redirect('pos:purchase_list')
@@ -2053,12 +2251,12 @@ def purchase_cancel(request, pk):
 # Expenses
 @login_required
 def expense_list(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view expenses')
         return redirect('pos:dashboard')
@@ -2110,12 +2308,12 @@ def expense_list(request):
 
 @login_required
 def expense_create(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to create expenses')
         return redirect('pos:expense_list')
@@ -2143,12 +2341,12 @@ def expense_create(request):
 
 @login_required
 def expense_edit(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to edit expenses')
         return redirect('pos:expense_list')
@@ -2176,12 +2374,12 @@ def expense_edit(request, pk):
 
 @login_required
 def expense_delete(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete expenses')
         return redirect('pos:expense_list')
@@ -2203,13 +2401,14 @@ def expense_delete(request, pk):
 
 # Reports
 @login_required
+@use_replica
 def reports(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view reports')
         return redirect('pos:dashboard')
@@ -2406,13 +2605,14 @@ def reports(request):
     return render(request, 'pos_app/reports.html', context)
 
 @login_required
+@use_replica
 def export_sales_report(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to export reports')
         return redirect('pos:reports')
@@ -2476,13 +2676,14 @@ def export_sales_report(request):
     return response
 
 @login_required
+@use_replica
 def export_inventory_report(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager', 'inventory']:
         messages.error(request, 'You do not have permission to export reports')
         return redirect('pos:reports')
@@ -2515,20 +2716,15 @@ def export_inventory_report(request):
     
     return response
 
-import logging
-
-# Configure logging
-logger = logging.getLogger(__name__)
-
 # Settings
 @login_required
 def settings_view(request):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
 
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to access settings')
         return redirect('pos:dashboard')
@@ -2565,14 +2761,15 @@ def settings_view(request):
     return render(request, 'pos_app/settings.html', context)
 
 @login_required
+@use_replica
 def vat_report(request):
     """Generate comprehensive VAT report for KRA compliance"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view VAT reports')
         return redirect('pos:dashboard')
@@ -2669,14 +2866,15 @@ def vat_report(request):
     return render(request, 'pos_app/vat_report.html', context)
 
 @login_required
+@use_replica
 def export_vat_report(request):
     """Export VAT report as CSV for KRA submission"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to export VAT reports')
         return redirect('pos:vat_report')
@@ -2803,12 +3001,12 @@ def export_vat_report(request):
 @login_required
 def vat_management(request):
     """VAT category management interface"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to manage VAT settings')
         return redirect('pos:dashboard')
@@ -2829,11 +3027,11 @@ def vat_management(request):
 
 @login_required
 def edit_vat_category(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to edit VAT categories')
         return redirect('pos:vat_management')
@@ -2854,11 +3052,11 @@ def edit_vat_category(request, pk):
 
 @login_required
 def delete_vat_category(request, pk):
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         messages.error(request, 'You do not have permission to delete VAT categories')
         return redirect('pos:vat_management')
@@ -2876,12 +3074,12 @@ def delete_vat_category(request, pk):
 @login_required
 def credit_management(request):
     """Credit and debt management interface"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to manage credit')
         return redirect('pos:dashboard')
@@ -2976,12 +3174,12 @@ def credit_management(request):
 @login_required
 def receive_payment(request):
     """Process debt payment from customer"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
@@ -3095,7 +3293,7 @@ def receive_payment(request):
 @login_required
 def add_vat_category(request):
     """Add new VAT category - handles both form data and JSON data"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         # For form submissions, redirect to business setup
         if request.content_type == 'application/json' or request.META.get('HTTP_ACCEPT', '').startswith('application/json'):
@@ -3104,7 +3302,7 @@ def add_vat_category(request):
             return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin']:
         if request.content_type == 'application/json' or request.META.get('HTTP_ACCEPT', '').startswith('application/json'):
             return JsonResponse({'error': 'Permission denied'}, status=403)
@@ -3228,12 +3426,12 @@ def add_vat_category(request):
 @login_required
 def edit_vat_category(request, pk):
     """Edit existing VAT category"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
@@ -3283,12 +3481,12 @@ def edit_vat_category(request, pk):
 @login_required
 def delete_vat_category(request, pk):
     """Delete VAT category"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return JsonResponse({'error': 'No business found'}, status=404)
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
@@ -3320,14 +3518,15 @@ def delete_vat_category(request, pk):
     return redirect('pos:vat_management')
 
 @login_required
+@use_replica
 def credit_report_overall(request):
     """Comprehensive credit report for all customers with debt"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view credit reports')
         return redirect('pos:dashboard')
@@ -3520,12 +3719,12 @@ def generate_overall_credit_pdf(request, context):
 @login_required
 def credit_report_customer(request, customer_id):
     """Detailed credit report for a specific customer"""
-    business = get_business_for_user(request.user)
+    business = request.tenant.business
     if not business:
         return redirect('pos:business_setup')
     
     # Get user role
-    role = get_user_role(request.user, business)
+    role = request.tenant.role
     if role not in ['owner', 'admin', 'manager']:
         messages.error(request, 'You do not have permission to view credit reports')
         return redirect('pos:dashboard')
@@ -0,0 +1,90 @@
+# pos_app/wire.py
+"""
+Compact wire format for POS terminals on slow links.
+
+A terminal opts in per request with the ``X-POS-Encoding: compact`` header.
+Compact sales use short keys and positional item rows:
+
+    {"k": "<idempotency key>", "p": "cash", "c": 12, "t": "450.00",
+     "i": [[product_id, quantity], [product_id, quantity, unit_price], ...]}
+
+and compact list responses are columnar: {"fields": [...], "rows": [[...], ...]}.
+
+Long lists are streamed with json_array, a chunk of elements at a time, so
+neither the worker's memory nor the time to the first byte grows with them.
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+
+ENCODING_HEADER = 'X-POS-Encoding'
+COMPACT = 'compact'
+
+SALE_KEYS = {
+    'k': 'idempotency_key',
+    'c': 'customer_id',
+    'p': 'payment_method',
+    'r': 'payment_reference',
+    'n': 'notes',
+    't': 'total_amount',
+    'd': 'discount_amount',
+    'a': 'created_at',
+    'l': 'loyalty_points_used',
+    'o': 'credit_override_confirmed',
+    'i': 'items',
+}
+ITEM_FIELDS = ('product_id', 'quantity', 'unit_price')
+
+STREAM_CHUNK_SIZE = 500  # array elements per chunk
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def wants_compact(request):
+    return request.headers.get(ENCODING_HEADER, '').strip().lower() == COMPACT
+
+
+def expand_sale(data):
+    """Turn a compact sale into the regular payload; anything malformed is left for validation"""
+    if not isinstance(data, dict):
+        return data
+    sale = {SALE_KEYS.get(key, key): value for key, value in data.items()}
+    if isinstance(sale.get('items'), list):
+        sale['items'] = [
+            dict(zip(ITEM_FIELDS, row)) if isinstance(row, list) else row
+            for row in sale['items']
+        ]
+    return sale
+
+
+def columnar(fields, records):
+    """Pack a list of dicts into {"fields": [...], "rows": [[...], ...]}"""
+    return {
+        'fields': list(fields),
+        'rows': [[record[field] for field in fields] for record in records],
+    }
+
+
+def json_members(mapping):
+    """The members of a JSON object, without braces, for splicing around a streamed array"""
+    return ','.join(f'{_encoder.encode(str(key))}:{_encoder.encode(value)}' for key, value in mapping.items())
+
+
+def json_array(items, head='[', tail=']', chunk_size=None):
+    """
+    Encode items as a JSON array, yielding chunk_size elements at a time.
+
+    head and tail are written around the elements, so the array can be the
+    last member of an enclosing object (head='{"rows":[', tail=']}').
+    """
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    yield head
+    separator = ''
+    batch = []
+    for item in items:
+        batch.append(_encoder.encode(item))
+        if len(batch) >= chunk_size:
+            yield separator + ','.join(batch)
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(batch)
+    yield tail